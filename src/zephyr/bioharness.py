@@ -1,86 +1,209 @@
-
-import logging
-
-import zephyr.message
-import zephyr.util
-
-
-class BioHarnessSignalAnalysis:
-    def __init__(self, signal_callbacks, event_callbacks):
-        self.signal_callbacks = signal_callbacks
-        self.event_callbacks = event_callbacks
-        
-        self.latest_rr_value_sign = 0
-    
-    def handle_signal(self, signal_packet, starts_new_stream):
-        if signal_packet.type == "rr":
-            
-            for sample_number, rr_value in enumerate(signal_packet.samples):
-                signal_discontinuity = (sample_number == 0) and starts_new_stream
-                
-                rr_value_sign = cmp(rr_value, 0)
-                
-                if rr_value_sign != self.latest_rr_value_sign and not signal_discontinuity:
-                    heartbeat_interval = abs(rr_value)
-                    heartbeat_interval_timestamp = signal_packet.timestamp + sample_number / float(signal_packet.samplerate)
-                    
-                    for event_callback in self.event_callbacks:
-                        event_callback("heartbeat_interval", (heartbeat_interval_timestamp, heartbeat_interval))
-                
-                self.latest_rr_value_sign = rr_value_sign
-
-
-class BioHarnessPacketHandler:
-    def __init__(self, signal_callbacks, event_callbacks, sequence_number_wraparound=256):
-        self.signal_callbacks = signal_callbacks
-        self.event_callbacks = event_callbacks
-        self.sequence_number_wraparound = sequence_number_wraparound
-        
-        self.sequence_numbers = {}
-        self.clock_difference_correction = zephyr.util.ClockDifferenceEstimator()
-    
-    def get_message_end_timestamp(self, signal_packet):
-        temporal_message_length = (len(signal_packet.samples) - 1) / signal_packet.samplerate
-        return signal_packet.timestamp + temporal_message_length
-    
-    def get_expected_sequence_number(self, packet_type):
-        previous_sequence_number = self.sequence_numbers.get(packet_type)
-        if previous_sequence_number is not None:
-            expected_sequence_number = (previous_sequence_number + 1) % self.sequence_number_wraparound
-        else:
-            expected_sequence_number = None
-        
-        return expected_sequence_number
-    
-    def handle_packet(self, packet):
-        if isinstance(packet, zephyr.message.SignalPacket):
-            expected_sequence_number = self.get_expected_sequence_number(packet.type)
-            self.sequence_numbers[packet.type] = packet.sequence_number
-            
-            if expected_sequence_number is not None and expected_sequence_number != packet.sequence_number:
-                logging.warning("Invalid sequence number in stream %s: %d != %d",
-                                packet.type, expected_sequence_number,
-                                packet.sequence_number)
-                
-                starts_new_stream = True
-            else:
-                starts_new_stream = False
-            
-            
-            end_timestamp = self.get_message_end_timestamp(packet)
-            
-            corrected_end_timestamp = self.clock_difference_correction.estimate_and_correct_timestamp(end_timestamp, packet.type)
-            corrected_timestamp = packet.timestamp + corrected_end_timestamp - end_timestamp
-            
-            corrected_signal_packet = packet._replace(timestamp=corrected_timestamp)
-            
-            for signal_callback in self.signal_callbacks:
-                signal_callback(corrected_signal_packet, starts_new_stream)
-        
-        elif isinstance(packet, zephyr.message.SummaryMessage):
-            corrected_timestamp = self.clock_difference_correction.estimate_and_correct_timestamp(packet.timestamp, "bh_summary")
-            
-            for event_callback in self.event_callbacks:
-                event_callback("activity", (corrected_timestamp, packet.activity))
-                event_callback("heart_rate", (corrected_timestamp, packet.heart_rate))
-                event_callback("respiration_rate", (corrected_timestamp, packet.respiration_rate))
+
+import logging
+
+import zephyr.message
+import zephyr.util
+
+
+def generate_heartbeat_intervals(rr_values, latest_rr_value_sign, starts_new_stream):
+    """Generate the (sample index, heartbeat interval) pairs of the
+    heartbeats in RR signal values in a single pass without NumPy"""
+    for sample_number, rr_value in enumerate(rr_values):
+        signal_discontinuity = (sample_number == 0) and starts_new_stream
+        
+        rr_value_sign = cmp(rr_value, 0)
+        
+        if rr_value_sign != latest_rr_value_sign and not signal_discontinuity:
+            yield sample_number, abs(rr_value)
+        
+        latest_rr_value_sign = rr_value_sign
+
+
+def find_heartbeat_intervals(rr_values, latest_rr_value_sign, starts_new_stream):
+    """Find the heartbeats in RR signal values. A heartbeat is detected when
+    the sign of the signal changes, and the absolute value after the change
+    is the heartbeat interval. No heartbeat is detected at the first value if
+    it starts a new stream. Returns the sample indices of the heartbeats, the
+    heartbeat intervals and the sign of the last value."""
+    if zephyr.util.USE_NUMPY:
+        numpy = zephyr.util.numpy
+        rr_values = numpy.asarray(rr_values, dtype=float)
+        
+        if not len(rr_values):
+            return [], [], latest_rr_value_sign
+        
+        rr_value_signs = numpy.sign(rr_values)
+        
+        previous_rr_value_signs = numpy.empty_like(rr_value_signs)
+        previous_rr_value_signs[0] = latest_rr_value_sign
+        previous_rr_value_signs[1:] = rr_value_signs[:-1]
+        
+        sign_changes = rr_value_signs != previous_rr_value_signs
+        if starts_new_stream:
+            sign_changes[0] = False
+        
+        heartbeat_indices = numpy.flatnonzero(sign_changes)
+        heartbeat_intervals = numpy.abs(rr_values[heartbeat_indices])
+        return heartbeat_indices.tolist(), heartbeat_intervals.tolist(), int(rr_value_signs[-1])
+    
+    heartbeat_indices = []
+    heartbeat_intervals = []
+    
+    for sample_number, heartbeat_interval in generate_heartbeat_intervals(rr_values, latest_rr_value_sign,
+                                                                          starts_new_stream):
+        heartbeat_indices.append(sample_number)
+        heartbeat_intervals.append(heartbeat_interval)
+    
+    if len(rr_values):
+        latest_rr_value_sign = cmp(rr_values[-1], 0)
+    
+    return heartbeat_indices, heartbeat_intervals, latest_rr_value_sign
+
+
+def extract_heartbeat_intervals(rr_signal_stream_history):
+    """Find the heartbeats of a stored RR signal history at once, e.g. for
+    offline reprocessing. The heartbeats are the same as those found from
+    the signal packets by BioHarnessSignalAnalysis, and they are timed by the
+    sample timestamps of the history. Returns the heartbeat timestamps and
+    intervals as two lists."""
+    heartbeat_timestamps = []
+    heartbeat_intervals = []
+    latest_rr_value_sign = 0
+    
+    for stream_i, signal_stream in enumerate(rr_signal_stream_history.get_signal_streams()):
+        start_timestamp, rr_values = signal_stream.read_samples()
+        
+        stream_heartbeat_indices, stream_heartbeat_intervals, latest_rr_value_sign = \
+            find_heartbeat_intervals(rr_values, latest_rr_value_sign, stream_i > 0)
+        
+        heartbeat_timestamps.extend(start_timestamp + sample_number / float(signal_stream.samplerate)
+                                    for sample_number in stream_heartbeat_indices)
+        heartbeat_intervals.extend(stream_heartbeat_intervals)
+    
+    return heartbeat_timestamps, heartbeat_intervals
+
+
+class BioHarnessSignalAnalysis:
+    """Detects heartbeats from the RR signal. Event callbacks are called as
+    event_callback("heartbeat_interval", (timestamp, interval)) for each
+    heartbeat, and batch event callbacks as batch_event_callback(
+    "heartbeat_interval", timestamps, intervals) with all the heartbeats of a
+    packet at once."""
+    def __init__(self, signal_callbacks, event_callbacks, batch_event_callbacks=()):
+        self.signal_callbacks = signal_callbacks
+        self.event_callbacks = event_callbacks
+        self.batch_event_callbacks = list(batch_event_callbacks)
+        
+        self.latest_rr_value_sign = 0
+    
+    def handle_signal(self, signal_packet, starts_new_stream):
+        if signal_packet.type == "rr":
+            if not zephyr.util.USE_NUMPY and not self.batch_event_callbacks:
+                self.handle_rr_values(signal_packet, starts_new_stream)
+                return
+            
+            heartbeat_indices, heartbeat_intervals, self.latest_rr_value_sign = \
+                find_heartbeat_intervals(signal_packet.samples, self.latest_rr_value_sign, starts_new_stream)
+            
+            if not heartbeat_indices:
+                return
+            
+            heartbeat_timestamps = [signal_packet.timestamp + sample_number / float(signal_packet.samplerate)
+                                    for sample_number in heartbeat_indices]
+            
+            for event_callback in self.event_callbacks:
+                for heartbeat_event in zip(heartbeat_timestamps, heartbeat_intervals):
+                    event_callback("heartbeat_interval", heartbeat_event)
+            
+            for batch_event_callback in self.batch_event_callbacks:
+                batch_event_callback("heartbeat_interval", heartbeat_timestamps, heartbeat_intervals)
+    
+    def handle_rr_values(self, signal_packet, starts_new_stream):
+        """Call the event callbacks in a single pass over the RR values, which
+        is faster than collecting the heartbeats first when NumPy is not
+        used"""
+        rr_values = signal_packet.samples
+        
+        for sample_number, heartbeat_interval in generate_heartbeat_intervals(rr_values, self.latest_rr_value_sign,
+                                                                              starts_new_stream):
+            heartbeat_interval_timestamp = signal_packet.timestamp + sample_number / float(signal_packet.samplerate)
+            
+            for event_callback in self.event_callbacks:
+                event_callback("heartbeat_interval", (heartbeat_interval_timestamp, heartbeat_interval))
+        
+        if len(rr_values):
+            self.latest_rr_value_sign = cmp(rr_values[-1], 0)
+
+
+class BioHarnessPacketHandler:
+    """Corrects the timestamps of the packets of a device to the local clock
+    and detects missing packets. The clock difference estimation can be
+    configured by passing a zephyr.util.ClockDifferenceEstimator. The
+    sequence number gaps are counted in the given
+    zephyr.instrumentation.PipelineInstrumentation, if any."""
+    def __init__(self, signal_callbacks, event_callbacks, sequence_number_wraparound=256, time_function=None,
+                 clock_difference_estimator=None, instrumentation=None):
+        self.signal_callbacks = signal_callbacks
+        self.event_callbacks = event_callbacks
+        self.sequence_number_wraparound = sequence_number_wraparound
+        self.instrumentation = instrumentation
+        
+        self.sequence_numbers = {}
+        
+        if clock_difference_estimator is None:
+            clock_difference_estimator = zephyr.util.ClockDifferenceEstimator(time_function)
+        self.clock_difference_correction = clock_difference_estimator
+    
+    def get_message_end_timestamp(self, signal_packet):
+        temporal_message_length = (len(signal_packet.samples) - 1) / signal_packet.samplerate
+        return signal_packet.timestamp + temporal_message_length
+    
+    def get_expected_sequence_number(self, packet_type):
+        previous_sequence_number = self.sequence_numbers.get(packet_type)
+        if previous_sequence_number is not None:
+            expected_sequence_number = (previous_sequence_number + 1) % self.sequence_number_wraparound
+        else:
+            expected_sequence_number = None
+        
+        return expected_sequence_number
+    
+    def handle_packet(self, packet):
+        if isinstance(packet, zephyr.message.SignalPacket):
+            expected_sequence_number = self.get_expected_sequence_number(packet.type)
+            self.sequence_numbers[packet.type] = packet.sequence_number
+            
+            if expected_sequence_number is not None and expected_sequence_number != packet.sequence_number:
+                logging.warning("Invalid sequence number in stream %s: %d != %d",
+                                packet.type, expected_sequence_number,
+                                packet.sequence_number)
+                
+                if self.instrumentation is not None:
+                    self.instrumentation.count("sequence_gaps")
+                    self.instrumentation.count("missing_packets", (packet.sequence_number - expected_sequence_number) %
+                                               self.sequence_number_wraparound)
+                
+                starts_new_stream = True
+            else:
+                starts_new_stream = False
+            
+            
+            end_timestamp = self.get_message_end_timestamp(packet)
+            
+            corrected_end_timestamp = self.clock_difference_correction.estimate_and_correct_timestamp(end_timestamp, packet.type)
+            
+            corrected_timestamp = packet.timestamp + corrected_end_timestamp - end_timestamp
+            
+            # A corrected copy, so that the other callbacks of the packet see
+            # it as it was received
+            corrected_signal_packet = packet._replace(timestamp=corrected_timestamp)
+            
+            for signal_callback in self.signal_callbacks:
+                signal_callback(corrected_signal_packet, starts_new_stream)
+        
+        elif isinstance(packet, zephyr.message.SummaryMessage):
+            corrected_timestamp = self.clock_difference_correction.estimate_and_correct_timestamp(packet.timestamp, "bh_summary")
+            
+            for event_callback in self.event_callbacks:
+                event_callback("activity", (corrected_timestamp, packet.activity))
+                event_callback("heart_rate", (corrected_timestamp, packet.heart_rate))
+                event_callback("respiration_rate", (corrected_timestamp, packet.respiration_rate))
@@ -1,204 +1,624 @@
-
-import threading
-import collections
-
-import zephyr
-
-
-class EventStream:
-    def __init__(self):
-        self.events = []
-        self.events_cleaned_up = 0
-        self.lock = threading.RLock()
-    
-    def __iter__(self):
-        with self.lock:
-            return iter(self.events[:])
-    
-    def __len__(self):
-        with self.lock:
-            corrected_length = len(self.events) + self.events_cleaned_up
-            return corrected_length
-    
-    def __getitem__(self, index):
-        with self.lock:
-            assert 0 <= index < len(self)
-            assert index >= self.events_cleaned_up
-            
-            corrected_index = index - self.events_cleaned_up
-            return self.events[corrected_index]
-    
-    def append(self, value):
-        with self.lock:
-            self.events.append(value)
-    
-    def clean_up_events_before(self, timestamp_lower_bound):
-        with self.lock:
-            cutoff_index = 0
-            
-            for event_timestamp, event_value in self.events: #@UnusedVariable
-                if event_timestamp < timestamp_lower_bound:
-                    cutoff_index += 1
-                else:
-                    break
-            
-            if cutoff_index:
-                self.events = self.events[cutoff_index:]
-                self.events_cleaned_up += cutoff_index
-    
-    def iterate_samples(self, from_sample_index, to_end_timestamp):
-        sample_index = from_sample_index
-        
-        while True:
-            with self.lock:
-                if self.events_cleaned_up > sample_index:
-                    break
-                
-                last_item = self[sample_index] if len(self) > sample_index else None
-            
-            if last_item is not None:
-                event_timestamp, event_value = last_item
-                
-                if event_timestamp <= to_end_timestamp:
-                    yield event_value
-                    sample_index += 1
-                    continue
-            
-            break
-
-
-class SignalStream:
-    def __init__(self, signal_packet):
-        self.samplerate = signal_packet.samplerate
-        self.samples = []
-        self.lock = threading.RLock()
-        
-        self.end_timestamp = None
-        self.append_signal_packet(signal_packet)
-    
-    def append_signal_packet(self, signal_packet):
-        with self.lock:
-            assert signal_packet.samplerate == self.samplerate
-            
-            self.samples.extend(signal_packet.samples)
-            self.end_timestamp = signal_packet.timestamp + len(signal_packet.samples) / float(signal_packet.samplerate)
-    
-    def remove_samples_before(self, timestamp_lower_bound):
-        with self.lock:
-            samples_to_remove = max(0, int((timestamp_lower_bound - self.start_timestamp) * self.samplerate))
-            
-            if samples_to_remove:
-                self.samples = self.samples[samples_to_remove:]
-        
-        return samples_to_remove
-    
-    @property
-    def start_timestamp(self):
-        return self.end_timestamp - len(self.samples) / float(self.samplerate)
-    
-    def iterate_timed_samples(self, skip_samples=0):
-        with self.lock:
-            start_timestamp = self.start_timestamp
-            sample_period = 1.0 / self.samplerate
-            
-            for sample_i, sample in enumerate(self.samples[skip_samples:], start=skip_samples):
-                sample_timestamp = start_timestamp + sample_i * sample_period
-                yield sample_timestamp, sample
-
-
-class SignalStreamHistory:
-    def __init__(self):
-        self._signal_streams = []
-        
-        self.samples_cleaned_up = 0
-    
-    def append_signal_packet(self, signal_packet, starts_new_stream):
-        if starts_new_stream or not len(self._signal_streams):
-            signal_stream = SignalStream(signal_packet)
-            self._signal_streams.append(signal_stream)
-        else:
-            signal_stream = self._signal_streams[-1]
-            signal_stream.append_signal_packet(signal_packet)
-    
-    def get_signal_streams(self):
-        return self._signal_streams
-    
-    def _cleanup_signal_stream(self, signal_stream, timestamp_bound):
-        if timestamp_bound >= signal_stream.end_timestamp:
-            self._signal_streams.remove(signal_stream)
-            samples_removed = len(signal_stream.samples)
-        else:
-            samples_removed = signal_stream.remove_samples_before(timestamp_bound)
-        
-        self.samples_cleaned_up += samples_removed
-    
-    def clean_up_samples_before(self, history_limit):
-        for signal_stream in self._signal_streams[:]:
-            first_timestamp = signal_stream.start_timestamp
-            
-            if first_timestamp >= history_limit:
-                break
-            
-            self._cleanup_signal_stream(signal_stream, history_limit)
-    
-    def iterate_samples(self, from_sample_index, to_end_timestamp):
-        from_sample_index = from_sample_index - self.samples_cleaned_up
-        
-        signal_stream_start_index = 0
-        for signal_stream in self._signal_streams:
-            sample_count = len(signal_stream.samples)
-            next_signal_stream_start_index = signal_stream_start_index + sample_count
-            
-            if from_sample_index < next_signal_stream_start_index:
-                samples_to_skip = max(0, from_sample_index - signal_stream_start_index)
-                
-                for sample_timestamp, sample in signal_stream.iterate_timed_samples(samples_to_skip):
-                    if sample_timestamp > to_end_timestamp:
-                        break
-                    
-                    yield sample
-            
-            signal_stream_start_index = next_signal_stream_start_index
-
-
-class MeasurementCollector:
-    def __init__(self, history_length_seconds=20.0):
-        self._signal_stream_histories = collections.defaultdict(SignalStreamHistory)
-        self._event_streams = collections.defaultdict(EventStream)
-        
-        self.history_length_seconds = history_length_seconds
-        self.last_cleanup_time = 0.0
-    
-    def get_signal_stream_history(self, stream_type):
-        return self._signal_stream_histories[stream_type]
-    
-    def get_event_stream(self, stream_type):
-        return self._event_streams[stream_type]
-    
-    def iterate_signal_stream_histories(self):
-        return self._signal_stream_histories.items()
-    
-    def iterate_event_streams(self):
-        return self._event_streams.items()
-    
-    def handle_signal(self, signal_packet, starts_new_stream):
-        signal_stream_history = self._signal_stream_histories[signal_packet.type]
-        signal_stream_history.append_signal_packet(signal_packet, starts_new_stream)
-        self.cleanup_if_needed()
-    
-    def handle_event(self, stream_name, value):
-        self._event_streams[stream_name].append(value)
-        self.cleanup_if_needed()
-    
-    def cleanup_if_needed(self):
-        now = zephyr.time()
-        
-        if self.last_cleanup_time < now - 5.0:
-            history_limit = now - self.history_length_seconds
-            for signal_stream_history in self._signal_stream_histories.values():
-                signal_stream_history.clean_up_samples_before(history_limit)
-            
-            for event_stream in self._event_streams.values():
-                event_stream.clean_up_events_before(history_limit)
-            
-            self.last_cleanup_time = now
+
+import array
+import bisect
+import itertools
+import threading
+import collections
+
+import zephyr.util
+from zephyr.downsampling import DEFAULT_DOWNSAMPLING_LEVELS, DownsampledSignal, DownsampledSignalHistory
+
+
+class EventStream:
+    """Stores (timestamp, value) events in parallel timestamp and value
+    columns. Events are looked up with bisection over the running maximum of
+    the timestamps, which gives the same results as a linear scan from the
+    beginning even if the timestamps are not strictly monotonic. Cleaned up
+    events are skipped with a head offset, and the columns are compacted
+    only when more than half of them has been cleaned up.
+    
+    The events are added by a single thread at a time, and readers never
+    block it: they copy what they need and retry if the stream was updated
+    meanwhile (see zephyr.util.SequenceLock)."""
+    def __init__(self):
+        self.timestamps = []
+        self.max_timestamps = []
+        self.values = []
+        self.head = 0
+        
+        self.events_cleaned_up = 0
+        self.sequence_lock = zephyr.util.SequenceLock()
+    
+    def __iter__(self):
+        return iter(self.sequence_lock.read(self._read_events))
+    
+    def _read_events(self):
+        return zip(self.timestamps[self.head:], self.values[self.head:])
+    
+    def __len__(self):
+        return self.sequence_lock.read(self._read_length)
+    
+    def _read_length(self):
+        return len(self.values) - self.head + self.events_cleaned_up
+    
+    def __getitem__(self, index):
+        return self.sequence_lock.read(self._read_event, index)
+    
+    def _read_event(self, index):
+        assert 0 <= index < self._read_length()
+        assert index >= self.events_cleaned_up
+        
+        corrected_index = index - self.events_cleaned_up + self.head
+        return self.timestamps[corrected_index], self.values[corrected_index]
+    
+    def append(self, value):
+        event_timestamp, event_value = value
+        
+        with self.sequence_lock:
+            if self.max_timestamps:
+                max_timestamp = max(self.max_timestamps[-1], event_timestamp)
+            else:
+                max_timestamp = event_timestamp
+            
+            self.timestamps.append(event_timestamp)
+            self.max_timestamps.append(max_timestamp)
+            self.values.append(event_value)
+    
+    def extend(self, event_timestamps, event_values):
+        """Append the events with the given timestamps and values"""
+        event_timestamps = list(event_timestamps)
+        
+        with self.sequence_lock:
+            max_timestamp = self.max_timestamps[-1] if self.max_timestamps else None
+            
+            for event_timestamp in event_timestamps:
+                if max_timestamp is None or event_timestamp > max_timestamp:
+                    max_timestamp = event_timestamp
+                self.max_timestamps.append(max_timestamp)
+            
+            self.timestamps.extend(event_timestamps)
+            self.values.extend(event_values)
+    
+    def clean_up_events_before(self, timestamp_lower_bound):
+        with self.sequence_lock:
+            cutoff_index = bisect.bisect_left(self.max_timestamps, timestamp_lower_bound, self.head)
+            
+            self.events_cleaned_up += cutoff_index - self.head
+            self.head = cutoff_index
+            
+            if self.head > len(self.values) / 2:
+                del self.timestamps[:self.head]
+                del self.max_timestamps[:self.head]
+                del self.values[:self.head]
+                self.head = 0
+    
+    def events_between(self, start_timestamp, end_timestamp):
+        """Return the timestamps and values of the events between the given
+        timestamps (inclusive) as two lists."""
+        return self.sequence_lock.read(self._read_events_between, start_timestamp, end_timestamp)
+    
+    def _read_events_between(self, start_timestamp, end_timestamp):
+        start_index = bisect.bisect_left(self.max_timestamps, start_timestamp, self.head)
+        end_index = bisect.bisect_right(self.max_timestamps, end_timestamp, start_index)
+        
+        return self.timestamps[start_index:end_index], self.values[start_index:end_index]
+    
+    def get_timed_samples(self, from_sample_index, to_end_timestamp):
+        """Return the timestamps and values of the events from the given index
+        until the given timestamp as two lists."""
+        timestamps, values, next_sample_index = self.sequence_lock.read(self._read_timed_samples,  #@UnusedVariable
+                                                                        from_sample_index, to_end_timestamp, False)
+        return timestamps, values
+    
+    def read_timed_samples(self, from_sample_index, to_end_timestamp):
+        """Return the timestamps and values of the events from the given index
+        until the given timestamp, and the index of the next event. Events
+        that have been cleaned up are skipped."""
+        return self.sequence_lock.read(self._read_timed_samples, from_sample_index, to_end_timestamp, True)
+    
+    def _read_timed_samples(self, from_sample_index, to_end_timestamp, skip_cleaned_up):
+        if self.events_cleaned_up > from_sample_index:
+            if not skip_cleaned_up:
+                return [], [], from_sample_index
+            
+            from_sample_index = self.events_cleaned_up
+        
+        start_index = from_sample_index - self.events_cleaned_up + self.head
+        end_index = bisect.bisect_right(self.max_timestamps, to_end_timestamp, start_index)
+        
+        return (self.timestamps[start_index:end_index], self.values[start_index:end_index],
+                from_sample_index + end_index - start_index)
+    
+    def create_cursor(self, from_sample_index=0):
+        return SampleCursor(self, from_sample_index)
+    
+    def iterate_samples(self, from_sample_index, to_end_timestamp):
+        timestamps, values = self.get_timed_samples(from_sample_index, to_end_timestamp)  #@UnusedVariable
+        return iter(values)
+    
+    def get_sample_timestamp(self, sample_index):
+        """Return the timestamp at which iterate_samples emits the event with
+        the given index, or None if there is no such event yet."""
+        return self.sequence_lock.read(self._read_sample_timestamp, sample_index)
+    
+    def _read_sample_timestamp(self, sample_index):
+        corrected_index = max(0, sample_index - self.events_cleaned_up) + self.head
+        
+        if corrected_index < len(self.max_timestamps):
+            return self.max_timestamps[corrected_index]
+        else:
+            return None
+
+
+# Longer histories are not preallocated, the sample buffers grow when needed
+MAX_PREALLOCATED_SAMPLES = 2**16
+
+class SampleRingBuffer:
+    """Stores samples in a preallocated circular array of floats. Samples
+    with several components, such as acceleration, are stored as consecutive
+    values and returned as tuples. The buffer grows when it becomes full."""
+    def __init__(self, capacity, sample_width=1):
+        self.capacity = max(1, int(capacity))
+        self.sample_width = sample_width
+        self.values = array.array("d", [0.0]) * (self.capacity * sample_width)
+        
+        self.start = 0
+        self.sample_count = 0
+    
+    def __len__(self):
+        return self.sample_count
+    
+    def _as_value_array(self, samples):
+        if hasattr(samples, "ravel"):
+            # NumPy array
+            return array.array("d", samples.ravel().tolist())
+        elif self.sample_width == 1:
+            return array.array("d", samples)
+        else:
+            return array.array("d", itertools.chain.from_iterable(samples))
+    
+    def _grow(self, minimum_capacity):
+        width = self.sample_width
+        start_position = self.start * width
+        
+        values = self.values[start_position:] + self.values[:start_position]
+        del values[self.sample_count * width:]
+        
+        self.capacity = max(2 * self.capacity, minimum_capacity)
+        values.extend(array.array("d", [0.0]) * (self.capacity * width - len(values)))
+        
+        self.values = values
+        self.start = 0
+    
+    def extend(self, samples):
+        new_values = self._as_value_array(samples)
+        new_value_count = len(new_values)
+        new_sample_count = new_value_count / self.sample_width
+        
+        if self.sample_count + new_sample_count > self.capacity:
+            self._grow(self.sample_count + new_sample_count)
+        
+        buffer_value_count = len(self.values)
+        write_position = ((self.start + self.sample_count) % self.capacity) * self.sample_width
+        
+        # Write up to the end of the array, and the rest to the beginning
+        first_part_length = min(new_value_count, buffer_value_count - write_position)
+        self.values[write_position:write_position + first_part_length] = new_values[:first_part_length]
+        self.values[:new_value_count - first_part_length] = new_values[first_part_length:]
+        
+        self.sample_count += new_sample_count
+    
+    def remove_first(self, sample_count):
+        sample_count = min(sample_count, self.sample_count)
+        
+        self.start = (self.start + sample_count) % self.capacity
+        self.sample_count -= sample_count
+    
+    def copy_values(self, skip_samples=0):
+        """Return a copy of the values of the samples after the skipped ones"""
+        width = self.sample_width
+        first_position = ((self.start + skip_samples) % self.capacity) * width
+        value_count = max(0, self.sample_count - skip_samples) * width
+        
+        values = self.values[first_position:first_position + value_count]
+        if len(values) < value_count:
+            values.extend(self.values[:value_count - len(values)])
+        
+        return values
+    
+    def iterate(self, skip_samples=0):
+        values = self.values
+        width = self.sample_width
+        
+        for sample_i in xrange(skip_samples, self.sample_count):
+            position = ((self.start + sample_i) % self.capacity) * width
+            
+            if width == 1:
+                yield values[position]
+            else:
+                yield tuple(values[position:position + width])
+
+
+class SignalStream:
+    """The samples of a continuous signal. The samples are added by a single
+    thread at a time, and readers never block it (see EventStream)."""
+    def __init__(self, signal_packet, history_length_seconds=20.0):
+        self.samplerate = signal_packet.samplerate
+        self.sequence_lock = zephyr.util.SequenceLock()
+        
+        first_sample = signal_packet.samples[0] if len(signal_packet.samples) else None
+        sample_width = len(first_sample) if hasattr(first_sample, "__len__") else 1
+        capacity = min(history_length_seconds * self.samplerate, MAX_PREALLOCATED_SAMPLES)
+        self.sample_buffer = SampleRingBuffer(capacity, sample_width)
+        
+        self.end_timestamp = None
+        self.append_signal_packet(signal_packet)
+    
+    def __len__(self):
+        return len(self.sample_buffer)
+    
+    @property
+    def samples(self):
+        """A copy of the samples currently in the stream"""
+        start_timestamp, samples = self.read_samples() #@UnusedVariable
+        return samples
+    
+    def read_samples(self, skip_samples=0):
+        """Return the timestamp of the first sample in the stream and a list
+        of the samples after the skipped ones, as a consistent copy"""
+        start_timestamp, values = self.sequence_lock.read(self._copy_values, skip_samples)
+        
+        width = self.sample_buffer.sample_width
+        if width == 1:
+            return start_timestamp, values.tolist()
+        else:
+            return start_timestamp, zip(*[iter(values)] * width)
+    
+    def _copy_values(self, skip_samples):
+        return self._read_start_timestamp(), self.sample_buffer.copy_values(skip_samples)
+    
+    def append_signal_packet(self, signal_packet):
+        with self.sequence_lock:
+            assert signal_packet.samplerate == self.samplerate
+            
+            self.sample_buffer.extend(signal_packet.samples)
+            self.end_timestamp = signal_packet.timestamp + len(signal_packet.samples) / float(signal_packet.samplerate)
+    
+    def remove_samples_before(self, timestamp_lower_bound):
+        with self.sequence_lock:
+            samples_to_remove = max(0, int((timestamp_lower_bound - self._read_start_timestamp()) * self.samplerate))
+            samples_to_remove = min(samples_to_remove, len(self.sample_buffer))
+            
+            if samples_to_remove:
+                self.sample_buffer.remove_first(samples_to_remove)
+        
+        return samples_to_remove
+    
+    @property
+    def start_timestamp(self):
+        return self.sequence_lock.read(self._read_start_timestamp)
+    
+    def _read_start_timestamp(self):
+        return self.end_timestamp - len(self.sample_buffer) / float(self.samplerate)
+    
+    def get_sample_timestamp(self, sample_i):
+        return self.start_timestamp + sample_i * (1.0 / self.samplerate)
+    
+    def iterate_timed_samples(self, skip_samples=0):
+        """Yield (timestamp, sample) for the samples after the skipped ones.
+        The samples are copied when the iteration starts, so a slow consumer
+        does not hold up the writer."""
+        start_timestamp, samples = self.read_samples(skip_samples)
+        sample_period = 1.0 / self.samplerate
+        
+        for sample_i, sample in enumerate(samples, start=skip_samples):
+            sample_timestamp = start_timestamp + sample_i * sample_period
+            yield sample_timestamp, sample
+
+
+class SampleCursor:
+    """Reads the events of an EventStream in order. Each read continues where
+    the previous one ended, so the reader does not need to keep track of the
+    event indices. If events that were not read yet are cleaned up, the
+    cursor skips to the oldest remaining event."""
+    def __init__(self, sample_source, sample_index=0):
+        self.sample_source = sample_source
+        self.sample_index = sample_index
+    
+    def read_timed_samples(self, to_end_timestamp):
+        """Return the timestamps and values of the samples after the previous
+        read until the given timestamp as two lists."""
+        timestamps, samples, self.sample_index = self.sample_source.read_timed_samples(self.sample_index,
+                                                                                       to_end_timestamp)
+        return timestamps, samples
+    
+    def get_next_sample_timestamp(self):
+        """Return the timestamp of the next sample, or None if there is no
+        such sample yet."""
+        return self.sample_source.get_sample_timestamp(self.sample_index)
+
+
+class SignalStreamCursor(SampleCursor):
+    """A SampleCursor that remembers the signal stream in which the previous
+    read ended, so that the next read finds its first sample without a
+    search. If samples that were not read yet are cleaned up, the cursor
+    skips to the oldest remaining sample."""
+    def __init__(self, sample_source, sample_index=0):
+        SampleCursor.__init__(self, sample_source, sample_index)
+        self.stream_number = None
+    
+    def read_timed_samples(self, to_end_timestamp):
+        timestamps, samples, self.sample_index, self.stream_number = \
+            self.sample_source.read_timed_samples(self.sample_index, to_end_timestamp, self.stream_number)
+        return timestamps, samples
+    
+    def get_next_sample_timestamp(self):
+        return self.sample_source.get_sample_timestamp(self.sample_index, self.stream_number)
+
+
+class SignalStreamHistory:
+    """The full-rate samples of the latest history_length_seconds, and a
+    downsampled history at the given levels (see
+    zephyr.downsampling.DownsampledSignalHistory) that is kept much longer.
+    The samples are added by a single thread at a time, and readers never
+    block it (see EventStream).
+    
+    The samples are numbered over all the signal streams from the first
+    sample of the history on. The index of the sample that follows each
+    signal stream is kept in a sorted list, so that the stream of a sample
+    is found by bisection however many times the connection has been
+    lost."""
+    def __init__(self, history_length_seconds=20.0, downsampling_levels=DEFAULT_DOWNSAMPLING_LEVELS):
+        self._signal_streams = []
+        self._stream_end_indices = []
+        self.sequence_lock = zephyr.util.SequenceLock()
+        self.history_length_seconds = history_length_seconds
+        self.downsampling_levels = downsampling_levels
+        self.downsampled_history = None
+        
+        self.samples_appended = 0
+        self.samples_cleaned_up = 0
+        self.streams_cleaned_up = 0
+    
+    def append_signal_packet(self, signal_packet, starts_new_stream):
+        with self.sequence_lock:
+            if starts_new_stream or not len(self._signal_streams):
+                signal_stream = SignalStream(signal_packet, self.history_length_seconds)
+                self._signal_streams.append(signal_stream)
+                self._stream_end_indices.append(self.samples_appended)
+            else:
+                signal_stream = self._signal_streams[-1]
+                signal_stream.append_signal_packet(signal_packet)
+            
+            self.samples_appended += len(signal_packet.samples)
+            self._stream_end_indices[-1] = self.samples_appended
+        
+        if self.downsampling_levels:
+            if self.downsampled_history is None:
+                sample_width = signal_stream.sample_buffer.sample_width
+                self.downsampled_history = DownsampledSignalHistory(sample_width, self.downsampling_levels)
+            
+            self.downsampled_history.append_signal_packet(signal_packet)
+    
+    def get_downsampled(self, start_timestamp, end_timestamp, pixel_width):
+        """Return the minimums, maximums and means of the signal between the
+        given timestamps at the coarsest resolution that still gives at least
+        pixel_width values, as a DownsampledSignal. When the downsampling
+        levels are too coarse for the request, the full-rate samples are
+        returned as the minimums, maximums and means, with a bin_seconds of
+        zero."""
+        if self.downsampled_history is not None:
+            downsampled_signal = self.downsampled_history.get_downsampled(start_timestamp, end_timestamp, pixel_width)
+            
+            if downsampled_signal is not None:
+                return downsampled_signal
+        
+        timestamps = []
+        samples = []
+        
+        for sample_timestamp, sample in self.iterate_timed_samples(0, end_timestamp):
+            if sample_timestamp >= start_timestamp:
+                timestamps.append(sample_timestamp)
+                samples.append(sample)
+        
+        return DownsampledSignal(0.0, timestamps, samples, samples, samples)
+    
+    def get_signal_streams(self):
+        return list(self._signal_streams)
+    
+    def clean_up_samples_before(self, history_limit):
+        with self.sequence_lock:
+            removed_stream_count = 0
+            
+            for stream_i, signal_stream in enumerate(self._signal_streams):
+                if signal_stream.start_timestamp >= history_limit:
+                    break
+                
+                if stream_i == removed_stream_count and history_limit >= signal_stream.end_timestamp:
+                    removed_stream_count += 1
+                    self.samples_cleaned_up += len(signal_stream)
+                else:
+                    self.samples_cleaned_up += signal_stream.remove_samples_before(history_limit)
+            
+            del self._signal_streams[:removed_stream_count]
+            del self._stream_end_indices[:removed_stream_count]
+            self.streams_cleaned_up += removed_stream_count
+    
+    def _find_stream(self, sample_index, stream_number=None):
+        """Return the position in _signal_streams of the stream that contains
+        the sample with the given index, or of the first stream after it.
+        The absolute number of a stream, as returned by an earlier read, is
+        checked first."""
+        end_indices = self._stream_end_indices
+        
+        if stream_number is not None:
+            stream_i = stream_number - self.streams_cleaned_up
+            
+            if (0 <= stream_i < len(end_indices) and sample_index < end_indices[stream_i] and
+                (stream_i == 0 or sample_index >= end_indices[stream_i - 1])):
+                return stream_i
+        
+        return bisect.bisect_right(end_indices, sample_index)
+    
+    def create_cursor(self, from_sample_index=0):
+        return SignalStreamCursor(self, from_sample_index)
+    
+    def iterate_samples(self, from_sample_index, to_end_timestamp):
+        for sample_timestamp, sample in self.iterate_timed_samples(from_sample_index, to_end_timestamp):  #@UnusedVariable
+            yield sample
+    
+    def get_timed_samples(self, from_sample_index, to_end_timestamp):
+        """Return the timestamps and values of the samples from the given index
+        until the given timestamp as two lists."""
+        timestamps, samples, next_sample_index, stream_number = self.read_timed_samples(from_sample_index,  #@UnusedVariable
+                                                                                        to_end_timestamp)
+        return timestamps, samples
+    
+    def read_timed_samples(self, from_sample_index, to_end_timestamp, stream_number=None):
+        """Return the timestamps and values of the samples from the given index
+        until the given timestamp as two lists, the index of the sample after
+        them and the number of the stream it is in, which can be given to the
+        next read as a hint."""
+        first_stream_number, stream_copies = self.sequence_lock.read(self._copy_stream_values, from_sample_index,
+                                                                     to_end_timestamp, stream_number)
+        timestamps = []
+        samples = []
+        next_sample_index = from_sample_index
+        
+        for stream_number, stream_copy in enumerate(stream_copies, start=first_stream_number):
+            signal_stream, stream_start_index, start_timestamp, samples_to_skip, values = stream_copy
+            sample_period = 1.0 / signal_stream.samplerate
+            width = signal_stream.sample_buffer.sample_width
+            stream_samples = values.tolist() if width == 1 else zip(*[iter(values)] * width)
+            
+            stream_timestamps = [start_timestamp + sample_i * sample_period
+                                 for sample_i in xrange(samples_to_skip, samples_to_skip + len(stream_samples))]
+            sample_count = bisect.bisect_right(stream_timestamps, to_end_timestamp)
+            
+            timestamps.extend(stream_timestamps[:sample_count])
+            samples.extend(stream_samples[:sample_count])
+            next_sample_index = stream_start_index + samples_to_skip + sample_count
+            
+            if sample_count < len(stream_samples):
+                break
+        
+        return timestamps, samples, next_sample_index, stream_number
+    
+    def iterate_timed_samples(self, from_sample_index, to_end_timestamp):
+        """Yield (timestamp, sample) for the samples from the given index until
+        the given timestamp. The samples are copied when the iteration
+        starts, so a slow consumer does not hold up the writer."""
+        first_stream_number, stream_copies = self.sequence_lock.read(self._copy_stream_values, from_sample_index,  #@UnusedVariable
+                                                                     to_end_timestamp)
+        
+        for signal_stream, stream_start_index, start_timestamp, samples_to_skip, values in stream_copies:  #@UnusedVariable
+            sample_period = 1.0 / signal_stream.samplerate
+            width = signal_stream.sample_buffer.sample_width
+            samples = values if width == 1 else zip(*[iter(values)] * width)
+            
+            for sample_i, sample in enumerate(samples, start=samples_to_skip):
+                sample_timestamp = start_timestamp + sample_i * sample_period
+                
+                if sample_timestamp > to_end_timestamp:
+                    return
+                
+                yield sample_timestamp, sample
+    
+    def _copy_stream_values(self, from_sample_index, to_end_timestamp, stream_number=None):
+        first_stream_i = self._find_stream(from_sample_index, stream_number)
+        stream_copies = []
+        
+        for stream_i in xrange(first_stream_i, len(self._signal_streams)):
+            signal_stream = self._signal_streams[stream_i]
+            start_timestamp = signal_stream._read_start_timestamp()
+            
+            if start_timestamp > to_end_timestamp:
+                break
+            
+            stream_start_index = self._stream_end_indices[stream_i] - len(signal_stream)
+            samples_to_skip = max(0, from_sample_index - stream_start_index)
+            start_timestamp, values = signal_stream._copy_values(samples_to_skip)
+            stream_copies.append((signal_stream, stream_start_index, start_timestamp, samples_to_skip, values))
+        
+        return first_stream_i + self.streams_cleaned_up, stream_copies
+    
+    def get_sample_timestamp(self, sample_index, stream_number=None):
+        """Return the timestamp of the sample with the given index, or None if
+        there is no such sample yet. Cleaned up samples are skipped."""
+        return self.sequence_lock.read(self._read_sample_timestamp, sample_index, stream_number)
+    
+    def _read_sample_timestamp(self, sample_index, stream_number=None):
+        stream_i = self._find_stream(sample_index, stream_number)
+        
+        if stream_i == len(self._signal_streams):
+            return None
+        
+        signal_stream = self._signal_streams[stream_i]
+        stream_start_index = self._stream_end_indices[stream_i] - len(signal_stream)
+        samples_to_skip = max(0, sample_index - stream_start_index)
+        
+        return signal_stream._read_start_timestamp() + samples_to_skip * (1.0 / signal_stream.samplerate)
+
+
+class MeasurementCollector:
+    def __init__(self, history_length_seconds=20.0, time_function=None,
+                 downsampling_levels=DEFAULT_DOWNSAMPLING_LEVELS):
+        self.history_length_seconds = history_length_seconds
+        self.time_function = time_function
+        self.downsampling_levels = downsampling_levels
+        
+        self._signal_stream_histories = collections.defaultdict(lambda: SignalStreamHistory(self.history_length_seconds,
+                                                                                             self.downsampling_levels))
+        self._event_streams = collections.defaultdict(EventStream)
+        self.last_cleanup_time = 0.0
+        
+        # Notified whenever new samples or events are added
+        self.new_data_condition = threading.Condition()
+        self.data_version = 0
+    
+    def get_signal_stream_history(self, stream_type):
+        return self._signal_stream_histories[stream_type]
+    
+    def get_event_stream(self, stream_type):
+        return self._event_streams[stream_type]
+    
+    def iterate_signal_stream_histories(self):
+        return self._signal_stream_histories.items()
+    
+    def iterate_event_streams(self):
+        return self._event_streams.items()
+    
+    def handle_signal(self, signal_packet, starts_new_stream):
+        signal_stream_history = self._signal_stream_histories[signal_packet.type]
+        signal_stream_history.append_signal_packet(signal_packet, starts_new_stream)
+        self.notify_new_data()
+        self.cleanup_if_needed()
+    
+    def handle_event(self, stream_name, value):
+        self._event_streams[stream_name].append(value)
+        self.notify_new_data()
+        self.cleanup_if_needed()
+    
+    def handle_events(self, stream_name, timestamps, values):
+        """Store a batch of events with a single notification"""
+        self._event_streams[stream_name].extend(timestamps, values)
+        self.notify_new_data()
+        self.cleanup_if_needed()
+    
+    def notify_new_data(self):
+        with self.new_data_condition:
+            self.data_version += 1
+            self.new_data_condition.notify_all()
+    
+    def cleanup_if_needed(self):
+        now = zephyr.get_time(self.time_function)
+        
+        if self.last_cleanup_time < now - 5.0:
+            history_limit = now - self.history_length_seconds
+            for signal_stream_history in self._signal_stream_histories.values():
+                signal_stream_history.clean_up_samples_before(history_limit)
+            
+            for event_stream in self._event_streams.values():
+                event_stream.clean_up_events_before(history_limit)
+            
+            self.last_cleanup_time = now
@@ -1,44 +1,130 @@
-
-import threading
-import collections
-import itertools
-import time
-
-import zephyr
-
-class DelayedRealTimeStream(threading.Thread):
-    def __init__(self, signal_collector, callbacks, default_delay, specific_delays={}):
-        threading.Thread.__init__(self)
-        self.signal_collector = signal_collector
-        self.callbacks = callbacks
-        self.default_delay = default_delay
-        self.specific_delays = specific_delays
-        
-        self.stream_output_positions = collections.defaultdict(lambda: 0)
-        
-        self.terminate_requested = False
-    
-    def add_callback(self, callback):
-        self.callbacks.append(callback)
-    
-    def terminate(self):
-        self.terminate_requested = True
-    
-    def run(self):
-        while not self.terminate_requested:
-            now = zephyr.time()
-            all_streams = itertools.chain(self.signal_collector.iterate_signal_stream_histories(),
-                                          self.signal_collector.iterate_event_streams())
-            
-            for signal_stream_name, signal_stream_history in all_streams:
-                delay = self.specific_delays.get(signal_stream_name, self.default_delay)
-                
-                delayed_current_time = now - delay
-                
-                from_sample = self.stream_output_positions[signal_stream_name]
-                for sample in signal_stream_history.iterate_samples(from_sample, delayed_current_time):
-                    self.stream_output_positions[signal_stream_name] += 1
-                    for callback in self.callbacks:
-                        callback(signal_stream_name, sample)
-            
-            time.sleep(0.01)
+
+import threading
+import itertools
+
+import zephyr
+
+class SampleCallbackAdapter:
+    """Delivers batches of samples to callbacks that take one sample at a time"""
+    def __init__(self, callbacks):
+        self.callbacks = callbacks
+    
+    def __call__(self, signal_stream_name, timestamps, samples):
+        for sample in samples:
+            for callback in self.callbacks:
+                callback(signal_stream_name, sample)
+
+
+class DelayedRealTimeStream(threading.Thread):
+    """Outputs the samples and events of a collector when they are older than
+    the configured delay. Instead of polling, the thread sleeps until the next
+    sample of some stream is due or until the collector receives new data.
+    
+    Callbacks are called as callback(stream_name, sample) for each sample.
+    Batch callbacks are called as batch_callback(stream_name, timestamps,
+    samples) with all the samples of a stream that are output at once. The
+    samples of a stream can be collected into larger batches by allowing them
+    to be output later than their due time, by the stream's maximum batch
+    latency."""
+    
+    # Upper limit for a single wait, in case the clock is adjusted
+    max_wait_seconds = 1.0
+    
+    def __init__(self, signal_collector, callbacks, default_delay, specific_delays={},
+                 batch_callbacks=(), max_batch_latencies={}):
+        threading.Thread.__init__(self)
+        self.signal_collector = signal_collector
+        self.callbacks = callbacks
+        self.default_delay = default_delay
+        self.specific_delays = specific_delays
+        self.max_batch_latencies = max_batch_latencies
+        
+        self.batch_callbacks = [SampleCallbackAdapter(self.callbacks)] + list(batch_callbacks)
+        
+        self.stream_cursors = {}
+        self.next_sample_timestamps = {}
+        
+        self.terminate_requested = False
+    
+    def add_callback(self, callback):
+        self.callbacks.append(callback)
+    
+    def add_batch_callback(self, batch_callback):
+        self.batch_callbacks.append(batch_callback)
+    
+    def terminate(self):
+        self.terminate_requested = True
+        
+        with self.signal_collector.new_data_condition:
+            self.signal_collector.new_data_condition.notify_all()
+    
+    def get_cursor(self, signal_stream_name, signal_stream_history):
+        cursor = self.stream_cursors.get(signal_stream_name)
+        
+        if cursor is None:
+            cursor = signal_stream_history.create_cursor()
+            self.stream_cursors[signal_stream_name] = cursor
+        
+        return cursor
+    
+    def output_samples(self, signal_stream_name, signal_stream_history, delayed_current_time):
+        cursor = self.get_cursor(signal_stream_name, signal_stream_history)
+        timestamps, samples = cursor.read_timed_samples(delayed_current_time)
+        
+        if len(samples):
+            for batch_callback in self.batch_callbacks:
+                batch_callback(signal_stream_name, timestamps, samples)
+    
+    def output_due_samples(self, now):
+        """Output the samples that are due and return the time when the next
+        sample is due, or None if all available samples have been output."""
+        next_output_time = None
+        
+        all_streams = itertools.chain(self.signal_collector.iterate_signal_stream_histories(),
+                                      self.signal_collector.iterate_event_streams())
+        
+        for signal_stream_name, signal_stream_history in all_streams:
+            delay = self.specific_delays.get(signal_stream_name, self.default_delay)
+            max_batch_latency = self.max_batch_latencies.get(signal_stream_name, 0.0)
+            
+            delayed_current_time = now - delay
+            
+            next_sample_timestamp = self.next_sample_timestamps.get(signal_stream_name)
+            
+            cursor = self.get_cursor(signal_stream_name, signal_stream_history)
+            
+            if next_sample_timestamp is None:
+                next_sample_timestamp = cursor.get_next_sample_timestamp()
+            
+            if next_sample_timestamp is not None and next_sample_timestamp + max_batch_latency <= delayed_current_time:
+                self.output_samples(signal_stream_name, signal_stream_history, delayed_current_time)
+                next_sample_timestamp = cursor.get_next_sample_timestamp()
+            
+            self.next_sample_timestamps[signal_stream_name] = next_sample_timestamp
+            
+            if next_sample_timestamp is not None:
+                stream_next_output_time = next_sample_timestamp + delay + max_batch_latency
+                
+                if next_output_time is None or stream_next_output_time < next_output_time:
+                    next_output_time = stream_next_output_time
+        
+        return next_output_time
+    
+    def run(self):
+        new_data_condition = self.signal_collector.new_data_condition
+        
+        while not self.terminate_requested:
+            with new_data_condition:
+                data_version = self.signal_collector.data_version
+            
+            next_output_time = self.output_due_samples(zephyr.time())
+            
+            with new_data_condition:
+                if self.terminate_requested or data_version != self.signal_collector.data_version:
+                    continue
+                
+                wait_seconds = self.max_wait_seconds
+                if next_output_time is not None:
+                    wait_seconds = max(0.0, min(wait_seconds, next_output_time - zephyr.time()))
+                
+                zephyr.wait(new_data_condition, wait_seconds)
@@ -0,0 +1,280 @@
+
+import math
+import array
+import bisect
+import collections
+
+import zephyr.util
+
+
+# Bin lengths in seconds and the number of bins kept at each level: an hour
+# of 1 s bins, 12 hours of 10 s bins and three days of 60 s bins
+DEFAULT_DOWNSAMPLING_LEVELS = ((1.0, 3600), (10.0, 4320), (60.0, 4320))
+
+DownsampledSignal = collections.namedtuple("DownsampledSignal", ["bin_seconds", "timestamps", "minimums",
+                                                                 "maximums", "means"])
+
+
+def merge_bin(target_bin, minimums, maximums, sums, count):
+    target_minimums, target_maximums, target_sums = target_bin[1:4]
+    
+    for component_i in range(len(target_sums)):
+        target_minimums[component_i] = min(target_minimums[component_i], minimums[component_i])
+        target_maximums[component_i] = max(target_maximums[component_i], maximums[component_i])
+        target_sums[component_i] += sums[component_i]
+    
+    target_bin[4] += count
+
+
+class DownsampledLevel:
+    """The minimum, maximum, sum and count of the samples in consecutive
+    bins of bin_seconds, aligned to multiples of bin_seconds. The bins are
+    stored as columns with the components of multi-component samples as
+    consecutive values. The latest bin stays open until a sample of a later
+    bin arrives. Samples that are older than the open bin, e.g. due to clock
+    difference corrections, are added to the open bin."""
+    def __init__(self, bin_seconds, max_bin_count, sample_width):
+        self.bin_seconds = bin_seconds
+        self.max_bin_count = max_bin_count
+        self.sample_width = sample_width
+        
+        self.bin_indices = array.array("d")
+        self.minimums = array.array("d")
+        self.maximums = array.array("d")
+        self.sums = array.array("d")
+        self.counts = array.array("d")
+        
+        self.open_bin = None
+    
+    def __len__(self):
+        return len(self.bin_indices) + (self.open_bin is not None)
+    
+    def get_bin_index(self, timestamp):
+        return int(math.floor(timestamp / self.bin_seconds))
+    
+    def add_bin(self, bin_index, minimums, maximums, sums, count):
+        """Add samples to the bin with the given index. Returns the bin that
+        was closed, as a list of the arguments, or None."""
+        open_bin = self.open_bin
+        
+        if open_bin is not None and bin_index <= open_bin[0]:
+            merge_bin(open_bin, minimums, maximums, sums, count)
+            return None
+        
+        self.open_bin = [bin_index, list(minimums), list(maximums), list(sums), count]
+        
+        if open_bin is not None:
+            self._store_bin(open_bin)
+        
+        return open_bin
+    
+    def _store_bin(self, closed_bin):
+        bin_index, minimums, maximums, sums, count = closed_bin
+        
+        self.bin_indices.append(bin_index)
+        self.minimums.extend(minimums)
+        self.maximums.extend(maximums)
+        self.sums.extend(sums)
+        self.counts.append(count)
+        
+        # Remove the oldest bins in large chunks, keeping at least
+        # max_bin_count bins
+        if len(self.bin_indices) >= 2 * self.max_bin_count:
+            removed_bin_count = len(self.bin_indices) - self.max_bin_count
+            removed_value_count = removed_bin_count * self.sample_width
+            
+            del self.bin_indices[:removed_bin_count]
+            del self.minimums[:removed_value_count]
+            del self.maximums[:removed_value_count]
+            del self.sums[:removed_value_count]
+            del self.counts[:removed_bin_count]
+    
+    @property
+    def start_timestamp(self):
+        """The start of the oldest bin, or None if the level is empty"""
+        if len(self.bin_indices):
+            return self.bin_indices[0] * self.bin_seconds
+        elif self.open_bin is not None:
+            return self.open_bin[0] * self.bin_seconds
+        else:
+            return None
+    
+    def get_bins(self, start_timestamp, end_timestamp, open_bins=None):
+        """Return the bins that overlap the given time range as a
+        DownsampledSignal. The timestamps are the starts of the bins, and the
+        values are lists of tuples for multi-component samples. The open bins
+        that follow the stored bins can be given as a sorted list, by default
+        the open bin of the level."""
+        width = self.sample_width
+        
+        if open_bins is None:
+            open_bins = [self.open_bin] if self.open_bin is not None else []
+        
+        start_bin_index = math.floor(start_timestamp / self.bin_seconds)
+        end_bin_index = math.floor(end_timestamp / self.bin_seconds)
+        
+        start_index = bisect.bisect_left(self.bin_indices, start_bin_index)
+        end_index = bisect.bisect_right(self.bin_indices, end_bin_index)
+        
+        bin_indices = self.bin_indices[start_index:end_index].tolist()
+        minimums = self.minimums[start_index * width:end_index * width].tolist()
+        maximums = self.maximums[start_index * width:end_index * width].tolist()
+        sums = self.sums[start_index * width:end_index * width].tolist()
+        counts = self.counts[start_index:end_index].tolist()
+        
+        for open_bin in open_bins:
+            if start_bin_index <= open_bin[0] <= end_bin_index:
+                bin_indices.append(open_bin[0])
+                minimums.extend(open_bin[1])
+                maximums.extend(open_bin[2])
+                sums.extend(open_bin[3])
+                counts.append(open_bin[4])
+        
+        timestamps = [bin_index * self.bin_seconds for bin_index in bin_indices]
+        means = [value_sum / counts[value_i // width] for value_i, value_sum in enumerate(sums)]
+        
+        if width > 1:
+            minimums, maximums, means = [zip(*[iter(values)] * width) for values in (minimums, maximums, means)]
+        
+        return DownsampledSignal(self.bin_seconds, timestamps, minimums, maximums, means)
+
+
+class DownsampledSignalHistory:
+    """Multi-resolution minimum, maximum and mean history of a signal for
+    long-term trend views. The finest level is updated from the signal
+    packets with one slice per bin, and each coarser level from the closed
+    bins of the previous level. The bin length of each level must be a
+    multiple of the previous one. The samples in the open bins of the finer
+    levels are included in the latest bins of a coarse level when it is
+    queried."""
+    def __init__(self, sample_width, levels=DEFAULT_DOWNSAMPLING_LEVELS):
+        self.sample_width = sample_width
+        self.levels = [DownsampledLevel(bin_seconds, max_bin_count, sample_width)
+                       for bin_seconds, max_bin_count in levels]
+        
+        self.level_ratios = []
+        for finer_level, coarser_level in zip(self.levels[:-1], self.levels[1:]):
+            level_ratio = int(round(coarser_level.bin_seconds / finer_level.bin_seconds))
+            
+            if abs(level_ratio * finer_level.bin_seconds - coarser_level.bin_seconds) > 1e-9 * coarser_level.bin_seconds:
+                raise ValueError("The bin length of each level must be a multiple of the previous one")
+            
+            self.level_ratios.append(level_ratio)
+        
+        self.sequence_lock = zephyr.util.SequenceLock()
+    
+    def _add_to_levels(self, bin_index, minimums, maximums, sums, count):
+        closed_bin = self.levels[0].add_bin(bin_index, minimums, maximums, sums, count)
+        
+        level_i = 1
+        while closed_bin is not None and level_i < len(self.levels):
+            bin_index, minimums, maximums, sums, count = closed_bin
+            closed_bin = self.levels[level_i].add_bin(bin_index // self.level_ratios[level_i - 1],
+                                                      minimums, maximums, sums, count)
+            level_i += 1
+    
+    def append_signal_packet(self, signal_packet):
+        samples = signal_packet.samples
+        sample_count = len(samples)
+        
+        if not sample_count or not self.levels:
+            return
+        
+        if self.sample_width == 1:
+            component_values = [samples.tolist() if hasattr(samples, "tolist") else samples]
+        elif hasattr(samples, "T"):
+            # NumPy array
+            component_values = samples.T.tolist()
+        else:
+            component_values = zip(*samples)
+        
+        finest_level = self.levels[0]
+        bin_seconds = finest_level.bin_seconds
+        sample_period = 1.0 / signal_packet.samplerate
+        first_timestamp = signal_packet.timestamp
+        
+        with self.sequence_lock:
+            bin_index = finest_level.get_bin_index(first_timestamp)
+            segment_start = 0
+            
+            while segment_start < sample_count:
+                # The first sample of the next bin, allowing for rounding errors
+                next_bin_start = (bin_index + 1) * bin_seconds
+                segment_end = int(math.ceil((next_bin_start - first_timestamp) / sample_period - 1e-9))
+                segment_end = min(sample_count, max(segment_start + 1, segment_end))
+                
+                if segment_start == 0 and segment_end == sample_count:
+                    segments = component_values
+                else:
+                    segments = [values[segment_start:segment_end] for values in component_values]
+                self._add_to_levels(bin_index,
+                                    [min(segment) for segment in segments],
+                                    [max(segment) for segment in segments],
+                                    [float(sum(segment)) for segment in segments],
+                                    segment_end - segment_start)
+                
+                segment_start = segment_end
+                bin_index = finest_level.get_bin_index(first_timestamp + segment_start * sample_period)
+    
+    def get_open_bins(self, level_i):
+        """Merge the open bins of the given level and the finer levels into
+        bins of the given level"""
+        open_bins = {}
+        
+        for finer_level_i in range(level_i + 1):
+            open_bin = self.levels[finer_level_i].open_bin
+            
+            if open_bin is not None:
+                level_ratio = 1
+                for ratio in self.level_ratios[finer_level_i:level_i]:
+                    level_ratio *= ratio
+                
+                bin_index = open_bin[0] // level_ratio
+                
+                if bin_index in open_bins:
+                    merge_bin(open_bins[bin_index], *open_bin[1:])
+                else:
+                    open_bins[bin_index] = [bin_index, list(open_bin[1]), list(open_bin[2]), list(open_bin[3]),
+                                            open_bin[4]]
+        
+        return [open_bins[bin_index] for bin_index in sorted(open_bins)]
+    
+    def choose_level(self, start_timestamp, end_timestamp, pixel_width):
+        """Return the coarsest level that has at least pixel_width bins in the
+        given time range, or None if even the finest level is too coarse.
+        Levels that do not reach back to the start of the range are skipped
+        if a coarser level does."""
+        ideal_bin_seconds = (end_timestamp - start_timestamp) / float(max(1, pixel_width))
+        
+        chosen_level = None
+        for level in self.levels:
+            if level.bin_seconds > ideal_bin_seconds:
+                break
+            
+            chosen_level = level
+        
+        if chosen_level is None:
+            return None
+        
+        # Prefer a coarser level if the chosen one has already dropped the
+        # beginning of the range
+        for level in self.levels[self.levels.index(chosen_level):]:
+            level_start_timestamp = level.start_timestamp
+            
+            if level_start_timestamp is not None and level_start_timestamp <= start_timestamp:
+                return level
+        
+        return chosen_level
+    
+    def get_downsampled(self, start_timestamp, end_timestamp, pixel_width):
+        """Return the bins of the level chosen by choose_level as a
+        DownsampledSignal, or None if even the finest level is too coarse"""
+        return self.sequence_lock.read(self._read_downsampled, start_timestamp, end_timestamp, pixel_width)
+    
+    def _read_downsampled(self, start_timestamp, end_timestamp, pixel_width):
+        level = self.choose_level(start_timestamp, end_timestamp, pixel_width)
+        
+        if level is None:
+            return None
+        
+        return level.get_bins(start_timestamp, end_timestamp, self.get_open_bins(self.levels.index(level)))
@@ -0,0 +1,195 @@
+
+import os
+import select
+import logging
+
+import zephyr
+from zephyr.protocol import BioHarnessCommands, create_message_frame
+
+
+class NonBlockingProtocol:
+    """A counterpart of Protocol that is driven by a ProtocolEventLoop instead
+    of a thread of its own. The connection must have a file descriptor that
+    can be used with select, e.g. a serial port on a POSIX system.
+    
+    If the connection has a timeout and no data is received during it, the
+    connection is closed and re-opened like in Protocol."""
+    
+    reopen_retries = 100
+    reopen_retry_interval = 1.0
+    
+    def __init__(self, connection, callbacks, read_chunk_size=4096):
+        self.connection = connection
+        self.callbacks = callbacks
+        self.read_chunk_size = read_chunk_size
+        
+        self.initialization_messages = []
+        
+        self.is_open = True
+        self.last_receive_time = None
+        self.reopen_attempts = 0
+        self.next_reopen_time = None
+    
+    def fileno(self):
+        return self.connection.fileno()
+    
+    def add_initilization_message(self, message_id, payload):
+        message_frame = create_message_frame(message_id, payload)
+        
+        try:
+            self.connection.write(message_frame)
+        except ValueError:
+            self.initialization_messages.append(message_frame)
+    
+    def get_timeout(self):
+        return getattr(self.connection, "timeout", None)
+    
+    def connection_made(self, now):
+        for message_frame in self.initialization_messages:
+            self.connection.write(message_frame)
+        
+        self.last_receive_time = now
+    
+    def read_available_bytes(self):
+        return os.read(self.fileno(), self.read_chunk_size)
+    
+    def data_received(self, data_string, now):
+        self.last_receive_time = now
+        
+        for callback in self.callbacks:
+            callback(data_string)
+    
+    def get_deadline(self):
+        """Return the time of the next timeout or re-open attempt"""
+        if not self.is_open:
+            return self.next_reopen_time
+        
+        timeout = self.get_timeout()
+        if timeout is None:
+            return None
+        
+        return self.last_receive_time + timeout
+    
+    def check_timeout(self, now):
+        timeout = self.get_timeout()
+        
+        if timeout is not None and now - self.last_receive_time >= timeout:
+            logging.info("Timeout occurred, closing port")
+            self.connection.close()
+            
+            self.is_open = False
+            self.reopen_attempts = 0
+            self.next_reopen_time = now
+    
+    def try_reopen(self, now):
+        if now < self.next_reopen_time:
+            return
+        
+        try:
+            self.connection.open()
+        except Exception as e:
+            logging.info("Re-opening port failed, retry %d (%s)", self.reopen_attempts, e)
+            
+            self.reopen_attempts += 1
+            if self.reopen_attempts >= self.reopen_retries:
+                raise OSError("Unable to re-open")
+            
+            self.next_reopen_time = now + self.reopen_retry_interval
+            return
+        
+        logging.info("Re-opening port successful")
+        self.is_open = True
+        self.last_receive_time = now
+
+
+class NonBlockingBioHarnessProtocol(NonBlockingProtocol, BioHarnessCommands):
+    pass
+
+
+class ProtocolEventLoop:
+    """Reads the connections of many NonBlockingProtocols in a single thread.
+    Protocols are removed from the loop when their connection reaches the end
+    of data or cannot be re-opened after a timeout.
+    
+    An error in reading a connection or in the callbacks of a protocol only
+    removes that protocol and closes its connection, and the other protocols
+    are served as before. The failure callbacks are called as
+    failure_callback(protocol, exception) for the failed protocols, including
+    those that cannot be re-opened."""
+    
+    # Upper limit for a single wait, so that termination is noticed
+    max_wait_seconds = 1.0
+    
+    def __init__(self, failure_callbacks=()):
+        self.failure_callbacks = failure_callbacks
+        self.protocols = []
+        self.terminated = False
+    
+    def add_protocol(self, protocol):
+        protocol.connection_made(zephyr.time())
+        self.protocols.append(protocol)
+    
+    def remove_protocol(self, protocol):
+        self.protocols.remove(protocol)
+    
+    def remove_failed_protocol(self, protocol, exception):
+        self.remove_protocol(protocol)
+        
+        try:
+            protocol.connection.close()
+        except Exception as e:
+            logging.warning("Closing the connection of a failed protocol failed: %s", e)
+        
+        for failure_callback in self.failure_callbacks:
+            failure_callback(protocol, exception)
+    
+    def terminate(self):
+        self.terminated = True
+    
+    def get_wait_seconds(self, now):
+        wait_seconds = self.max_wait_seconds
+        
+        for protocol in self.protocols:
+            deadline = protocol.get_deadline()
+            
+            if deadline is not None:
+                wait_seconds = min(wait_seconds, deadline - now)
+        
+        return max(0.0, wait_seconds)
+    
+    def run_once(self):
+        for protocol in self.protocols[:]:
+            if not protocol.is_open:
+                try:
+                    protocol.try_reopen(zephyr.time())
+                except OSError as e:
+                    logging.error("Removing protocol: %s", e)
+                    self.remove_failed_protocol(protocol, e)
+        
+        open_protocols = [protocol for protocol in self.protocols if protocol.is_open]
+        
+        readable_protocols = select.select(open_protocols, [], [], self.get_wait_seconds(zephyr.time()))[0]
+        
+        now = zephyr.time()
+        
+        for protocol in readable_protocols:
+            try:
+                data_string = protocol.read_available_bytes()
+                
+                if len(data_string):
+                    protocol.data_received(data_string, now)
+                else:
+                    logging.info("End of data reached, removing protocol")
+                    self.remove_protocol(protocol)
+            except Exception as e:
+                logging.exception("Removing protocol after an error: %s", e)
+                self.remove_failed_protocol(protocol, e)
+        
+        readable_protocols = set(readable_protocols)
+        for protocol in open_protocols:
+            if protocol not in readable_protocols:
+                protocol.check_timeout(now)
+    
+    def run(self):
+        while self.protocols and not self.terminated:
+            self.run_once()
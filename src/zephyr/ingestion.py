@@ -0,0 +1,280 @@
+
+import Queue
+import array
+import struct
+import logging
+import itertools
+import multiprocessing
+
+from zephyr.collector import MeasurementCollector
+from zephyr.bioharness import BioHarnessSignalAnalysis, BioHarnessPacketHandler
+from zephyr.event_loop import NonBlockingBioHarnessProtocol, ProtocolEventLoop
+from zephyr.hxm import HxMPacketAnalysis
+from zephyr.message import MessagePayloadParser, SignalPacket
+from zephyr.protocol import BufferedMessageFrameParser
+
+
+# Signal packets and events are sent from the worker processes to the
+# supervisor as binary records. The stream names are sent as indices to
+# this list, and other stream names as such after the record header.
+STREAM_NAMES = ["ecg", "breathing", "rr", "acceleration", "heart_rate", "activity",
+                "respiration_rate", "heartbeat_interval", "strides"]
+
+STREAM_CODES = dict((stream_name, stream_code) for stream_code, stream_name in enumerate(STREAM_NAMES))
+
+NAMED_STREAM_CODE = 255
+
+# Length of a stream name that is not in STREAM_NAMES
+STREAM_NAME_LENGTH = struct.Struct("<B")
+
+SIGNAL_RECORD = 0
+EVENT_RECORD = 1
+
+# Record type, device index and stream code
+RECORD_HEADER = struct.Struct("<BHB")
+
+# Timestamp, sample rate, sequence number, stream discontinuity flag,
+# values per sample and sample count, followed by the sample values as doubles
+SIGNAL_RECORD_FIELDS = struct.Struct("<ddBBBI")
+
+# Timestamp and value
+EVENT_RECORD_FIELDS = struct.Struct("<dd")
+
+
+class RecordEncoder:
+    def __init__(self):
+        self.records = []
+    
+    def add_header(self, record_type, device_index, stream_name):
+        stream_code = STREAM_CODES.get(stream_name)
+        
+        if stream_code is not None:
+            self.records.append(RECORD_HEADER.pack(record_type, device_index, stream_code))
+        else:
+            encoded_stream_name = stream_name.encode("utf-8")
+            self.records.append(RECORD_HEADER.pack(record_type, device_index, NAMED_STREAM_CODE))
+            self.records.append(STREAM_NAME_LENGTH.pack(len(encoded_stream_name)))
+            self.records.append(encoded_stream_name)
+    
+    def add_signal(self, device_index, signal_packet, starts_new_stream):
+        samples = signal_packet.samples
+        
+        if hasattr(samples, "ravel"):
+            # NumPy array
+            sample_width = samples.shape[1] if samples.ndim > 1 else 1
+            values = array.array("d", samples.ravel().tolist())
+        else:
+            sample_width = len(samples[0]) if len(samples) and hasattr(samples[0], "__len__") else 1
+            if sample_width == 1:
+                values = array.array("d", samples)
+            else:
+                values = array.array("d", itertools.chain.from_iterable(samples))
+        
+        self.add_header(SIGNAL_RECORD, device_index, signal_packet.type)
+        self.records.append(SIGNAL_RECORD_FIELDS.pack(signal_packet.timestamp, signal_packet.samplerate,
+                                                      signal_packet.sequence_number, starts_new_stream,
+                                                      sample_width, len(values) / sample_width))
+        self.records.append(values.tostring())
+    
+    def add_event(self, device_index, stream_name, value):
+        event_timestamp, event_value = value
+        
+        self.add_header(EVENT_RECORD, device_index, stream_name)
+        self.records.append(EVENT_RECORD_FIELDS.pack(event_timestamp, event_value))
+    
+    def pop_data(self):
+        data = "".join(self.records)
+        self.records = []
+        return data
+
+
+def decode_records(data, signal_callback, event_callback):
+    """Decode the records created by a RecordEncoder. The callbacks are
+    called as signal_callback(device_index, signal_packet, starts_new_stream)
+    and event_callback(device_index, stream_name, (timestamp, value))."""
+    position = 0
+    
+    while position < len(data):
+        record_type, device_index, stream_code = RECORD_HEADER.unpack_from(data, position)
+        position += RECORD_HEADER.size
+        
+        if stream_code == NAMED_STREAM_CODE:
+            stream_name_length, = STREAM_NAME_LENGTH.unpack_from(data, position)
+            position += STREAM_NAME_LENGTH.size
+            stream_name = data[position:position + stream_name_length].decode("utf-8")
+            position += stream_name_length
+        else:
+            stream_name = STREAM_NAMES[stream_code]
+        
+        if record_type == SIGNAL_RECORD:
+            (timestamp, samplerate, sequence_number, starts_new_stream,
+             sample_width, sample_count) = SIGNAL_RECORD_FIELDS.unpack_from(data, position)
+            position += SIGNAL_RECORD_FIELDS.size
+            
+            values = array.array("d")
+            values_end_position = position + sample_count * sample_width * values.itemsize
+            values.fromstring(data[position:values_end_position])
+            position = values_end_position
+            
+            if sample_width == 1:
+                samples = values
+            else:
+                samples = zip(*[values[component_i::sample_width] for component_i in range(sample_width)])
+            
+            signal_packet = SignalPacket(stream_name, timestamp, samplerate, samples, sequence_number)
+            signal_callback(device_index, signal_packet, bool(starts_new_stream))
+        else:
+            event_timestamp, event_value = EVENT_RECORD_FIELDS.unpack_from(data, position)
+            position += EVENT_RECORD_FIELDS.size
+            
+            event_callback(device_index, stream_name, (event_timestamp, event_value))
+
+
+def create_device_protocol(device_index, connection, enable_periodic_packets, encoder):
+    def signal_callback(signal_packet, starts_new_stream):
+        encoder.add_signal(device_index, signal_packet, starts_new_stream)
+    
+    def event_callback(stream_name, value):
+        encoder.add_event(device_index, stream_name, value)
+    
+    rr_signal_analysis = BioHarnessSignalAnalysis([], [event_callback])
+    signal_packet_handler_bh = BioHarnessPacketHandler([signal_callback, rr_signal_analysis.handle_signal],
+                                                       [event_callback])
+    signal_packet_handler_hxm = HxMPacketAnalysis([event_callback])
+    
+    payload_parser = MessagePayloadParser([signal_packet_handler_bh.handle_packet,
+                                           signal_packet_handler_hxm.handle_packet])
+    message_parser = BufferedMessageFrameParser(payload_parser.handle_message)
+    
+    protocol = NonBlockingBioHarnessProtocol(connection, [message_parser.parse_data])
+    
+    if enable_periodic_packets:
+        protocol.enable_periodic_packets()
+    
+    return protocol
+
+
+def run_worker(worker_index, device_definitions, output_queue):
+    """Read and analyze the given devices in a worker process, and send the
+    results to the output queue as encoded records. A device that cannot be
+    opened, or whose connection or analysis fails, is reported as a
+    (device index, error message) tuple, and the other devices are read
+    on. The worker index is sent when all the devices have finished or the
+    worker fails."""
+    try:
+        encoder = RecordEncoder()
+        device_indices = {}
+        
+        def report_failure(device_index, exception):
+            if encoder.records:
+                output_queue.put(encoder.pop_data())
+            
+            output_queue.put((device_index, str(exception)))
+        
+        event_loop = ProtocolEventLoop([lambda protocol, exception: report_failure(device_indices[protocol],
+                                                                                   exception)])
+        
+        for device_index, (connection_factory, enable_periodic_packets) in device_definitions:
+            try:
+                protocol = create_device_protocol(device_index, connection_factory(), enable_periodic_packets,
+                                                  encoder)
+            except Exception as e:
+                logging.exception("Unable to open device %d", device_index)
+                report_failure(device_index, e)
+                continue
+            
+            device_indices[protocol] = device_index
+            event_loop.add_protocol(protocol)
+        
+        while event_loop.protocols:
+            event_loop.run_once()
+            
+            if encoder.records:
+                output_queue.put(encoder.pop_data())
+    finally:
+        output_queue.put(worker_index)
+
+
+class IngestionPool:
+    """Reads and analyzes many devices in a pool of worker processes, and
+    collects the results to a MeasurementCollector per device in the calling
+    process.
+    
+    Devices are given as (connection_factory, enable_periodic_packets)
+    tuples. The connection factory is called in the worker process and must
+    be picklable, e.g. a module level function or a functools.partial of one.
+    The connections must be usable with zephyr.event_loop.
+    
+    The devices that cannot be opened or fail while they are read are listed
+    in failed_devices as device index: error message, and the results of a
+    failed device end there. The other devices of the same worker are read
+    on. A worker that dies without finishing, e.g. when it is killed, is
+    noticed within worker_check_interval seconds, and the results of its
+    devices end there."""
+    
+    worker_check_interval = 1.0
+    
+    def __init__(self, device_definitions, process_count, collector_factory=MeasurementCollector):
+        self.device_definitions = device_definitions
+        self.process_count = process_count
+        
+        self.collectors = [collector_factory() for device_definition in device_definitions]  #@UnusedVariable
+        
+        self.failed_devices = {}
+        
+        self.output_queue = multiprocessing.Queue()
+        self.processes = []
+    
+    def start(self):
+        indexed_device_definitions = list(enumerate(self.device_definitions))
+        
+        for process_i in range(min(self.process_count, len(indexed_device_definitions))):
+            device_shard = indexed_device_definitions[process_i::self.process_count]
+            process = multiprocessing.Process(target=run_worker, args=(process_i, device_shard, self.output_queue))
+            process.daemon = True
+            process.start()
+            self.processes.append(process)
+    
+    def handle_signal(self, device_index, signal_packet, starts_new_stream):
+        self.collectors[device_index].handle_signal(signal_packet, starts_new_stream)
+    
+    def handle_event(self, device_index, stream_name, value):
+        self.collectors[device_index].handle_event(stream_name, value)
+    
+    def run(self):
+        """Start the workers and collect their results until all the devices
+        have finished"""
+        self.start()
+        
+        running_worker_indices = set(range(len(self.processes)))
+        
+        while running_worker_indices:
+            # A worker that had exited before the wait, and whose results did
+            # not arrive during it, has died without finishing
+            exited_worker_indices = [worker_index for worker_index in running_worker_indices
+                                     if not self.processes[worker_index].is_alive()]
+            
+            try:
+                data = self.output_queue.get(timeout=self.worker_check_interval)
+            except Queue.Empty:
+                for worker_index in exited_worker_indices:
+                    logging.error("Worker %d died with exit code %s", worker_index,
+                                  self.processes[worker_index].exitcode)
+                    running_worker_indices.discard(worker_index)
+                continue
+            
+            if isinstance(data, int):
+                running_worker_indices.discard(data)
+            elif isinstance(data, tuple):
+                device_index, error_message = data
+                logging.error("Device %d failed: %s", device_index, error_message)
+                self.failed_devices[device_index] = error_message
+            else:
+                decode_records(data, self.handle_signal, self.handle_event)
+        
+        for process in self.processes:
+            process.join()
+    
+    def terminate(self):
+        for process in self.processes:
+            process.terminate()
@@ -0,0 +1,266 @@
+
+import os
+import json
+import time
+import threading
+import collections
+import BaseHTTPServer
+
+import zephyr
+
+
+class StageStatistics:
+    """Call count, processed item count and time spent in one stage of the
+    pipeline. The total time includes the stages that the stage calls, and
+    the own time excludes them."""
+    def __init__(self):
+        self.call_count = 0
+        self.item_count = 0
+        self.total_seconds = 0.0
+        self.own_seconds = 0.0
+    
+    def get_report(self, elapsed_seconds):
+        return collections.OrderedDict([
+            ("calls", self.call_count),
+            ("items", self.item_count),
+            ("total_seconds", self.total_seconds),
+            ("own_seconds", self.own_seconds),
+            ("mean_call_microseconds", self.total_seconds / self.call_count * 1e6 if self.call_count else None),
+            ("items_per_second", self.item_count / elapsed_seconds if elapsed_seconds > 0 else None)])
+
+
+class LagStatistics:
+    """How long the samples of a stream have waited between their timestamps
+    and their output"""
+    def __init__(self):
+        self.sample_count = 0
+        self.lag_sum = 0.0
+        self.max_lag = None
+    
+    def add_samples(self, now, timestamps):
+        self.sample_count += len(timestamps)
+        self.lag_sum += now * len(timestamps) - sum(timestamps)
+        
+        lag = now - min(timestamps)
+        if self.max_lag is None or lag > self.max_lag:
+            self.max_lag = lag
+    
+    def get_report(self):
+        return collections.OrderedDict([
+            ("samples", self.sample_count),
+            ("mean_seconds", self.lag_sum / self.sample_count if self.sample_count else None),
+            ("max_seconds", self.max_lag)])
+
+
+class PipelineInstrumentation:
+    """Opt-in profiling of a data pipeline. The callbacks between the stages
+    are wrapped with instrument, which records the call count, the number of
+    items (e.g. bytes, frames or packets) and the time spent in each stage.
+    The parsers and packet handlers that are given the instrumentation count
+    their errors with count, e.g. CRC failures, protocol errors and
+    sequence number gaps. The lag from the sample timestamps to their output
+    by DelayedRealTimeStream is recorded when handle_output_samples is added
+    as one of its batch callbacks.
+    
+    Nothing is recorded for the callbacks that are not wrapped, so a pipeline
+    without instrumentation runs as before. The statistics of each stage
+    should be updated by one thread at a time. The stages, counters and lags
+    are added and counted under a lock, so get_report can be called from
+    another thread, e.g. by ReportFileExporter or create_report_server."""
+    def __init__(self, time_function=None):
+        self.time_function = time_function
+        
+        self.stages = collections.OrderedDict()
+        self.counters = collections.OrderedDict()
+        self.lags = collections.OrderedDict()
+        self.lock = threading.Lock()
+        
+        self.start_time = time.time()
+        self._thread_state = threading.local()
+    
+    def get_stage(self, stage_name):
+        with self.lock:
+            stage = self.stages.get(stage_name)
+            
+            if stage is None:
+                stage = self.stages[stage_name] = StageStatistics()
+            
+            return stage
+    
+    def instrument(self, stage_name, callback, item_count_function=None):
+        """Return a callback that calls the given one and records its calls in
+        the named stage. Each call counts as one item, or as
+        item_count_function(*arguments) items, e.g. len for data
+        callbacks."""
+        stage = self.get_stage(stage_name)
+        thread_state = self._thread_state
+        timer = time.time
+        
+        def instrumented_callback(*args):
+            child_seconds_stack = getattr(thread_state, "child_seconds_stack", None)
+            if child_seconds_stack is None:
+                child_seconds_stack = thread_state.child_seconds_stack = []
+            
+            child_seconds_stack.append(0.0)
+            start_time = timer()
+            
+            try:
+                return callback(*args)
+            finally:
+                elapsed_seconds = timer() - start_time
+                child_seconds = child_seconds_stack.pop()
+                
+                if child_seconds_stack:
+                    child_seconds_stack[-1] += elapsed_seconds
+                
+                stage.call_count += 1
+                stage.item_count += item_count_function(*args) if item_count_function is not None else 1
+                stage.total_seconds += elapsed_seconds
+                stage.own_seconds += elapsed_seconds - child_seconds
+        
+        return instrumented_callback
+    
+    def count(self, counter_name, increment=1):
+        with self.lock:
+            self.counters[counter_name] = self.counters.get(counter_name, 0) + increment
+    
+    def handle_output_samples(self, stream_name, timestamps, samples):
+        """A batch callback for DelayedRealTimeStream that records the lag of
+        the output samples"""
+        if not len(timestamps):
+            return
+        
+        now = zephyr.get_time(self.time_function)
+        
+        with self.lock:
+            lag_statistics = self.lags.get(stream_name)
+            if lag_statistics is None:
+                lag_statistics = self.lags[stream_name] = LagStatistics()
+            
+            lag_statistics.add_samples(now, timestamps)
+    
+    def get_report(self):
+        """Return the statistics as a dictionary that can be serialized as
+        JSON"""
+        elapsed_seconds = time.time() - self.start_time
+        
+        with self.lock:
+            return collections.OrderedDict([
+                ("elapsed_seconds", elapsed_seconds),
+                ("stages", collections.OrderedDict((stage_name, stage.get_report(elapsed_seconds))
+                                                   for stage_name, stage in self.stages.items())),
+                ("counters", collections.OrderedDict(self.counters)),
+                ("lags", collections.OrderedDict((stream_name, lag_statistics.get_report())
+                                                 for stream_name, lag_statistics in self.lags.items()))])
+
+
+def instrument(instrumentation, stage_name, callback, item_count_function=None):
+    """Return the callback wrapped with instrumentation.instrument, or as
+    such if there is no instrumentation"""
+    if instrumentation is None:
+        return callback
+    
+    return instrumentation.instrument(stage_name, callback, item_count_function)
+
+
+def format_value(value):
+    if value is None:
+        return "-"
+    elif isinstance(value, float):
+        return "%.6g" % value
+    else:
+        return str(value)
+
+
+def format_report(report):
+    """Format a report of PipelineInstrumentation as a plain text table"""
+    lines = ["Elapsed %.3f s" % report["elapsed_seconds"]]
+    
+    for section_name in ["stages", "lags"]:
+        section = report[section_name]
+        
+        if section:
+            column_names = section.values()[0].keys()
+            lines.append("")
+            lines.append("\t".join([section_name] + column_names))
+            
+            for row_name, row in section.items():
+                lines.append("\t".join([row_name] + [format_value(row[column_name]) for column_name in column_names]))
+    
+    if report["counters"]:
+        lines.append("")
+        for counter_name, value in report["counters"].items():
+            lines.append("%s\t%d" % (counter_name, value))
+    
+    return "\n".join(lines) + "\n"
+
+
+def write_report(instrumentation, report_path):
+    """Write the report of the instrumentation to a file, as text if the path
+    ends with .txt and otherwise as JSON. The file is replaced at once, so a
+    reader never sees a partial report."""
+    report = instrumentation.get_report()
+    
+    if report_path.endswith(".txt"):
+        report_string = format_report(report)
+    else:
+        report_string = json.dumps(report, indent=2)
+    
+    temporary_path = report_path + ".tmp"
+    with open(temporary_path, "wb") as report_file:
+        report_file.write(report_string)
+    
+    # Windows does not replace an existing file on rename
+    if os.name == "nt" and os.path.exists(report_path):
+        os.remove(report_path)
+    
+    os.rename(temporary_path, report_path)
+
+
+class ReportFileExporter(threading.Thread):
+    """Writes the report of the instrumentation to a file every interval
+    seconds, and once more when terminated"""
+    def __init__(self, instrumentation, report_path, interval=5.0):
+        threading.Thread.__init__(self)
+        self.daemon = True
+        
+        self.instrumentation = instrumentation
+        self.report_path = report_path
+        self.interval = interval
+        
+        self.terminate_event = threading.Event()
+    
+    def terminate(self):
+        self.terminate_event.set()
+    
+    def run(self):
+        while not self.terminate_event.is_set():
+            zephyr.wait(self.terminate_event, self.interval)
+            write_report(self.instrumentation, self.report_path)
+
+
+def create_report_server(instrumentation, port, host="127.0.0.1"):
+    """Create an HTTP server that serves the report of the instrumentation as
+    JSON, or as text at /text. Run it with serve_forever, e.g. in a daemon
+    thread, and stop it with shutdown."""
+    class ReportRequestHandler(BaseHTTPServer.BaseHTTPRequestHandler):
+        def do_GET(self):
+            report = instrumentation.get_report()
+            
+            if self.path.rstrip("/") == "/text":
+                content_type = "text/plain"
+                body = format_report(report)
+            else:
+                content_type = "application/json"
+                body = json.dumps(report, indent=2)
+            
+            self.send_response(200)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+        
+        def log_message(self, format, *args):  #@ReservedAssignment
+            pass
+    
+    return BaseHTTPServer.HTTPServer((host, port), ReportRequestHandler)
@@ -1,150 +1,368 @@
-
-import collections
-
-import zephyr.util
-
-
-HxMMessage = collections.namedtuple("HxMMessage",
-                                    ["heart_rate", "heartbeat_number", "heartbeat_milliseconds",
-                                     "distance", "speed", "strides"])
-
-SummaryMessage = collections.namedtuple("SummaryMessage",
-                                        ["sequence_number", "timestamp", "heart_rate",
-                                         "respiration_rate", "skin_temperature",
-                                         "posture", "activity", "peak_acceleration",
-                                         "breathing_wave_amplitude", "breathing_confidence",
-                                         "heart_rate_confidence"])
-
-SignalPacket = collections.namedtuple("SignalPacket", ["type", "timestamp", "samplerate",
-                                                       "samples", "sequence_number"])
-
-
-
-
-#Specification of HxM payload bytes:
-#Firmware ID
-#Firmware Version
-#Hardware ID
-#Hardware Version
-#Battery Charge Indicator
-#Heart Rate
-#Heart Beat Number
-#Heart Beat Timestamp #1 (Oldest)
-#Heart Beat Timestamp #2
-#...
-#Heart Beat Timestamp #14
-#Heart Beat Timestamp #15 (Oldest)
-#Reserved
-#Reserved
-#Reserved
-#Distance
-#Instantaneous speed
-#Strides
-#Reserved
-#Reserved
-
-def parse_hxm_message(payload):
-    heart_rate, heartbeat_number = payload[9:11]
-    
-    heartbeat_timestamp_bytes = payload[11:41]
-    
-    movement_data_bytes = payload[47:53]
-    
-    distance, speed, strides = tuple(zephyr.util.parse_uint16_values_from_bytes(movement_data_bytes))
-    
-    distance = distance / 16.0
-    speed = speed / 256.0
-    
-    heartbeat_milliseconds = list(zephyr.util.parse_uint16_values_from_bytes(heartbeat_timestamp_bytes))
-    
-    hxm_message = HxMMessage(heart_rate=heart_rate, heartbeat_number=heartbeat_number,
-                             heartbeat_milliseconds=heartbeat_milliseconds, distance=distance,
-                             speed=speed, strides=strides)
-    return hxm_message
-
-
-def parse_summary_packet(payload):
-    sequence_number = payload[0]
-    
-    timestamp = zephyr.util.parse_timestamp(payload[1:9])
-    
-    (heart_rate, respiration_rate, skin_temperature, posture, activity,
-     peak_acceleration, breathing_wave_amplitude) = \
-        zephyr.util.parse_uint16_values_from_byte_sequence([10, 12, 14, 16, 18, 20, 25], payload)
-    
-    respiration_rate *= 0.1
-    skin_temperature *= 0.1
-    activity *= 0.01
-    peak_acceleration *= 0.01
-    
-    breathing_confidence = payload[29]
-    heart_rate_confidence = payload[34]
-    
-    message = SummaryMessage(sequence_number, timestamp, heart_rate,
-                             respiration_rate, skin_temperature,
-                             posture, activity, peak_acceleration,
-                             breathing_wave_amplitude, breathing_confidence,
-                             heart_rate_confidence)
-    
-    return message
-
-
-def signal_packet_payload_parser_factory(sample_parser, signal_code, samplerate):
-    def parse_signal_packet(payload):
-        sequence_number = payload[0]
-        timestamp_bytes = payload[1:9]
-        signal_bytes = payload[9:]
-        
-        message_timestamp = zephyr.util.parse_timestamp(timestamp_bytes)
-        samples = sample_parser(signal_bytes)
-        
-        signal_packet = zephyr.message.SignalPacket(signal_code, message_timestamp, samplerate, samples, sequence_number)
-        return signal_packet
-    
-    return parse_signal_packet
-
-
-def parse_10_bit_samples(signal_bytes):
-    samples = zephyr.util.unpack_bit_packed_values(signal_bytes, 10, False)
-    samples = [value - 512 for value in samples]
-    return samples
-
-
-def parse_16_bit_samples(signal_bytes):
-    samples = zephyr.util.unpack_bit_packed_values(signal_bytes, 16, True)
-    samples = [value * 0.001 for value in samples]
-    return samples
-
-
-def parse_accelerometer_samples(signal_bytes):
-    interleaved_samples = parse_10_bit_samples(signal_bytes)
-    
-    # 83 correspond to one g in the 14-bit acceleration
-    # signal, and this of 1/4 of that
-    one_g_value = 20.75
-    interleaved_samples = [value / one_g_value for value in interleaved_samples]
-    
-    samples = zip(interleaved_samples[0::3],
-                        interleaved_samples[1::3],
-                        interleaved_samples[2::3])
-    return samples
-
-
-class MessagePayloadParser:
-    def __init__(self, callbacks):
-        self.callbacks = callbacks
-    
-    def handle_message(self, message_frame):
-        handler = MESSAGE_TYPES.get(message_frame.message_id)
-        if handler is not None:
-            message = handler(message_frame.payload)
-            for callback in self.callbacks:
-                callback(message)
-
-
-MESSAGE_TYPES = {0x2B: parse_summary_packet,
-                 0x21: signal_packet_payload_parser_factory(parse_10_bit_samples, "breathing", 18.0),
-                 0x22: signal_packet_payload_parser_factory(parse_10_bit_samples, "ecg", 250.0),
-                 0x24: signal_packet_payload_parser_factory(parse_16_bit_samples, "rr", 18.0),
-                 0x25: signal_packet_payload_parser_factory(parse_accelerometer_samples, "acceleration", 50.0),
-                 0x26: parse_hxm_message}
+
+import array
+import struct
+import collections
+
+import zephyr.util
+
+
+class CompactMessage(object):
+    """Base class for messages stored in slots instead of namedtuples. The
+    messages support the comparison, unpacking, indexing, len, _asdict,
+    _replace and pickling of namedtuples, but they are not tuples.
+    Subclasses list their public fields in _fields."""
+    __slots__ = ()
+    _fields = ()
+    
+    def _get_values(self):
+        return tuple(getattr(self, field_name) for field_name in self._fields)
+    
+    def __eq__(self, other):
+        return type(self) is type(other) and self._get_values() == other._get_values()
+    
+    def __ne__(self, other):
+        return not self == other
+    
+    def __hash__(self):
+        return hash(self._get_values())
+    
+    def __iter__(self):
+        return iter(self._get_values())
+    
+    def __getitem__(self, index):
+        return self._get_values()[index]
+    
+    def __len__(self):
+        return len(self._fields)
+    
+    def __reduce__(self):
+        return (type(self), self._get_values())
+    
+    def _asdict(self):
+        return collections.OrderedDict(zip(self._fields, self._get_values()))
+    
+    def __repr__(self):
+        return "%s(%s)" % (type(self).__name__, ", ".join("%s=%r" % (field_name, getattr(self, field_name))
+                                                          for field_name in self._fields))
+    
+    def _replace(self, **field_values):
+        for field_name in self._fields:
+            field_values.setdefault(field_name, getattr(self, field_name))
+        
+        return type(self)(**field_values)
+
+
+class HxMMessage(CompactMessage):
+    """The heartbeat timestamps are decoded from the payload when they are
+    first used"""
+    __slots__ = ("heart_rate", "heartbeat_number", "_heartbeat_milliseconds",
+                 "distance", "speed", "strides", "_payload")
+    _fields = ("heart_rate", "heartbeat_number", "heartbeat_milliseconds",
+               "distance", "speed", "strides")
+    
+    def __init__(self, heart_rate, heartbeat_number, heartbeat_milliseconds, distance, speed, strides, payload=None):
+        self.heart_rate = heart_rate
+        self.heartbeat_number = heartbeat_number
+        self._heartbeat_milliseconds = heartbeat_milliseconds
+        self.distance = distance
+        self.speed = speed
+        self.strides = strides
+        self._payload = payload
+    
+    @property
+    def heartbeat_milliseconds(self):
+        if self._heartbeat_milliseconds is None and self._payload is not None:
+            self._heartbeat_milliseconds = list(HXM_HEARTBEAT_TIMESTAMPS.unpack_from(self._payload, 11))
+            self._payload = None
+        
+        return self._heartbeat_milliseconds
+
+SummaryMessage = collections.namedtuple("SummaryMessage",
+                                        ["sequence_number", "timestamp", "heart_rate",
+                                         "respiration_rate", "skin_temperature",
+                                         "posture", "activity", "peak_acceleration",
+                                         "breathing_wave_amplitude", "breathing_confidence",
+                                         "heart_rate_confidence"])
+
+
+class SignalPacket(CompactMessage):
+    """The samples are decoded from the payload when they are first used"""
+    __slots__ = ("type", "timestamp", "samplerate", "_samples", "sequence_number",
+                 "_payload", "_sample_parser")
+    _fields = ("type", "timestamp", "samplerate", "samples", "sequence_number")
+    
+    def __init__(self, type, timestamp, samplerate, samples, sequence_number, payload=None, sample_parser=None):  #@ReservedAssignment
+        self.type = type
+        self.timestamp = timestamp
+        self.samplerate = samplerate
+        self._samples = samples
+        self.sequence_number = sequence_number
+        self._payload = payload
+        self._sample_parser = sample_parser
+    
+    @property
+    def samples(self):
+        if self._samples is None and self._payload is not None:
+            self._samples = self._sample_parser(self._payload[9:])
+            self._payload = None
+        
+        return self._samples
+    
+    def _replace(self, **field_values):
+        # The copy decodes the samples only if they are used
+        if "samples" not in field_values and self._samples is None:
+            field_values.update(samples=None, payload=self._payload, sample_parser=self._sample_parser)
+        
+        return CompactMessage._replace(self, **field_values)
+
+
+
+
+#Specification of HxM payload bytes:
+#Firmware ID
+#Firmware Version
+#Hardware ID
+#Hardware Version
+#Battery Charge Indicator
+#Heart Rate
+#Heart Beat Number
+#Heart Beat Timestamp #1 (Oldest)
+#Heart Beat Timestamp #2
+#...
+#Heart Beat Timestamp #14
+#Heart Beat Timestamp #15 (Oldest)
+#Reserved
+#Reserved
+#Reserved
+#Distance
+#Instantaneous speed
+#Strides
+#Reserved
+#Reserved
+
+# The NumPy types of the struct type codes that decode_payload_columns
+# supports. The fields are little-endian.
+PAYLOAD_FIELD_DTYPES = {"B": "u1", "H": "<u2", "I": "<u4", "b": "i1", "h": "<i2", "i": "<i4"}
+
+def create_payload_layout(payload_fields):
+    """Return the struct.Struct of a fixed payload layout, given as a list of
+    (type code, count) fields, with "x" for padding bytes. Only the type
+    codes of PAYLOAD_FIELD_DTYPES are supported."""
+    for type_code, count in payload_fields:  #@UnusedVariable
+        if type_code != "x" and type_code not in PAYLOAD_FIELD_DTYPES:
+            raise ValueError("Unsupported payload field type %r" % type_code)
+    
+    return struct.Struct("<" + "".join("%d%s" % (count, type_code) for type_code, count in payload_fields))
+
+
+# Heart rate, heartbeat number, heartbeat timestamps, distance, speed and strides
+HXM_PAYLOAD_FIELDS = [("x", 9), ("B", 2), ("H", 15), ("x", 6), ("H", 3)]
+HXM_PAYLOAD_LAYOUT = create_payload_layout(HXM_PAYLOAD_FIELDS)
+
+# The same without the heartbeat timestamps, which are decoded when needed
+HXM_SCALAR_FIELDS = struct.Struct("<9xBB36xHHH")
+HXM_HEARTBEAT_TIMESTAMPS = struct.Struct("<15H")
+
+def parse_hxm_message(payload):
+    heart_rate, heartbeat_number, distance, speed, strides = HXM_SCALAR_FIELDS.unpack_from(payload)
+    
+    distance = distance / 16.0
+    speed = speed / 256.0
+    
+    hxm_message = HxMMessage(heart_rate=heart_rate, heartbeat_number=heartbeat_number,
+                             heartbeat_milliseconds=None, distance=distance,
+                             speed=speed, strides=strides, payload=payload)
+    return hxm_message
+
+
+# Sequence number, date and milliseconds of the timestamp, heart rate,
+# respiration rate, skin temperature, posture, activity, peak acceleration,
+# breathing wave amplitude, breathing confidence and heart rate confidence
+SUMMARY_PAYLOAD_FIELDS = [("B", 1), ("I", 2), ("x", 1), ("H", 6), ("x", 3), ("H", 1), ("x", 2), ("B", 1),
+                          ("x", 4), ("B", 1)]
+SUMMARY_PAYLOAD_LAYOUT = create_payload_layout(SUMMARY_PAYLOAD_FIELDS)
+
+def parse_summary_packet(payload):
+    (sequence_number, date_value, day_milliseconds, heart_rate, respiration_rate, skin_temperature,
+     posture, activity, peak_acceleration, breathing_wave_amplitude, breathing_confidence,
+     heart_rate_confidence) = SUMMARY_PAYLOAD_LAYOUT.unpack_from(payload)
+    
+    timestamp = zephyr.util.get_midnight_epoch(date_value) + day_milliseconds / 1000.0
+    
+    respiration_rate *= 0.1
+    skin_temperature *= 0.1
+    activity *= 0.01
+    peak_acceleration *= 0.01
+    
+    message = SummaryMessage(sequence_number, timestamp, heart_rate,
+                             respiration_rate, skin_temperature,
+                             posture, activity, peak_acceleration,
+                             breathing_wave_amplitude, breathing_confidence,
+                             heart_rate_confidence)
+    
+    return message
+
+
+def decode_payload_columns(payload_fields, payloads):
+    """Decode payloads with a fixed layout, given as for
+    create_payload_layout, into a list of columns, one per field value. The
+    columns are NumPy arrays if NumPy is used, and otherwise arrays of
+    floats."""
+    payload_layout = create_payload_layout(payload_fields)
+    
+    if zephyr.util.USE_NUMPY:
+        numpy = zephyr.util.numpy
+        
+        # Let NumPy decode the fields of all the payloads at once
+        field_dtypes = []
+        field_offsets = []
+        offset = 0
+        
+        for type_code, count in payload_fields:
+            field_size = struct.calcsize("<" + type_code)
+            
+            if type_code != "x":
+                field_dtypes.extend([numpy.dtype(PAYLOAD_FIELD_DTYPES[type_code])] * count)
+                field_offsets.extend(offset + field_i * field_size for field_i in range(count))
+            
+            offset += count * field_size
+        
+        dtype = numpy.dtype({"names": ["f%d" % field_i for field_i in range(len(field_dtypes))],
+                             "formats": field_dtypes, "offsets": field_offsets,
+                             "itemsize": payload_layout.size})
+        
+        if any(len(payload) < payload_layout.size for payload in payloads):
+            raise ValueError("A payload is shorter than the payload layout")
+        
+        payload_data = b"".join(bytes(payload[:payload_layout.size]) for payload in payloads)
+        records = numpy.frombuffer(payload_data, dtype=dtype)
+        
+        return [records[field_name].astype(float) for field_name in dtype.names]
+    
+    rows = [payload_layout.unpack_from(payload) for payload in payloads]
+    field_count = sum(count for type_code, count in payload_fields if type_code != "x")
+    
+    return [array.array("d", [row[field_i] for row in rows]) for field_i in range(field_count)]
+
+
+def get_timestamp_column(date_values, day_milliseconds):
+    if zephyr.util.USE_NUMPY:
+        numpy = zephyr.util.numpy
+        
+        unique_date_values, date_indices = numpy.unique(date_values, return_inverse=True)
+        midnight_epochs = numpy.array([zephyr.util.get_midnight_epoch(int(date_value))
+                                       for date_value in unique_date_values])
+        return midnight_epochs[date_indices] + day_milliseconds / 1000.0
+    
+    return array.array("d", [zephyr.util.get_midnight_epoch(int(date_value)) + milliseconds / 1000.0
+                             for date_value, milliseconds in zip(date_values, day_milliseconds)])
+
+
+def scale_column(column, factor):
+    if zephyr.util.USE_NUMPY:
+        return column * factor
+    
+    return array.array("d", [value * factor for value in column])
+
+
+def decode_summary_payloads(payloads):
+    """Decode many summary packet payloads at once for offline analysis.
+    Returns a SummaryMessage whose fields are columns of all the payloads."""
+    (sequence_numbers, date_values, day_milliseconds, heart_rates, respiration_rates, skin_temperatures,
+     postures, activities, peak_accelerations, breathing_wave_amplitudes, breathing_confidences,
+     heart_rate_confidences) = decode_payload_columns(SUMMARY_PAYLOAD_FIELDS, payloads)
+    
+    return SummaryMessage(sequence_numbers, get_timestamp_column(date_values, day_milliseconds), heart_rates,
+                          scale_column(respiration_rates, 0.1), scale_column(skin_temperatures, 0.1),
+                          postures, scale_column(activities, 0.01), scale_column(peak_accelerations, 0.01),
+                          breathing_wave_amplitudes, breathing_confidences, heart_rate_confidences)
+
+
+def decode_hxm_payloads(payloads):
+    """Decode many HxM message payloads at once for offline analysis. Returns
+    an HxMMessage whose fields are columns of all the payloads. The heartbeat
+    timestamps are a two-dimensional array with NumPy, and otherwise an array
+    with the 15 timestamps of each message as consecutive values."""
+    columns = decode_payload_columns(HXM_PAYLOAD_FIELDS, payloads)
+    heart_rates, heartbeat_numbers = columns[:2]
+    heartbeat_timestamp_columns = columns[2:17]
+    distances, speeds, strides = columns[17:]
+    
+    if zephyr.util.USE_NUMPY:
+        heartbeat_milliseconds = zephyr.util.numpy.column_stack(heartbeat_timestamp_columns)
+    else:
+        heartbeat_milliseconds = array.array("d")
+        for message_heartbeat_milliseconds in zip(*heartbeat_timestamp_columns):
+            heartbeat_milliseconds.extend(message_heartbeat_milliseconds)
+    
+    return HxMMessage(heart_rates, heartbeat_numbers, heartbeat_milliseconds,
+                      scale_column(distances, 1 / 16.0), scale_column(speeds, 1 / 256.0), strides)
+
+
+def signal_packet_payload_parser_factory(sample_parser, signal_code, samplerate):
+    def parse_signal_packet(payload):
+        sequence_number = payload[0]
+        message_timestamp = zephyr.util.parse_timestamp(payload, 1)
+        
+        signal_packet = zephyr.message.SignalPacket(signal_code, message_timestamp, samplerate, None, sequence_number,
+                                                    payload, sample_parser)
+        return signal_packet
+    
+    return parse_signal_packet
+
+
+def parse_10_bit_samples(signal_bytes):
+    if zephyr.util.USE_NUMPY:
+        return zephyr.util.unpack_bit_packed_array(signal_bytes, 10, False) - 512
+    
+    samples = zephyr.util.unpack_bit_packed_values(signal_bytes, 10, False)
+    samples = [value - 512 for value in samples]
+    return samples
+
+
+def parse_16_bit_samples(signal_bytes):
+    if zephyr.util.USE_NUMPY:
+        return zephyr.util.unpack_bit_packed_array(signal_bytes, 16, True) * 0.001
+    
+    samples = zephyr.util.unpack_bit_packed_values(signal_bytes, 16, True)
+    samples = [value * 0.001 for value in samples]
+    return samples
+
+
+def parse_accelerometer_samples(signal_bytes):
+    interleaved_samples = parse_10_bit_samples(signal_bytes)
+    
+    # 83 correspond to one g in the 14-bit acceleration
+    # signal, and this of 1/4 of that
+    one_g_value = 20.75
+    
+    if zephyr.util.USE_NUMPY:
+        sample_count = len(interleaved_samples) / 3
+        return interleaved_samples[:sample_count * 3].reshape(sample_count, 3) / one_g_value
+    
+    interleaved_samples = [value / one_g_value for value in interleaved_samples]
+    
+    samples = zip(interleaved_samples[0::3],
+                        interleaved_samples[1::3],
+                        interleaved_samples[2::3])
+    return samples
+
+
+class MessagePayloadParser:
+    def __init__(self, callbacks):
+        self.callbacks = callbacks
+    
+    def handle_message(self, message_frame):
+        handler = MESSAGE_TYPES.get(message_frame.message_id)
+        if handler is not None:
+            message = handler(message_frame.payload)
+            for callback in self.callbacks:
+                callback(message)
+
+
+MESSAGE_TYPES = {0x2B: parse_summary_packet,
+                 0x21: signal_packet_payload_parser_factory(parse_10_bit_samples, "breathing", 18.0),
+                 0x22: signal_packet_payload_parser_factory(parse_10_bit_samples, "ecg", 250.0),
+                 0x24: signal_packet_payload_parser_factory(parse_16_bit_samples, "rr", 18.0),
+                 0x25: signal_packet_payload_parser_factory(parse_accelerometer_samples, "acceleration", 50.0),
+                 0x26: parse_hxm_message}
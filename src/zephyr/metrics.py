@@ -0,0 +1,168 @@
+
+import math
+import collections
+
+import zephyr.util
+
+
+class HeartRateVariabilityMetric:
+    """Rolling heart rate (beats per minute), SDNN and RMSSD (seconds) from
+    the heartbeat intervals of the latest window_seconds. Successive
+    differences are not taken over gaps in the heartbeats, e.g. when the
+    connection has been lost, and RMSSD is not output until the window has
+    successive differences again."""
+    
+    input_stream_name = "heartbeat_interval"
+    
+    def __init__(self, window_seconds=60.0, max_heartbeat_gap_seconds=3.0):
+        self.max_heartbeat_gap_seconds = max_heartbeat_gap_seconds
+        self.intervals = zephyr.util.SlidingWindow(window_seconds)
+        self.squared_interval_differences = zephyr.util.SlidingWindow(window_seconds)
+        self.previous_heartbeat = None
+    
+    def handle_value(self, timestamp, interval, output):
+        self.intervals.append(timestamp, interval)
+        
+        if self.previous_heartbeat is not None:
+            previous_timestamp, previous_interval = self.previous_heartbeat
+            
+            if timestamp - previous_timestamp <= self.max_heartbeat_gap_seconds:
+                interval_difference = interval - previous_interval
+                self.squared_interval_differences.append(timestamp, interval_difference * interval_difference)
+        
+        self.previous_heartbeat = (timestamp, interval)
+        self.squared_interval_differences.expire(timestamp)
+        
+        output("rolling_heart_rate", timestamp, 60.0 / self.intervals.mean)
+        
+        sdnn = self.intervals.standard_deviation
+        if sdnn is not None:
+            output("sdnn", timestamp, sdnn)
+        
+        if len(self.squared_interval_differences):
+            output("rmssd", timestamp, math.sqrt(max(0.0, self.squared_interval_differences.mean)))
+
+
+class RollingMeanMetric:
+    """The mean and the maximum of the values of an event stream during the
+    latest window_seconds, e.g. of the respiration rate or the activity
+    level of a BioHarness summary"""
+    def __init__(self, input_stream_name, window_seconds=60.0):
+        self.input_stream_name = input_stream_name
+        self.window = zephyr.util.SlidingWindow(window_seconds)
+        self.window_maximum = zephyr.util.SlidingWindowMaximum(window_seconds)
+    
+    def handle_value(self, timestamp, value, output):
+        self.window.append(timestamp, value)
+        self.window_maximum.append(timestamp, value)
+        
+        output("mean_" + self.input_stream_name, timestamp, self.window.mean)
+        output("max_" + self.input_stream_name, timestamp, self.window_maximum.maximum)
+
+
+class AccelerationVariabilityMetric:
+    """The standard deviation of the acceleration magnitude (g) during the
+    latest window_seconds, output once per signal packet"""
+    
+    input_stream_name = "acceleration"
+    
+    def __init__(self, window_seconds=10.0):
+        self.magnitudes = zephyr.util.SlidingWindow(window_seconds)
+    
+    def handle_signal(self, signal_packet, output):
+        samples = signal_packet.samples
+        
+        if not len(samples):
+            return
+        
+        if zephyr.util.USE_NUMPY:
+            numpy = zephyr.util.numpy
+            magnitudes = numpy.sqrt((numpy.asarray(samples, dtype=float) ** 2).sum(axis=1)).tolist()
+        else:
+            magnitudes = [math.sqrt(x * x + y * y + z * z) for x, y, z in samples]
+        
+        sample_period = 1.0 / signal_packet.samplerate
+        for sample_i, magnitude in enumerate(magnitudes):
+            sample_timestamp = signal_packet.timestamp + sample_i * sample_period
+            self.magnitudes.append(sample_timestamp, magnitude)
+        
+        standard_deviation = self.magnitudes.standard_deviation
+        if standard_deviation is not None:
+            output("acceleration_variability", sample_timestamp, standard_deviation)
+
+
+def create_default_metrics():
+    return [HeartRateVariabilityMetric(),
+            RollingMeanMetric("respiration_rate"),
+            RollingMeanMetric("activity"),
+            AccelerationVariabilityMetric()]
+
+
+class MetricsEngine:
+    """Maintains derived metrics of the signals and events of a device and
+    stores them as event streams of the collector, so that the current values
+    can be read without going through the history. The metrics are updated
+    in constant time per value. Use handle_signal, handle_event and
+    handle_events as callbacks next to the collector's.
+    
+    Event metrics have handle_value(timestamp, value, output) and signal
+    metrics handle_signal(signal_packet, output), where output(stream_name,
+    timestamp, value) adds a derived event."""
+    def __init__(self, collector, metrics=None):
+        self.collector = collector
+        
+        if metrics is None:
+            metrics = create_default_metrics()
+        
+        self.event_metrics = collections.defaultdict(list)
+        self.signal_metrics = collections.defaultdict(list)
+        
+        for metric in metrics:
+            if hasattr(metric, "handle_signal"):
+                self.signal_metrics[metric.input_stream_name].append(metric)
+            else:
+                self.event_metrics[metric.input_stream_name].append(metric)
+    
+    def _store_outputs(self, outputs):
+        for stream_name, (timestamps, values) in outputs.items():
+            self.collector.handle_events(stream_name, timestamps, values)
+    
+    def _create_output(self):
+        outputs = collections.OrderedDict()
+        
+        def output(stream_name, timestamp, value):
+            if stream_name not in outputs:
+                outputs[stream_name] = ([], [])
+            
+            timestamps, values = outputs[stream_name]
+            timestamps.append(timestamp)
+            values.append(value)
+        
+        return outputs, output
+    
+    def handle_signal(self, signal_packet, starts_new_stream):
+        metrics = self.signal_metrics.get(signal_packet.type)
+        
+        if metrics:
+            outputs, output = self._create_output()
+            
+            for metric in metrics:
+                metric.handle_signal(signal_packet, output)
+            
+            self._store_outputs(outputs)
+    
+    def handle_event(self, stream_name, value):
+        timestamp, event_value = value
+        self.handle_events(stream_name, [timestamp], [event_value])
+    
+    def handle_events(self, stream_name, timestamps, values):
+        metrics = self.event_metrics.get(stream_name)
+        
+        if metrics:
+            outputs, output = self._create_output()
+            
+            for timestamp, value in zip(timestamps, values):
+                for metric in metrics:
+                    metric.handle_value(timestamp, value, output)
+            
+            self._store_outputs(outputs)
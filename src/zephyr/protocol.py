@@ -1,224 +1,506 @@
-
-import csv
-import time
-import logging
-import threading
-
-import zephyr.util
-
-
-class MessageDataLogger:
-    def __init__(self, log_file_basepath):
-        self.data_file = file(log_file_basepath + ".dat", "wb")
-        self.timing_file = file(log_file_basepath + "-timing.csv", "wb")
-        self.timing_file_csv_writer = csv.writer(self.timing_file)
-        
-        self.time_before = None
-    
-    def __call__(self, stream_bytes):
-        if self.time_before is None:
-            self.time_before = zephyr.time()
-        
-        delay = zephyr.time() - self.time_before
-        
-        data_file_position = self.data_file.tell()
-        
-        if delay > 0.01 and data_file_position:
-            self.timing_file_csv_writer.writerow((self.time_before, data_file_position))
-            print self.time_before, data_file_position
-        
-        self.data_file.write(stream_bytes)
-        
-        self.time_before = zephyr.time()
-
-
-class Protocol(threading.Thread):
-    def __init__(self, connection, callbacks):
-        super(Protocol, self).__init__()
-        self.connection = connection
-        self.callbacks = callbacks
-        
-        self.initialization_messages = []
-        self.terminated = False
-    
-    def terminate(self):
-        self.terminated = True
-    
-    def add_initilization_message(self, message_id, payload):
-        message_frame = create_message_frame(message_id, payload)
-        
-        try:
-            self.connection.write(message_frame)
-        except ValueError:
-            self.initialization_messages.append(message_frame)
-    
-    def read_and_handle_byte(self):
-        data_string = self.connection.read(1)
-        
-        timeout_occurred = hasattr(self.connection, "timeout") and not len(data_string)
-        
-        if timeout_occurred:
-            logging.info("Timeout occurred, closing port")
-            self.connection.close()
-            
-            retries = 100
-            for retry_i in range(retries):
-                if self.terminated:
-                    break
-                
-                try:
-                    self.connection.open()
-                except Exception as e:
-                    logging.info("Re-opening port failed, retry %d (%s)", retry_i, e)
-                    time.sleep(1.0)
-                    continue
-                
-                logging.info("Re-opening port successful")
-                break
-            else:
-                raise OSError("Unable to re-open")
-        
-        for callback in self.callbacks:
-            callback(data_string)
-        
-        return data_string
-    
-    def run(self):
-        for message_frame in self.initialization_messages:
-            self.connection.write(message_frame)
-        
-        while not self.terminated:
-            self.read_and_handle_byte()
-
-
-class BioHarnessProtocol(Protocol):
-    def enable_ecg_waveform(self):
-        self.add_initilization_message(0x16, [1])
-    
-    def enable_breathing_waveform(self):
-        self.add_initilization_message(0x15, [1])
-    
-    def enable_rr_data(self):
-        self.add_initilization_message(0x19, [1])
-    
-    def enable_accelerometer_waveform(self):
-        self.add_initilization_message(0x1E, [1])
-    
-    def set_summary_packet_transmit_interval_to_one_second(self):
-        self.add_initilization_message(0xBD, [1, 0])
-    
-    def enable_periodic_packets(self):
-        self.enable_ecg_waveform()
-        self.enable_breathing_waveform()
-        self.enable_rr_data()
-        self.enable_accelerometer_waveform()
-        self.set_summary_packet_transmit_interval_to_one_second()
-
-
-def create_message_frame(message_id, payload):
-    dlc = len(payload)
-    assert 0 <= dlc <= 128
-    
-    crc_byte = zephyr.util.crc_8_digest(payload)
-    
-    message_bytes = [0x02, message_id, dlc] + payload + [crc_byte, 0x03]
-    
-    message_frame = "".join(chr(byte) for byte in message_bytes)
-    return message_frame
-
-
-class MessageFrame:
-    def __init__(self, message_id):
-        self.message_id = message_id
-        self.length = None
-        self.eom = None
-        self.payload = []
-    
-    def set_length(self, length):
-        assert self.length is None
-        self.length = length
-    
-    def set_ack(self, eom):
-        assert self.eom is None
-        self.eom = eom
-    
-    def byte_accepted(self):
-        return len(self.payload) < self.length
-    
-    def handle_byte(self, byte):
-        self.payload.append(byte)
-    
-    def get_crc(self):
-        calculated_crc = zephyr.util.crc_8_digest(self.payload)
-        return calculated_crc
-
-
-class ProtocolError(Exception):
-    pass
-
-
-class MessageFrameParser:
-    def __init__(self, callback):
-        self.callback = callback
-        self.handler = self.handle_stx
-        self.message = None
-    
-    def parse_data(self, data_string):
-        for char in data_string:
-            byte = ord(char)
-            try:
-                self.handler(byte)
-            except ProtocolError, e:
-                logging.warning("ProtocolError: %s", e)
-                self.handler = self.handle_stx
-                self.message = None
-    
-    def handle_stx(self, byte):
-        """Handle the start of message byte. Continue to handling the message id
-        if the byte is found."""
-        if byte == 0x02:
-            self.handler = self.handle_msgid
-    
-    def handle_msgid(self, byte):
-        """Handle the message id. Continue to handling the payload length byte."""
-        self.message = MessageFrame(byte)
-        self.handler = self.handle_dlc
-    
-    def handle_dlc(self, byte):
-        """Handle the payload length. Continue to handling the payload."""
-        payload_length = byte
-        
-        if not 0 <= payload_length <= 128:
-            raise ProtocolError("Incorrect data length")
-        
-        self.message.set_length(payload_length)
-        
-        self.handler = self.handle_payload
-    
-    def handle_payload(self, byte):
-        """Handle a payload byte of the CRC byte. Continue to handling the end
-        of message byte of another payload byte."""
-        if self.message.byte_accepted():
-            self.message.handle_byte(byte)
-        else:
-            calculated_crc = self.message.get_crc()
-            
-            if byte != calculated_crc:
-                raise ProtocolError("CRC does not match")
-            
-            self.handler = self.handle_eom
-    
-    def handle_eom(self, byte):
-        """Handle the end of message byte. Continue to handling the start
-        of message byte."""
-        status_dict = {0x03: "ETX", 0x06: "ACK", 0x15: "NAK"}
-        status = status_dict.get(byte)
-        
-        if status is None:
-            raise ProtocolError("Invalid ACK byte")
-        
-        self.message.set_ack(status)
-        self.callback(self.message)
-        self.message = None
-        
-        self.handler = self.handle_stx
+
+import csv
+import time
+import atexit
+import logging
+import threading
+import collections
+
+import zephyr.util
+
+
+class MessageDataLogger:
+    """Logs a data stream to a .dat file, and the arrival times of the data
+    to a -timing.csv file. The logger is called with the received data, and
+    writes it to the files at once.
+    
+    After start_flushing, the call only appends the data to an in-memory
+    buffer, and a background thread writes the buffer to the files when it
+    has grown to flush_byte_count bytes or at least every flush_interval
+    seconds. Then close must be called to write the rest of the buffer; it
+    is also called when the interpreter exits.
+    
+    If rotate_byte_count or rotate_seconds is given, a new pair of files is
+    started when the current data file reaches that size or age. The n:th
+    additional pair is named with the suffix -n, e.g. log-1.dat and
+    log-1-timing.csv."""
+    
+    def __init__(self, log_file_basepath, flush_interval=1.0, flush_byte_count=65536,
+                 rotate_byte_count=None, rotate_seconds=None):
+        self.log_file_basepath = log_file_basepath
+        self.flush_interval = flush_interval
+        self.flush_byte_count = flush_byte_count
+        self.rotate_byte_count = rotate_byte_count
+        self.rotate_seconds = rotate_seconds
+        
+        # Written by the reading thread
+        self.time_before = None
+        self.file_index = 0
+        self.file_start_time = None
+        self.file_byte_count = 0
+        
+        # (file index, timing row or None, data) tuples waiting to be written
+        # by the flushing thread. The deque is appended to by the reading
+        # thread and consumed by the flushing thread without a lock.
+        self.buffer = collections.deque()
+        self.buffered_byte_count = 0
+        self.written_byte_count = 0
+        self.flush_event = threading.Event()
+        self.flushing_thread = None
+        
+        # Written by the thread that writes the files
+        self.write_lock = threading.Lock()
+        self.open_file_index = None
+        self.data_file = None
+        self.timing_file = None
+        self.timing_file_csv_writer = None
+        self.open_files(0)
+        
+        self.terminate_requested = False
+    
+    def get_log_file_basepath(self, file_index):
+        if file_index == 0:
+            return self.log_file_basepath
+        else:
+            return "%s-%d" % (self.log_file_basepath, file_index)
+    
+    def needs_rotation(self, now):
+        if not self.file_byte_count:
+            return False
+        
+        if self.rotate_byte_count is not None and self.file_byte_count >= self.rotate_byte_count:
+            return True
+        
+        if self.rotate_seconds is not None and now - self.file_start_time >= self.rotate_seconds:
+            return True
+        
+        return False
+    
+    def __call__(self, stream_bytes):
+        now = zephyr.time()
+        
+        if self.time_before is None:
+            self.time_before = now
+            self.file_start_time = now
+        
+        if self.needs_rotation(now):
+            self.file_index += 1
+            self.file_start_time = now
+            self.file_byte_count = 0
+        
+        delay = now - self.time_before
+        
+        if delay > 0.01 and self.file_byte_count:
+            timing_row = (self.time_before, self.file_byte_count)
+        else:
+            timing_row = None
+        
+        self.file_byte_count += len(stream_bytes)
+        self.time_before = now
+        
+        if self.flushing_thread is None:
+            self.write_entry(self.file_index, timing_row, stream_bytes)
+            return
+        
+        self.buffer.append((self.file_index, timing_row, stream_bytes))
+        self.buffered_byte_count += len(stream_bytes)
+        
+        if (self.buffered_byte_count - self.written_byte_count >= self.flush_byte_count and
+                not self.flush_event.is_set()):
+            self.flush_event.set()
+    
+    def open_files(self, file_index):
+        self.close_files()
+        
+        log_file_basepath = self.get_log_file_basepath(file_index)
+        self.data_file = open(log_file_basepath + ".dat", "wb")
+        self.timing_file = open(log_file_basepath + "-timing.csv", "wb")
+        self.timing_file_csv_writer = csv.writer(self.timing_file)
+        self.open_file_index = file_index
+    
+    def close_files(self):
+        if self.data_file is not None:
+            self.data_file.close()
+            self.timing_file.close()
+            self.data_file = None
+            self.timing_file = None
+    
+    def write_entry(self, file_index, timing_row, stream_bytes):
+        if file_index != self.open_file_index:
+            self.open_files(file_index)
+        
+        if timing_row is not None:
+            self.timing_file_csv_writer.writerow(timing_row)
+        
+        self.data_file.write(stream_bytes)
+    
+    def flush(self):
+        """Write the buffered data to the files"""
+        with self.write_lock:
+            data_chunks = []
+            
+            for item_i in xrange(len(self.buffer)):  #@UnusedVariable
+                file_index, timing_row, stream_bytes = self.buffer.popleft()
+                self.written_byte_count += len(stream_bytes)
+                
+                if file_index != self.open_file_index:
+                    if data_chunks:
+                        self.data_file.write("".join(data_chunks))
+                        data_chunks = []
+                    
+                    self.open_files(file_index)
+                
+                if timing_row is not None:
+                    self.timing_file_csv_writer.writerow(timing_row)
+                
+                data_chunks.append(stream_bytes)
+            
+            if data_chunks:
+                self.data_file.write("".join(data_chunks))
+            
+            if self.data_file is not None:
+                self.data_file.flush()
+                self.timing_file.flush()
+    
+    def start_flushing(self):
+        """Move the file writes from the calls to a background thread"""
+        self.flushing_thread = threading.Thread(target=self.run_flushing)
+        self.flushing_thread.daemon = True
+        self.flushing_thread.start()
+        
+        # The daemon thread would leave the buffer unwritten at exit
+        atexit.register(self.close)
+    
+    def terminate(self):
+        self.terminate_requested = True
+        self.flush_event.set()
+    
+    def close(self):
+        """Stop the flushing thread if it is running, and write the remaining
+        data"""
+        if self.flushing_thread is not None and self.flushing_thread.is_alive():
+            self.terminate()
+            self.flushing_thread.join()
+        
+        self.flush()
+        
+        with self.write_lock:
+            self.close_files()
+    
+    def run_flushing(self):
+        while not self.terminate_requested:
+            zephyr.wait(self.flush_event, self.flush_interval)
+            self.flush_event.clear()
+            
+            self.flush()
+
+
+class Protocol(threading.Thread):
+    def __init__(self, connection, callbacks, read_chunk_size=1, read_timeout=None):
+        super(Protocol, self).__init__()
+        self.connection = connection
+        self.callbacks = callbacks
+        self.read_chunk_size = read_chunk_size
+        
+        if read_timeout is not None:
+            self.connection.timeout = read_timeout
+        
+        self.initialization_messages = []
+        self.terminated = False
+    
+    def terminate(self):
+        self.terminated = True
+    
+    def add_initilization_message(self, message_id, payload):
+        message_frame = create_message_frame(message_id, payload)
+        
+        try:
+            self.connection.write(message_frame)
+        except ValueError:
+            self.initialization_messages.append(message_frame)
+    
+    def reopen_connection(self):
+        logging.info("Timeout occurred, closing port")
+        self.connection.close()
+        
+        retries = 100
+        for retry_i in range(retries):
+            if self.terminated:
+                break
+            
+            try:
+                self.connection.open()
+            except Exception as e:
+                logging.info("Re-opening port failed, retry %d (%s)", retry_i, e)
+                time.sleep(1.0)
+                continue
+            
+            logging.info("Re-opening port successful")
+            break
+        else:
+            raise OSError("Unable to re-open")
+    
+    def read_available_bytes(self, max_byte_count):
+        """Read the bytes that are already waiting in the connection, but at
+        most max_byte_count bytes. If nothing is waiting, block until one byte
+        arrives or the connection times out."""
+        if max_byte_count > 1 and hasattr(self.connection, "inWaiting"):
+            byte_count = min(max(self.connection.inWaiting(), 1), max_byte_count)
+        else:
+            byte_count = max_byte_count
+        
+        return self.connection.read(byte_count)
+    
+    def read_and_handle_bytes(self, max_byte_count):
+        data_string = self.read_available_bytes(max_byte_count)
+        
+        timeout_occurred = hasattr(self.connection, "timeout") and not len(data_string)
+        
+        if timeout_occurred:
+            self.reopen_connection()
+        
+        for callback in self.callbacks:
+            callback(data_string)
+        
+        return data_string
+    
+    def read_and_handle_byte(self):
+        return self.read_and_handle_bytes(1)
+    
+    def run(self):
+        for message_frame in self.initialization_messages:
+            self.connection.write(message_frame)
+        
+        while not self.terminated:
+            self.read_and_handle_bytes(self.read_chunk_size)
+
+
+class BioHarnessCommands:
+    """Initialization messages of the BioHarness, for protocol classes that
+    implement add_initilization_message"""
+    def enable_ecg_waveform(self):
+        self.add_initilization_message(0x16, [1])
+    
+    def enable_breathing_waveform(self):
+        self.add_initilization_message(0x15, [1])
+    
+    def enable_rr_data(self):
+        self.add_initilization_message(0x19, [1])
+    
+    def enable_accelerometer_waveform(self):
+        self.add_initilization_message(0x1E, [1])
+    
+    def set_summary_packet_transmit_interval_to_one_second(self):
+        self.add_initilization_message(0xBD, [1, 0])
+    
+    def enable_periodic_packets(self):
+        self.enable_ecg_waveform()
+        self.enable_breathing_waveform()
+        self.enable_rr_data()
+        self.enable_accelerometer_waveform()
+        self.set_summary_packet_transmit_interval_to_one_second()
+
+
+class BioHarnessProtocol(Protocol, BioHarnessCommands):
+    pass
+
+
+def create_message_frame(message_id, payload):
+    dlc = len(payload)
+    assert 0 <= dlc <= 128
+    
+    crc_byte = zephyr.util.crc_8_digest(payload)
+    
+    message_bytes = [0x02, message_id, dlc] + payload + [crc_byte, 0x03]
+    
+    message_frame = "".join(chr(byte) for byte in message_bytes)
+    return message_frame
+
+
+class MessageFrame(object):
+    __slots__ = ("message_id", "length", "eom", "payload", "stream_offset")
+    
+    def __init__(self, message_id):
+        self.message_id = message_id
+        self.length = None
+        self.eom = None
+        self.payload = bytearray()
+        
+        # Position of the start of message byte in the data stream, if known
+        self.stream_offset = None
+    
+    def set_length(self, length):
+        assert self.length is None
+        self.length = length
+    
+    def set_ack(self, eom):
+        assert self.eom is None
+        self.eom = eom
+    
+    def byte_accepted(self):
+        return len(self.payload) < self.length
+    
+    def handle_byte(self, byte):
+        self.payload.append(byte)
+    
+    def get_crc(self):
+        calculated_crc = zephyr.util.crc_8_digest(self.payload)
+        return calculated_crc
+
+
+class ProtocolError(Exception):
+    pass
+
+
+class CrcError(ProtocolError):
+    pass
+
+
+END_OF_MESSAGE_STATUSES = {0x03: "ETX", 0x06: "ACK", 0x15: "NAK"}
+
+
+def report_protocol_error(error, instrumentation):
+    """Log a ProtocolError, and count it if the parser has a
+    zephyr.instrumentation.PipelineInstrumentation"""
+    logging.warning("ProtocolError: %s", error)
+    
+    if instrumentation is not None:
+        instrumentation.count("protocol_errors")
+        
+        if isinstance(error, CrcError):
+            instrumentation.count("crc_failures")
+
+
+class MessageFrameParser:
+    def __init__(self, callback, instrumentation=None):
+        self.callback = callback
+        self.instrumentation = instrumentation
+        self.handler = self.handle_stx
+        self.message = None
+    
+    def parse_data(self, data_string):
+        for char in data_string:
+            byte = ord(char)
+            try:
+                self.handler(byte)
+            except ProtocolError, e:
+                report_protocol_error(e, self.instrumentation)
+                self.handler = self.handle_stx
+                self.message = None
+    
+    def handle_stx(self, byte):
+        """Handle the start of message byte. Continue to handling the message id
+        if the byte is found."""
+        if byte == 0x02:
+            self.handler = self.handle_msgid
+    
+    def handle_msgid(self, byte):
+        """Handle the message id. Continue to handling the payload length byte."""
+        self.message = MessageFrame(byte)
+        self.handler = self.handle_dlc
+    
+    def handle_dlc(self, byte):
+        """Handle the payload length. Continue to handling the payload."""
+        payload_length = byte
+        
+        if not 0 <= payload_length <= 128:
+            raise ProtocolError("Incorrect data length")
+        
+        self.message.set_length(payload_length)
+        
+        self.handler = self.handle_payload
+    
+    def handle_payload(self, byte):
+        """Handle a payload byte of the CRC byte. Continue to handling the end
+        of message byte of another payload byte."""
+        if self.message.byte_accepted():
+            self.message.handle_byte(byte)
+        else:
+            calculated_crc = self.message.get_crc()
+            
+            if byte != calculated_crc:
+                raise CrcError("CRC does not match")
+            
+            self.handler = self.handle_eom
+    
+    def handle_eom(self, byte):
+        """Handle the end of message byte. Continue to handling the start
+        of message byte."""
+        status = END_OF_MESSAGE_STATUSES.get(byte)
+        
+        if status is None:
+            raise ProtocolError("Invalid ACK byte")
+        
+        self.message.set_ack(status)
+        self.callback(self.message)
+        self.message = None
+        
+        self.handler = self.handle_stx
+
+
+class BufferedMessageFrameParser:
+    """A message frame parser that scans whole data buffers for frames
+    instead of handling the data one byte at a time. Produces the same
+    message frames as MessageFrameParser. Incomplete frames at the end of
+    the data are kept and completed by the next call to parse_data."""
+    def __init__(self, callback, instrumentation=None):
+        self.callback = callback
+        self.instrumentation = instrumentation
+        self.buffer = bytearray()
+        
+        # Position of the beginning of the buffer in the data stream
+        self.buffer_offset = 0
+    
+    def parse_data(self, data_string):
+        buffer = self.buffer
+        buffer.extend(data_string)
+        buffer_length = len(buffer)
+        
+        position = 0
+        while True:
+            stx_position = buffer.find("\x02", position)
+            
+            if stx_position == -1:
+                position = buffer_length
+                break
+            
+            dlc_position = stx_position + 2
+            if dlc_position >= buffer_length:
+                position = stx_position
+                break
+            
+            payload_length = buffer[dlc_position]
+            if payload_length > 128:
+                report_protocol_error(ProtocolError("Incorrect data length"), self.instrumentation)
+                position = dlc_position + 1
+                continue
+            
+            crc_position = dlc_position + 1 + payload_length
+            eom_position = crc_position + 1
+            if eom_position >= buffer_length:
+                position = stx_position
+                break
+            
+            payload = buffer[dlc_position + 1:crc_position]
+            
+            if buffer[crc_position] != zephyr.util.crc_8_digest(payload):
+                report_protocol_error(CrcError("CRC does not match"), self.instrumentation)
+                position = crc_position + 1
+                continue
+            
+            position = eom_position + 1
+            
+            status = END_OF_MESSAGE_STATUSES.get(buffer[eom_position])
+            if status is None:
+                report_protocol_error(ProtocolError("Invalid ACK byte"), self.instrumentation)
+                continue
+            
+            message = MessageFrame(buffer[stx_position + 1])
+            message.set_length(payload_length)
+            message.payload = payload
+            message.set_ack(status)
+            message.stream_offset = self.buffer_offset + stx_position
+            self.callback(message)
+        
+        del buffer[:position]
+        self.buffer_offset += position
@@ -0,0 +1,293 @@
+
+import csv
+import sys
+import mmap
+import array
+import struct
+import bisect
+import collections
+
+import zephyr.util
+from zephyr.message import MESSAGE_TYPES
+from zephyr.protocol import BufferedMessageFrameParser
+from zephyr.replay import get_timing_data_path, read_timing_data
+
+
+# An indexed recording contains the raw data stream and the timing entries
+# of a .dat and -timing.csv pair, and an index of the message frames in the
+# stream. All the sections are stored as little-endian columns:
+#
+# Header
+# Stream data, padded to a multiple of 8 bytes
+# Timing timestamps (double) and cumulative byte counts (uint64)
+# Frame arrival times (double), device timestamps (double, NaN if the
+# message has none), stream offsets (uint32) and message ids (uint8)
+#
+# The frame arrival times are non-decreasing, so frames are looked up by
+# arrival time with bisection directly from the memory-mapped file.
+
+RECORDING_MAGIC = "ZEPHYRRC"
+RECORDING_VERSION = 1
+
+# Magic, version, stream byte count, timing entry count and frame count
+RECORDING_HEADER = struct.Struct("<8sIQQQ4x")
+
+TIMESTAMPED_MESSAGE_IDS = set([0x21, 0x22, 0x24, 0x25, 0x2B])
+
+SIGNAL_MESSAGE_IDS = {"breathing": 0x21, "ecg": 0x22, "rr": 0x24, "acceleration": 0x25}
+
+FrameColumns = collections.namedtuple("FrameColumns", ["arrival_times", "device_timestamps",
+                                                       "stream_offsets", "message_ids"])
+
+
+class RecordingFormatError(Exception):
+    pass
+
+
+def _column_to_string(column):
+    if sys.byteorder == "big":
+        column = array.array(column.typecode, column)
+        column.byteswap()
+    
+    return column.tostring()
+
+
+def _padding(byte_count):
+    return "\x00" * (-byte_count % 8)
+
+
+def get_device_timestamp(message_frame):
+    if message_frame.message_id in TIMESTAMPED_MESSAGE_IDS:
+        return zephyr.util.parse_timestamp(message_frame.payload, 1)
+    else:
+        return float("nan")
+
+
+def index_stream_data(stream_data, timestamps, cumulative_byte_counts):
+    """Find the message frames of a data stream. Returns the frame columns as
+    arrays. A frame arrives with the timing entry that covers its last byte."""
+    frame_columns = FrameColumns(array.array("d"), array.array("d"), array.array("I"), array.array("B"))
+    
+    if not len(timestamps):
+        raise RecordingFormatError("No timing entries")
+    
+    def handle_frame(message_frame):
+        frame_end = message_frame.stream_offset + len(message_frame.payload) + 5
+        timing_index = bisect.bisect_left(cumulative_byte_counts, frame_end)
+        arrival_time = timestamps[min(timing_index, len(timestamps) - 1)]
+        
+        if len(frame_columns.arrival_times):
+            arrival_time = max(arrival_time, frame_columns.arrival_times[-1])
+        
+        frame_columns.arrival_times.append(arrival_time)
+        frame_columns.device_timestamps.append(get_device_timestamp(message_frame))
+        frame_columns.stream_offsets.append(message_frame.stream_offset)
+        frame_columns.message_ids.append(message_frame.message_id)
+    
+    BufferedMessageFrameParser(handle_frame).parse_data(stream_data)
+    
+    return frame_columns
+
+
+def write_recording(recording_path, stream_data, timestamps, cumulative_byte_counts):
+    if len(stream_data) >= 2**32:
+        raise RecordingFormatError("Data streams over 4 GiB are not supported")
+    
+    frame_columns = index_stream_data(stream_data, timestamps, cumulative_byte_counts)
+    
+    with open(recording_path, "wb") as recording_file:
+        recording_file.write(RECORDING_HEADER.pack(RECORDING_MAGIC, RECORDING_VERSION, len(stream_data),
+                                                   len(timestamps), len(frame_columns.arrival_times)))
+        recording_file.write(stream_data)
+        recording_file.write(_padding(len(stream_data)))
+        
+        recording_file.write(_column_to_string(array.array("d", timestamps)))
+        recording_file.write(struct.pack("<%dQ" % len(cumulative_byte_counts), *cumulative_byte_counts))
+        
+        for column in frame_columns:
+            recording_file.write(_column_to_string(column))
+
+
+def convert_to_recording(stream_data_path, recording_path, timing_data_path=None):
+    """Create an indexed recording from a .dat and -timing.csv file pair"""
+    if timing_data_path is None:
+        timing_data_path = get_timing_data_path(stream_data_path)
+    
+    with open(stream_data_path, "rb") as stream_data_file:
+        stream_data = stream_data_file.read()
+    
+    timestamps, cumulative_byte_counts = read_timing_data(timing_data_path)
+    write_recording(recording_path, stream_data, timestamps, cumulative_byte_counts)
+
+
+def convert_from_recording(recording_path, stream_data_path, timing_data_path=None):
+    """Write the .dat and -timing.csv file pair of an indexed recording in the
+    format of MessageDataLogger"""
+    if timing_data_path is None:
+        timing_data_path = get_timing_data_path(stream_data_path)
+    
+    recording = IndexedRecording(recording_path)
+    
+    try:
+        with open(stream_data_path, "wb") as stream_data_file:
+            stream_data_file.write(recording.read_stream_data())
+        
+        with open(timing_data_path, "wb") as timing_file:
+            timing_file_csv_writer = csv.writer(timing_file)
+            for timing_entry in zip(*recording.read_timing_data()):
+                timing_file_csv_writer.writerow(timing_entry)
+    finally:
+        recording.close()
+
+
+class _FileColumn:
+    """A read-only sequence view of a column in a memory-mapped file, for
+    bisection without reading the whole column"""
+    def __init__(self, buffer, position, value_format, length):
+        self.buffer = buffer
+        self.position = position
+        self.value_struct = struct.Struct("<" + value_format)
+        self.length = length
+    
+    def __len__(self):
+        return self.length
+    
+    def __getitem__(self, index):
+        if not 0 <= index < self.length:
+            raise IndexError("Column index out of range")
+        
+        return self.value_struct.unpack_from(self.buffer, self.position + index * self.value_struct.size)[0]
+
+
+class IndexedRecording:
+    """Random access to an indexed recording by arrival time. Frames are
+    found in O(log n) time, and windows are read as columns."""
+    def __init__(self, recording_path):
+        with open(recording_path, "rb") as recording_file:
+            self.buffer = mmap.mmap(recording_file.fileno(), 0, access=mmap.ACCESS_READ)
+        
+        if len(self.buffer) < RECORDING_HEADER.size:
+            raise RecordingFormatError("Truncated header")
+        
+        (magic, version, self.stream_byte_count,
+         self.timing_entry_count, self.frame_count) = RECORDING_HEADER.unpack_from(self.buffer)
+        
+        if magic != RECORDING_MAGIC:
+            raise RecordingFormatError("Not an indexed recording")
+        
+        if version != RECORDING_VERSION:
+            raise RecordingFormatError("Unsupported version %d" % version)
+        
+        self.stream_data_position = RECORDING_HEADER.size
+        self.timestamps_position = self.stream_data_position + self.stream_byte_count + (-self.stream_byte_count % 8)
+        self.byte_counts_position = self.timestamps_position + 8 * self.timing_entry_count
+        self.arrival_times_position = self.byte_counts_position + 8 * self.timing_entry_count
+        self.device_timestamps_position = self.arrival_times_position + 8 * self.frame_count
+        self.stream_offsets_position = self.device_timestamps_position + 8 * self.frame_count
+        self.message_ids_position = self.stream_offsets_position + 4 * self.frame_count
+        
+        if len(self.buffer) < self.message_ids_position + self.frame_count:
+            raise RecordingFormatError("Truncated recording")
+        
+        self.arrival_times = _FileColumn(self.buffer, self.arrival_times_position, "d", self.frame_count)
+    
+    def __len__(self):
+        return self.frame_count
+    
+    def close(self):
+        self.buffer.close()
+    
+    def _read_column(self, column_position, typecode, start_index, end_index):
+        column = array.array(typecode)
+        column.fromstring(self.buffer[column_position + start_index * column.itemsize:
+                                      column_position + end_index * column.itemsize])
+        
+        if sys.byteorder == "big":
+            column.byteswap()
+        
+        return column
+    
+    def read_stream_data(self):
+        return self.buffer[self.stream_data_position:self.stream_data_position + self.stream_byte_count]
+    
+    def read_timing_data(self):
+        timestamps = self._read_column(self.timestamps_position, "d", 0, self.timing_entry_count)
+        cumulative_byte_counts = struct.unpack_from("<%dQ" % self.timing_entry_count,
+                                                    self.buffer, self.byte_counts_position)
+        return timestamps, list(cumulative_byte_counts)
+    
+    def find_frames(self, start_time, end_time):
+        """Return the index range of the frames that arrived between the given
+        times (inclusive)"""
+        start_index = bisect.bisect_left(self.arrival_times, start_time)
+        end_index = bisect.bisect_right(self.arrival_times, end_time, start_index)
+        return start_index, end_index
+    
+    def read_frame_columns(self, start_index, end_index):
+        return FrameColumns(self._read_column(self.arrival_times_position, "d", start_index, end_index),
+                            self._read_column(self.device_timestamps_position, "d", start_index, end_index),
+                            self._read_column(self.stream_offsets_position, "I", start_index, end_index),
+                            self._read_column(self.message_ids_position, "B", start_index, end_index))
+    
+    def read_window(self, start_time, end_time):
+        return self.read_frame_columns(*self.find_frames(start_time, end_time))
+    
+    def get_payload(self, stream_offset):
+        """Return the payload of the frame at the given stream offset"""
+        position = self.stream_data_position + stream_offset
+        payload_length = ord(self.buffer[position + 2])
+        return bytearray(self.buffer[position + 3:position + 3 + payload_length])
+    
+    def iterate_messages(self, start_time, end_time):
+        """Parse the messages that arrived between the given times. Yields
+        (arrival_time, message) tuples."""
+        frame_columns = self.read_window(start_time, end_time)
+        
+        for arrival_time, stream_offset, message_id in zip(frame_columns.arrival_times,
+                                                           frame_columns.stream_offsets,
+                                                           frame_columns.message_ids):
+            handler = MESSAGE_TYPES.get(message_id)
+            if handler is not None:
+                yield arrival_time, handler(self.get_payload(stream_offset))
+    
+    def read_signal(self, stream_type, start_time, end_time):
+        """Return the device timestamps and the samples of a signal from the
+        packets that arrived between the given times. The samples are returned
+        as NumPy arrays if NumPy is used, and otherwise as arrays of floats
+        with the components of multi-component samples as consecutive
+        values."""
+        message_id = SIGNAL_MESSAGE_IDS[stream_type]
+        parse_signal_packet = MESSAGE_TYPES[message_id]
+        frame_columns = self.read_window(start_time, end_time)
+        
+        timestamps = array.array("d")
+        sample_parts = []
+        
+        for stream_offset, frame_message_id in zip(frame_columns.stream_offsets, frame_columns.message_ids):
+            if frame_message_id == message_id:
+                signal_packet = parse_signal_packet(self.get_payload(stream_offset))
+                sample_count = len(signal_packet.samples)
+                
+                timestamps.extend(signal_packet.timestamp + sample_i / signal_packet.samplerate
+                                  for sample_i in xrange(sample_count))
+                sample_parts.append(signal_packet.samples)
+        
+        if zephyr.util.USE_NUMPY:
+            numpy = zephyr.util.numpy
+            
+            if sample_parts:
+                samples = numpy.concatenate(sample_parts)
+            else:
+                samples = numpy.zeros((0, 3) if stream_type == "acceleration" else 0)
+            
+            return numpy.frombuffer(timestamps, dtype=float), samples
+        
+        samples = array.array("d")
+        for samples_part in sample_parts:
+            if stream_type == "acceleration":
+                for sample in samples_part:
+                    samples.extend(sample)
+            else:
+                samples.extend(samples_part)
+        
+        return timestamps, samples
@@ -0,0 +1,170 @@
+
+import os
+import csv
+import mmap
+import time
+import array
+
+from zephyr.collector import MeasurementCollector
+from zephyr.bioharness import BioHarnessSignalAnalysis, BioHarnessPacketHandler
+from zephyr.hxm import HxMPacketAnalysis
+from zephyr.instrumentation import instrument
+from zephyr.message import MessagePayloadParser
+from zephyr.protocol import BufferedMessageFrameParser
+
+
+def get_timing_data_path(stream_data_path):
+    """Return the timing file path that MessageDataLogger uses for a data file"""
+    return os.path.splitext(stream_data_path)[0] + "-timing.csv"
+
+
+def read_timing_data(timing_data_path):
+    """Read a timing file into arrays of arrival timestamps and cumulative
+    byte counts. The bytes before each byte count have arrived by the
+    corresponding timestamp."""
+    timestamps = array.array("d")
+    cumulative_byte_counts = array.array("l")
+    
+    with open(timing_data_path, "rb") as timing_file:
+        for timestamp_str, byte_count_str in csv.reader(timing_file):
+            timestamps.append(float(timestamp_str))
+            cumulative_byte_counts.append(int(byte_count_str))
+    
+    return timestamps, cumulative_byte_counts
+
+
+class VirtualClock:
+    """A clock for the time_function arguments of the analysis classes, set
+    to the arrival time of the replayed data"""
+    def __init__(self, now=0.0):
+        self.now = now
+    
+    def time(self):
+        return self.now
+
+
+class ReplayStatistics:
+    def __init__(self, byte_count, packet_count, duration):
+        self.byte_count = byte_count
+        self.packet_count = packet_count
+        self.duration = duration
+    
+    @property
+    def megabytes_per_second(self):
+        return self.byte_count / 1e6 / self.duration
+    
+    @property
+    def packets_per_second(self):
+        return self.packet_count / self.duration
+    
+    def __str__(self):
+        return "%d bytes, %d packets in %.3f s: %.2f MB/s, %.0f packets/s" % (self.byte_count, self.packet_count,
+                                                                             self.duration,
+                                                                             self.megabytes_per_second,
+                                                                             self.packets_per_second)
+
+
+class ReplayEngine:
+    """Replays a recorded data file as fast as possible. Instead of sleeping
+    until the recorded arrival times like TimedVirtualSerial, the clock is set
+    to the arrival time of each chunk of data before it is passed to the
+    callbacks. Bytes after the last timing entry arrive at the last recorded
+    timestamp."""
+    def __init__(self, stream_data_path, callbacks, clock, timing_data_path=None, use_mmap=True):
+        self.stream_data_path = stream_data_path
+        self.callbacks = callbacks
+        self.clock = clock
+        
+        if timing_data_path is None:
+            timing_data_path = get_timing_data_path(stream_data_path)
+        
+        self.timestamps, self.cumulative_byte_counts = read_timing_data(timing_data_path)
+        self.use_mmap = use_mmap
+    
+    def read_stream_data(self):
+        with open(self.stream_data_path, "rb") as input_file:
+            file_size = os.fstat(input_file.fileno()).st_size
+            
+            if self.use_mmap and file_size:
+                return mmap.mmap(input_file.fileno(), 0, access=mmap.ACCESS_READ)
+            else:
+                return input_file.read()
+    
+    def iterate_chunks(self):
+        """Yield (arrival_timestamp, data) for each chunk of the data file"""
+        stream_data = self.read_stream_data()
+        
+        try:
+            chunk_start = 0
+            
+            for chunk_timestamp, chunk_end in zip(self.timestamps, self.cumulative_byte_counts):
+                if chunk_end > chunk_start:
+                    yield chunk_timestamp, stream_data[chunk_start:chunk_end]
+                    chunk_start = chunk_end
+            
+            if chunk_start < len(stream_data) and len(self.timestamps):
+                yield self.timestamps[-1], stream_data[chunk_start:]
+        finally:
+            if isinstance(stream_data, mmap.mmap):
+                stream_data.close()
+    
+    def run(self):
+        """Replay the file and return the number of bytes replayed"""
+        byte_count = 0
+        
+        for chunk_timestamp, data in self.iterate_chunks():
+            self.clock.now = chunk_timestamp
+            
+            for callback in self.callbacks:
+                callback(data)
+            
+            byte_count += len(data)
+        
+        return byte_count
+
+
+def replay_measurement(stream_data_path, timing_data_path=None, use_mmap=True, history_length_seconds=1e9,
+                       instrumentation=None):
+    """Analyze a recorded BioHarness or HxM data file with the same pipeline
+    as simulation_workflow, but faster than real time. Returns the
+    MeasurementCollector and the ReplayStatistics. The stages of the
+    pipeline are profiled if a
+    zephyr.instrumentation.PipelineInstrumentation is given."""
+    clock = VirtualClock()
+    collector = MeasurementCollector(history_length_seconds, clock.time)
+    
+    handle_signal = instrument(instrumentation, "collector_signals", collector.handle_signal)
+    handle_event = instrument(instrumentation, "collector_events", collector.handle_event)
+    handle_events = instrument(instrumentation, "collector_event_batches", collector.handle_events)
+    
+    rr_signal_analysis = BioHarnessSignalAnalysis([], [], [handle_events])
+    
+    signal_packet_handler_bh = BioHarnessPacketHandler([handle_signal,
+                                                        instrument(instrumentation, "rr_analysis",
+                                                                   rr_signal_analysis.handle_signal)],
+                                                       [handle_event], time_function=clock.time,
+                                                       instrumentation=instrumentation)
+    signal_packet_handler_hxm = HxMPacketAnalysis([handle_event], clock.time)
+    
+    payload_parser = MessagePayloadParser([instrument(instrumentation, "bioharness_packet_handler",
+                                                      signal_packet_handler_bh.handle_packet),
+                                           instrument(instrumentation, "hxm_packet_handler",
+                                                      signal_packet_handler_hxm.handle_packet)])
+    
+    packet_counter = [0]
+    def handle_message(message_frame):
+        packet_counter[0] += 1
+        payload_parser.handle_message(message_frame)
+    
+    message_parser = BufferedMessageFrameParser(instrument(instrumentation, "payload_parser", handle_message),
+                                                instrumentation)
+    
+    replay_engine = ReplayEngine(stream_data_path, [instrument(instrumentation, "frame_parser",
+                                                               message_parser.parse_data, len)],
+                                 clock, timing_data_path, use_mmap)
+    
+    start_time = time.time()
+    byte_count = replay_engine.run()
+    duration = time.time() - start_time
+    
+    return collector, ReplayStatistics(byte_count, packet_counter[0], duration)
@@ -0,0 +1,471 @@
+
+import os
+import csv
+import math
+import time
+import heapq
+import bisect
+import random
+import threading
+
+import zephyr
+import zephyr.util
+from zephyr.message import SUMMARY_PAYLOAD_LAYOUT, HXM_PAYLOAD_LAYOUT
+from zephyr.protocol import create_message_frame
+
+
+# Message id: samplerate, samples per packet and the payload length of the
+# signal packets of a BioHarness
+SIGNAL_MESSAGES = {0x21: (18.0, 18, 32),
+                   0x22: (250.0, 63, 88),
+                   0x24: (18.0, 18, 45),
+                   0x25: (50.0, 20, 84)}
+
+SUMMARY_MESSAGE_ID = 0x2B
+SUMMARY_PAYLOAD_LENGTH = 71
+
+HXM_MESSAGE_ID = 0x26
+HXM_PAYLOAD_LENGTH = 55
+HXM_MESSAGE_INTERVAL = 1.0
+
+BIOHARNESS_MESSAGE_IDS = (0x22, 0x21, 0x24, 0x25, SUMMARY_MESSAGE_ID)
+HXM_MESSAGE_IDS = (HXM_MESSAGE_ID,)
+
+# 10-bit raw value of one g in the acceleration signal
+ONE_G_VALUE = 20.75
+
+STRIDE_LENGTH = 1.5
+
+
+def pack_bit_packed_values(values, value_nbits):
+    """Pack integers into bytes, the first value in the lowest bits, as read
+    by zephyr.util.unpack_bit_packed_values. Negative values are packed in
+    two's complement."""
+    value_bit_mask = 2**value_nbits - 1
+    packed_bits = 0
+    
+    for value_i, value in enumerate(values):
+        packed_bits |= (value & value_bit_mask) << (value_i * value_nbits)
+    
+    byte_count = (len(values) * value_nbits + 7) / 8
+    return [(packed_bits >> (byte_i * 8)) & 0xFF for byte_i in range(byte_count)]
+
+
+def get_timestamp_fields(timestamp):
+    """Return the year, month and day, and the milliseconds since the local
+    midnight of a timestamp, as in the timestamps of the payloads"""
+    local_time = time.localtime(timestamp)
+    date_value = local_time.tm_year | (local_time.tm_mon << 16) | (local_time.tm_mday << 24)
+    day_milliseconds = int((timestamp - zephyr.util.get_midnight_epoch(date_value)) * 1000.0)
+    return date_value, day_milliseconds
+
+
+def create_timestamp_bytes(timestamp):
+    return list(bytearray(zephyr.util.TIMESTAMP_FIELDS.pack(*get_timestamp_fields(timestamp))))
+
+
+def clip_10_bit_value(value):
+    return min(max(int(round(value)), 0), 1023)
+
+
+def pad_payload(payload, payload_length):
+    return payload + [0] * (payload_length - len(payload))
+
+
+class SyntheticPhysiology:
+    """Heartbeats whose intervals vary with the breathing, and the ECG,
+    breathing, RR and acceleration signals derived from them"""
+    def __init__(self, start_time, heart_rate, breathing_rate, walking_speed, random_generator):
+        self.heart_rate = heart_rate
+        self.breathing_frequency = breathing_rate / 60.0
+        self.walking_speed = walking_speed
+        self.random = random_generator
+        
+        self.heartbeat_count = 0
+        self.heartbeat_times = []
+        self.heartbeat_intervals = []
+        
+        # The first heartbeat is before the start, so that every signal
+        # value has a preceding heartbeat
+        self.add_heartbeat(start_time - self.get_heartbeat_interval(start_time) * self.random.random())
+    
+    def get_heartbeat_interval(self, heartbeat_time):
+        respiratory_variation = 0.05 * math.sin(2 * math.pi * self.breathing_frequency * heartbeat_time)
+        return 60.0 / self.heart_rate * (1.0 + respiratory_variation) + self.random.gauss(0.0, 0.01)
+    
+    def add_heartbeat(self, heartbeat_time):
+        if self.heartbeat_times:
+            self.heartbeat_intervals.append(heartbeat_time - self.heartbeat_times[-1])
+        else:
+            self.heartbeat_intervals.append(60.0 / self.heart_rate)
+        
+        self.heartbeat_times.append(heartbeat_time)
+        self.heartbeat_count += 1
+    
+    def generate_heartbeats_until(self, timestamp):
+        while self.heartbeat_times[-1] <= timestamp:
+            self.add_heartbeat(self.heartbeat_times[-1] + self.get_heartbeat_interval(self.heartbeat_times[-1]))
+    
+    def forget_heartbeats_before(self, timestamp, kept_heartbeat_count=16):
+        """Forget the old heartbeats, but keep enough of them for the HxM
+        messages"""
+        heartbeat_i = bisect.bisect_left(self.heartbeat_times, timestamp)
+        forgotten_count = max(0, min(heartbeat_i, len(self.heartbeat_times) - kept_heartbeat_count) - 1)
+        
+        del self.heartbeat_times[:forgotten_count]
+        del self.heartbeat_intervals[:forgotten_count]
+    
+    def find_previous_heartbeat(self, timestamp):
+        """Return the index of the latest heartbeat at or before the
+        timestamp"""
+        self.generate_heartbeats_until(timestamp)
+        return max(0, bisect.bisect_right(self.heartbeat_times, timestamp) - 1)
+    
+    def get_ecg_value(self, timestamp):
+        heartbeat_i = self.find_previous_heartbeat(timestamp)
+        value = 0.0
+        
+        # The QRS complex and the T wave of the surrounding heartbeats
+        for heartbeat_time in self.heartbeat_times[heartbeat_i:heartbeat_i + 2]:
+            offset = timestamp - heartbeat_time
+            value += 400.0 * math.exp(-(offset / 0.012) ** 2) + 60.0 * math.exp(-((offset - 0.25) / 0.05) ** 2)
+        
+        return value + self.random.gauss(0.0, 3.0)
+    
+    def get_breathing_value(self, timestamp):
+        return 300.0 * math.sin(2 * math.pi * self.breathing_frequency * timestamp) + self.random.gauss(0.0, 2.0)
+    
+    def get_rr_value(self, timestamp):
+        """The latest heartbeat interval, with a sign that alternates at each
+        heartbeat"""
+        heartbeat_i = self.find_previous_heartbeat(timestamp)
+        heartbeat_number = self.heartbeat_count - len(self.heartbeat_times) + heartbeat_i
+        sign = 1 if heartbeat_number % 2 == 0 else -1
+        return sign * self.heartbeat_intervals[heartbeat_i]
+    
+    def get_acceleration(self, timestamp):
+        step_movement = 0.3 * math.sin(2 * math.pi * timestamp * self.walking_speed / STRIDE_LENGTH)
+        return (1.0 + step_movement + self.random.gauss(0.0, 0.02),
+                self.random.gauss(0.0, 0.02),
+                self.random.gauss(0.0, 0.02))
+    
+    def get_recent_heartbeats(self, timestamp, heartbeat_count):
+        """Return the number of heartbeats until the timestamp, and the times
+        of the latest heartbeats, the newest first"""
+        heartbeat_i = self.find_previous_heartbeat(timestamp)
+        heartbeat_number = self.heartbeat_count - len(self.heartbeat_times) + heartbeat_i + 1
+        heartbeat_times = self.heartbeat_times[max(0, heartbeat_i + 1 - heartbeat_count):heartbeat_i + 1][::-1]
+        return heartbeat_number, heartbeat_times
+    
+    def get_mean_heart_rate(self, timestamp):
+        heartbeat_i = self.find_previous_heartbeat(timestamp)
+        recent_intervals = self.heartbeat_intervals[max(0, heartbeat_i - 4):heartbeat_i + 1]
+        return 60.0 * len(recent_intervals) / sum(recent_intervals)
+
+
+class SyntheticDevice:
+    """Generates the message frames of a BioHarness or an HxM device, with
+    valid framing, CRCs, sequence numbers and timestamps. The message_ids
+    select the messages, e.g. BIOHARNESS_MESSAGE_IDS or HXM_MESSAGE_IDS.
+    
+    Each signal packet is sent transmission_delay to twice that after its
+    last sample. Packets are dropped with packet_loss_probability, which
+    leaves a gap in their sequence numbers, and a bit of a payload or CRC
+    byte is flipped with corruption_probability, which makes the frame fail
+    its CRC check. The device clock differs from the generation time by
+    clock_offset seconds. The frames are the same for the same seed."""
+    def __init__(self, message_ids=BIOHARNESS_MESSAGE_IDS, start_time=None, heart_rate=70.0, breathing_rate=15.0,
+                 walking_speed=0.0, summary_interval=1.0, transmission_delay=0.02, clock_offset=0.0,
+                 packet_loss_probability=0.0, corruption_probability=0.0, seed=None):
+        self.start_time = start_time if start_time is not None else zephyr.time()
+        self.summary_interval = summary_interval
+        self.transmission_delay = transmission_delay
+        self.clock_offset = clock_offset
+        self.packet_loss_probability = packet_loss_probability
+        self.corruption_probability = corruption_probability
+        
+        self.random = random.Random(seed)
+        self.physiology = SyntheticPhysiology(self.start_time, heart_rate, breathing_rate, walking_speed, self.random)
+        
+        self.sequence_numbers = dict((message_id, self.random.randrange(256)) for message_id in message_ids)
+        
+        self.frame_count = 0
+        self.dropped_frame_count = 0
+        self.corrupted_frame_count = 0
+        
+        # Send time, message id and the start of the period of the next
+        # message of each type
+        self.schedule = []
+        for message_id in message_ids:
+            self.schedule_message(message_id, self.start_time)
+    
+    def get_message_interval(self, message_id):
+        if message_id in SIGNAL_MESSAGES:
+            samplerate, samples_per_packet, payload_length = SIGNAL_MESSAGES[message_id]  #@UnusedVariable
+            return samples_per_packet / samplerate
+        elif message_id == SUMMARY_MESSAGE_ID:
+            return self.summary_interval
+        else:
+            return HXM_MESSAGE_INTERVAL
+    
+    def schedule_message(self, message_id, period_start_time):
+        if message_id in SIGNAL_MESSAGES:
+            samplerate, samples_per_packet, payload_length = SIGNAL_MESSAGES[message_id]  #@UnusedVariable
+            last_sample_time = period_start_time + (samples_per_packet - 1) / samplerate
+        else:
+            last_sample_time = period_start_time + self.get_message_interval(message_id)
+        
+        send_time = last_sample_time + self.transmission_delay * (1.0 + self.random.random())
+        heapq.heappush(self.schedule, (send_time, message_id, period_start_time))
+    
+    def get_next_send_time(self):
+        return self.schedule[0][0]
+    
+    def create_signal_payload(self, message_id, sequence_number, period_start_time):
+        samplerate, samples_per_packet, payload_length = SIGNAL_MESSAGES[message_id]
+        sample_times = [period_start_time + sample_i / samplerate for sample_i in range(samples_per_packet)]
+        physiology = self.physiology
+        
+        if message_id == 0x22:
+            values = [clip_10_bit_value(512 + physiology.get_ecg_value(t)) for t in sample_times]
+            packed_bytes = pack_bit_packed_values(values, 10)
+        elif message_id == 0x21:
+            values = [clip_10_bit_value(512 + physiology.get_breathing_value(t)) for t in sample_times]
+            packed_bytes = pack_bit_packed_values(values, 10)
+        elif message_id == 0x24:
+            values = [int(round(physiology.get_rr_value(t) * 1000.0)) for t in sample_times]
+            packed_bytes = pack_bit_packed_values(values, 16)
+        else:
+            values = [clip_10_bit_value(512 + component * ONE_G_VALUE)
+                      for t in sample_times for component in physiology.get_acceleration(t)]
+            packed_bytes = pack_bit_packed_values(values, 10)
+        
+        payload = [sequence_number] + create_timestamp_bytes(period_start_time + self.clock_offset) + packed_bytes
+        return pad_payload(payload, payload_length)
+    
+    def create_summary_payload(self, sequence_number, timestamp):
+        physiology = self.physiology
+        heart_rate = physiology.get_mean_heart_rate(timestamp)
+        activity = 0.05 + 0.2 * physiology.walking_speed
+        date_value, day_milliseconds = get_timestamp_fields(timestamp + self.clock_offset)
+        
+        payload_string = SUMMARY_PAYLOAD_LAYOUT.pack(sequence_number, date_value, day_milliseconds,
+                                                     int(round(heart_rate)),
+                                                     int(round(physiology.breathing_frequency * 600.0)),
+                                                     int(round(10.0 * self.random.gauss(33.0, 0.1))),
+                                                     0, int(round(100.0 * activity)), int(round(100.0 * activity * 2.0)),
+                                                     300, 100, 100)
+        return pad_payload(list(bytearray(payload_string)), SUMMARY_PAYLOAD_LENGTH)
+    
+    def create_hxm_payload(self, timestamp):
+        physiology = self.physiology
+        heartbeat_number, heartbeat_times = physiology.get_recent_heartbeats(timestamp, 15)
+        
+        # Milliseconds of the device clock, which wrap around at 2**16
+        heartbeat_milliseconds = [int((heartbeat_time - self.start_time + self.clock_offset) * 1000.0) % 2**16
+                                  for heartbeat_time in heartbeat_times]
+        heartbeat_milliseconds += [0] * (15 - len(heartbeat_milliseconds))
+        
+        distance = physiology.walking_speed * (timestamp - self.start_time)
+        hxm_fields = ([int(round(physiology.get_mean_heart_rate(timestamp))), heartbeat_number % 256] +
+                      heartbeat_milliseconds +
+                      [int(distance * 16.0) % 2**16, int(physiology.walking_speed * 256.0),
+                       int(distance / STRIDE_LENGTH) % 256])
+        
+        payload_string = HXM_PAYLOAD_LAYOUT.pack(*hxm_fields)
+        return pad_payload(list(bytearray(payload_string)), HXM_PAYLOAD_LENGTH)
+    
+    def create_payload(self, message_id, period_start_time):
+        sequence_number = self.sequence_numbers[message_id]
+        self.sequence_numbers[message_id] = (sequence_number + 1) % 256
+        
+        if message_id in SIGNAL_MESSAGES:
+            return self.create_signal_payload(message_id, sequence_number, period_start_time)
+        elif message_id == SUMMARY_MESSAGE_ID:
+            return self.create_summary_payload(sequence_number, period_start_time + self.summary_interval)
+        else:
+            return self.create_hxm_payload(period_start_time + HXM_MESSAGE_INTERVAL)
+    
+    def corrupt_frame(self, message_frame):
+        # A payload byte or the CRC byte, so that the frame still ends where
+        # the parser expects it
+        byte_i = self.random.randrange(3, len(message_frame) - 1)
+        corrupted_byte = chr(ord(message_frame[byte_i]) ^ (1 << self.random.randrange(8)))
+        return message_frame[:byte_i] + corrupted_byte + message_frame[byte_i + 1:]
+    
+    def generate_frames(self, end_time):
+        """Return the frames that the device sends until end_time, as a list
+        of send times and frame strings"""
+        frames = []
+        
+        while self.schedule[0][0] <= end_time:
+            send_time, message_id, period_start_time = heapq.heappop(self.schedule)
+            self.schedule_message(message_id, period_start_time + self.get_message_interval(message_id))
+            
+            payload = self.create_payload(message_id, period_start_time)
+            self.frame_count += 1
+            
+            if self.random.random() < self.packet_loss_probability:
+                self.dropped_frame_count += 1
+                continue
+            
+            message_frame = create_message_frame(message_id, payload)
+            
+            if self.random.random() < self.corruption_probability:
+                message_frame = self.corrupt_frame(message_frame)
+                self.corrupted_frame_count += 1
+            
+            frames.append((send_time, message_frame))
+        
+        self.physiology.forget_heartbeats_before(end_time - 60.0)
+        
+        return frames
+    
+    def generate_stream_data(self, end_time):
+        return "".join(message_frame for send_time, message_frame in self.generate_frames(end_time))  #@UnusedVariable
+
+
+def create_synthetic_devices(device_count, message_ids=BIOHARNESS_MESSAGE_IDS, start_time=None, seed=0,
+                             **device_parameters):
+    """Create devices with different heart and breathing rates and clock
+    offsets. The other parameters of SyntheticDevice are the same for all
+    devices."""
+    if start_time is None:
+        start_time = zephyr.time()
+    
+    random_generator = random.Random(seed)
+    devices = []
+    
+    for device_i in range(device_count):
+        parameters = dict(heart_rate=random_generator.uniform(55.0, 95.0),
+                          breathing_rate=random_generator.uniform(10.0, 20.0),
+                          clock_offset=random_generator.uniform(-2.0, 2.0),
+                          seed=seed * 1000003 + device_i)
+        parameters.update(device_parameters)
+        
+        devices.append(SyntheticDevice(message_ids, start_time, **parameters))
+    
+    return devices
+
+
+def write_stream_files(device, duration, log_file_basepath):
+    """Write the frames that the device sends in duration seconds as a .dat
+    file and a -timing.csv file, like zephyr.protocol.MessageDataLogger, so
+    that long measurements can be replayed with the tools for recordings"""
+    end_time = device.start_time + duration
+    byte_count = 0
+    
+    with open(log_file_basepath + ".dat", "wb") as data_file:
+        with open(log_file_basepath + "-timing.csv", "wb") as timing_file:
+            timing_file_csv_writer = csv.writer(timing_file)
+            
+            while device.get_next_send_time() <= end_time:
+                for send_time, message_frame in device.generate_frames(min(device.get_next_send_time() + 60.0, end_time)):
+                    data_file.write(message_frame)
+                    byte_count += len(message_frame)
+                    timing_file_csv_writer.writerow((repr(send_time), byte_count))
+
+
+class SyntheticSerial:
+    """A serial port stand-in that delivers the frames of a SyntheticDevice
+    at their send times, so that many devices and long measurements can be
+    simulated without recordings. With a speed above one the device time
+    runs faster than zephyr.time, and with speed None the frames are
+    delivered as fast as they are read. The end of data is reached after
+    duration seconds of device time, if given."""
+    def __init__(self, device, duration=None, speed=1.0):
+        self.device = device
+        self.end_time = device.start_time + duration if duration is not None else None
+        self.speed = speed
+        
+        self.buffer = ""
+        self.clock_start_time = zephyr.time()
+    
+    def get_device_time(self):
+        return self.device.start_time + (zephyr.time() - self.clock_start_time) * self.speed
+    
+    def generate_data(self, wait):
+        next_send_time = self.device.get_next_send_time()
+        
+        if self.end_time is not None and next_send_time > self.end_time:
+            if wait:
+                raise EOFError("End of the synthetic stream reached")
+            return
+        
+        if self.speed is None:
+            if len(self.buffer):
+                return
+            
+            # A second of data at a time
+            end_time = next_send_time + 1.0
+        else:
+            end_time = self.get_device_time()
+            
+            if wait and end_time < next_send_time:
+                zephyr.sleep((next_send_time - end_time) / self.speed)
+                end_time = max(self.get_device_time(), next_send_time)
+        
+        if self.end_time is not None:
+            end_time = min(end_time, self.end_time)
+        
+        self.buffer += self.device.generate_stream_data(end_time)
+    
+    def open(self):
+        return None
+    
+    def close(self):
+        pass
+    
+    def inWaiting(self):
+        self.generate_data(False)
+        return len(self.buffer)
+    
+    def read(self, byte_count):
+        while not len(self.buffer):
+            self.generate_data(True)
+        
+        read_bytes = self.buffer[:byte_count]
+        self.buffer = self.buffer[byte_count:]
+        return read_bytes
+    
+    def write(self, data):
+        pass
+
+
+class PseudoTerminalPort:
+    """Writes the data of a serial port stand-in, e.g. a SyntheticSerial,
+    into a pseudo-terminal in a background thread. The terminal can be opened
+    by its port_name like a real serial port, e.g. with serial.Serial, to
+    test programs as a whole. Only available on POSIX systems."""
+    def __init__(self, source_serial, chunk_size=4096):
+        import pty
+        import tty
+        
+        self.master_fd, self.slave_fd = pty.openpty()
+        
+        # No line discipline processing, so that the bytes pass as such
+        tty.setraw(self.slave_fd)
+        self.port_name = os.ttyname(self.slave_fd)
+        
+        self.terminated = False
+        
+        self.writer_thread = threading.Thread(target=self.write_from_source, args=(source_serial, chunk_size))
+        self.writer_thread.daemon = True
+        self.writer_thread.start()
+    
+    def write_from_source(self, source_serial, chunk_size):
+        try:
+            while not self.terminated:
+                data = source_serial.read(chunk_size)
+                while len(data):
+                    data = data[os.write(self.master_fd, data):]
+        except EOFError:
+            pass
+        except OSError:
+            if not self.terminated:
+                raise
+    
+    def close(self):
+        self.terminated = True
+        os.close(self.master_fd)
+        os.close(self.slave_fd)
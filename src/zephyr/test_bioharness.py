@@ -0,0 +1,114 @@
+
+import random
+import unittest
+
+import zephyr.util
+from zephyr.bioharness import (find_heartbeat_intervals, extract_heartbeat_intervals, BioHarnessSignalAnalysis,
+                               BioHarnessPacketHandler)
+from zephyr.collector import MeasurementCollector
+from zephyr.message import SignalPacket
+from zephyr.replay import replay_measurement
+from zephyr.testing import test_data_dir
+
+
+def find_heartbeat_intervals_reference(rr_values, latest_rr_value_sign, starts_new_stream):
+    heartbeat_indices = []
+    heartbeat_intervals = []
+    
+    for sample_number, rr_value in enumerate(rr_values):
+        rr_value_sign = cmp(rr_value, 0)
+        
+        if rr_value_sign != latest_rr_value_sign and not (sample_number == 0 and starts_new_stream):
+            heartbeat_indices.append(sample_number)
+            heartbeat_intervals.append(abs(rr_value))
+        
+        latest_rr_value_sign = rr_value_sign
+    
+    return heartbeat_indices, heartbeat_intervals, latest_rr_value_sign
+
+
+class HeartbeatIntervalTest(unittest.TestCase):
+    def setUp(self):
+        self.original_use_numpy = zephyr.util.USE_NUMPY
+    
+    def tearDown(self):
+        zephyr.util.USE_NUMPY = self.original_use_numpy
+    
+    def test_random_rr_values(self):
+        random_generator = random.Random(1)
+        
+        for use_numpy in set([False, self.original_use_numpy]):
+            zephyr.util.USE_NUMPY = use_numpy
+            
+            for test_i in range(200):
+                rr_values = [random_generator.choice([-0.8, -0.75, 0.0, 0.75, 0.8])
+                             for sample_i in range(random_generator.randint(0, 20))]
+                latest_rr_value_sign = random_generator.choice([-1, 0, 1])
+                starts_new_stream = random_generator.choice([False, True])
+                
+                self.assertEqual(find_heartbeat_intervals(rr_values, latest_rr_value_sign, starts_new_stream),
+                                 find_heartbeat_intervals_reference(rr_values, latest_rr_value_sign,
+                                                                    starts_new_stream))
+    
+    def test_event_and_batch_callbacks(self):
+        signal_packets = [(SignalPacket("rr", 100.0, 18.0, [0.8, 0.8, -0.75, -0.75, 0.0], 0), False),
+                          (SignalPacket("rr", 101.0, 18.0, [0.7, -0.8], 1), True)]
+        
+        for use_numpy in set([False, self.original_use_numpy]):
+            zephyr.util.USE_NUMPY = use_numpy
+            
+            events = []
+            batch_events = []
+            
+            for signal_analysis in [BioHarnessSignalAnalysis([], [lambda *event: events.append(event)]),
+                                    BioHarnessSignalAnalysis([], [], [lambda stream_name, timestamps, values:
+                                                                      batch_events.extend(zip(timestamps, values))])]:
+                for signal_packet, starts_new_stream in signal_packets:
+                    signal_analysis.handle_signal(signal_packet, starts_new_stream)
+            
+            self.assertEqual([interval for stream_name, (timestamp, interval) in events], [0.8, 0.75, 0.0, 0.8])  #@UnusedVariable
+            self.assertEqual([value for stream_name, value in events], batch_events)  #@UnusedVariable
+    
+    def test_bulk_extraction_matches_online_analysis(self):
+        collector, replay_statistics = replay_measurement(test_data_dir + "/120-second-bt-stream.dat") #@UnusedVariable
+        
+        heartbeats = list(collector.get_event_stream("heartbeat_interval"))
+        self.assertTrue(len(heartbeats))
+        
+        heartbeat_timestamps, heartbeat_intervals = extract_heartbeat_intervals(collector.get_signal_stream_history("rr"))
+        
+        self.assertEqual(heartbeat_intervals, [interval for timestamp, interval in heartbeats])
+        
+        # The history times all samples relative to the latest packet, so
+        # only the latest heartbeats are timed exactly as in the analysis
+        self.assertEqual(heartbeat_timestamps, sorted(heartbeat_timestamps))
+        self.assertAlmostEqual(heartbeat_timestamps[-1], heartbeats[-1][0])
+    
+    def test_bulk_extraction_across_streams(self):
+        collector = MeasurementCollector(1e9, lambda: 200.0)
+        collector.handle_signal(SignalPacket("rr", 100.0, 18.0, [0.8, 0.8, -0.75, -0.75], 0), False)
+        collector.handle_signal(SignalPacket("rr", 200.0, 18.0, [0.75, 0.75, -0.8], 1), True)
+        
+        heartbeat_timestamps, heartbeat_intervals = extract_heartbeat_intervals(collector.get_signal_stream_history("rr"))
+        
+        self.assertEqual(heartbeat_intervals, [0.8, 0.75, 0.8])
+        self.assertEqual(len(heartbeat_timestamps), 3)
+        self.assertAlmostEqual(heartbeat_timestamps[0], 100.0)
+        self.assertAlmostEqual(heartbeat_timestamps[1], 100.0 + 2 / 18.0)
+        self.assertAlmostEqual(heartbeat_timestamps[2], 200.0 + 2 / 18.0)
+
+
+class BioHarnessPacketHandlerTest(unittest.TestCase):
+    def test_received_packet_is_not_changed(self):
+        corrected_packets = []
+        packet_handlers = [BioHarnessPacketHandler([lambda packet, starts_new_stream: corrected_packets.append(packet)],
+                                                   [], time_function=lambda: 110.0)
+                           for handler_i in range(2)]  #@UnusedVariable
+        
+        signal_packet = SignalPacket("ecg", 100.0, 250.0, [0] * 63, 0)
+        for packet_handler in packet_handlers:
+            packet_handler.handle_packet(signal_packet)
+        
+        self.assertEqual(signal_packet.timestamp, 100.0)
+        self.assertEqual(corrected_packets[0], corrected_packets[1])
+        self.assertNotEqual(corrected_packets[0].timestamp, 100.0)
@@ -0,0 +1,225 @@
+
+import threading
+import unittest
+
+from zephyr.collector import EventStream, SampleRingBuffer, SignalStream, SignalStreamHistory
+from zephyr.message import SignalPacket
+
+
+class EventStreamTest(unittest.TestCase):
+    def setUp(self):
+        self.event_stream = EventStream()
+        
+        for event_timestamp in range(100):
+            self.event_stream.append((float(event_timestamp), "event %d" % event_timestamp))
+    
+    def test_cleanup(self):
+        self.event_stream.clean_up_events_before(10.5)
+        self.event_stream.clean_up_events_before(60.0)
+        
+        self.assertEqual(len(self.event_stream), 100)
+        self.assertEqual(self.event_stream.events_cleaned_up, 60)
+        self.assertEqual(self.event_stream[60], (60.0, "event 60"))
+        self.assertEqual(list(self.event_stream)[0], (60.0, "event 60"))
+        
+        self.event_stream.append((100.0, "event 100"))
+        self.assertEqual(self.event_stream[100], (100.0, "event 100"))
+        self.assertEqual(len(list(self.event_stream)), 41)
+    
+    def test_extend(self):
+        extended_event_stream = EventStream()
+        extended_event_stream.extend([0.0, 1.0], ["event 0", "event 1"])
+        extended_event_stream.extend([], [])
+        extended_event_stream.extend([float(event_timestamp) for event_timestamp in range(2, 100)],
+                                     ["event %d" % event_timestamp for event_timestamp in range(2, 100)])
+        
+        self.assertEqual(list(extended_event_stream), list(self.event_stream))
+        self.assertEqual(extended_event_stream.max_timestamps, self.event_stream.max_timestamps)
+    
+    def test_iterate_samples(self):
+        self.assertEqual(list(self.event_stream.iterate_samples(5, 7.0)), ["event 5", "event 6", "event 7"])
+        self.assertEqual(list(self.event_stream.iterate_samples(8, 7.0)), [])
+        
+        self.event_stream.clean_up_events_before(70.0)
+        self.assertEqual(list(self.event_stream.iterate_samples(5, 200.0)), [])
+        self.assertEqual(list(self.event_stream.iterate_samples(98, 200.0)), ["event 98", "event 99"])
+    
+    def test_cursor(self):
+        cursor = self.event_stream.create_cursor()
+        
+        self.assertEqual(cursor.read_timed_samples(2.5), ([0.0, 1.0, 2.0], ["event 0", "event 1", "event 2"]))
+        self.assertEqual(cursor.get_next_sample_timestamp(), 3.0)
+        
+        # Events that are cleaned up before they are read are skipped
+        self.event_stream.clean_up_events_before(6.0)
+        self.assertEqual(cursor.get_next_sample_timestamp(), 6.0)
+        self.assertEqual(cursor.read_timed_samples(7.5), ([6.0, 7.0], ["event 6", "event 7"]))
+        self.assertEqual(cursor.sample_index, 8)
+        self.assertEqual(cursor.read_timed_samples(7.5), ([], []))
+        
+        self.event_stream.clean_up_events_before(90.0)
+        self.assertEqual(cursor.read_timed_samples(1000.0)[1], ["event %d" % event_i for event_i in range(90, 100)])
+        self.assertEqual(cursor.get_next_sample_timestamp(), None)
+    
+    def test_events_between(self):
+        self.event_stream.clean_up_events_before(50.0)
+        
+        self.assertEqual(self.event_stream.events_between(40.0, 51.5), ([50.0, 51.0], ["event 50", "event 51"]))
+        self.assertEqual(self.event_stream.events_between(98.5, 1000.0), ([99.0], ["event 99"]))
+        self.assertEqual(self.event_stream.events_between(1000.0, 2000.0), ([], []))
+    
+    def test_non_monotonic_timestamps(self):
+        event_stream = EventStream()
+        for event_timestamp in [1.0, 3.0, 2.0, 4.0]:
+            event_stream.append((event_timestamp, event_timestamp))
+        
+        event_stream.clean_up_events_before(2.5)
+        self.assertEqual(list(event_stream), [(3.0, 3.0), (2.0, 2.0), (4.0, 4.0)])
+
+
+class SampleRingBufferTest(unittest.TestCase):
+    def test_wraparound_and_growth(self):
+        ring_buffer = SampleRingBuffer(5)
+        expected_samples = []
+        
+        next_value = 0
+        for append_count, remove_count in [(3, 0), (2, 2), (3, 1), (4, 0), (10, 12), (1, 0)]:
+            new_samples = range(next_value, next_value + append_count)
+            next_value += append_count
+            
+            ring_buffer.extend(new_samples)
+            expected_samples.extend(new_samples)
+            
+            ring_buffer.remove_first(remove_count)
+            del expected_samples[:remove_count]
+            
+            self.assertEqual(len(ring_buffer), len(expected_samples))
+            self.assertEqual(list(ring_buffer.iterate()), expected_samples)
+            self.assertEqual(list(ring_buffer.iterate(2)), expected_samples[2:])
+            self.assertEqual(list(ring_buffer.copy_values(2)), expected_samples[2:])
+    
+    def test_multi_component_samples(self):
+        ring_buffer = SampleRingBuffer(2, sample_width=3)
+        
+        ring_buffer.extend([(1, 2, 3), (4, 5, 6)])
+        ring_buffer.remove_first(1)
+        ring_buffer.extend([(7, 8, 9)])
+        
+        self.assertEqual(list(ring_buffer.iterate()), [(4, 5, 6), (7, 8, 9)])
+
+
+class SignalStreamTest(unittest.TestCase):
+    def test_timed_samples_after_cleanup(self):
+        signal_stream = SignalStream(SignalPacket("ecg", 100.0, 10.0, range(10), 0), history_length_seconds=1.0)
+        signal_stream.append_signal_packet(SignalPacket("ecg", 101.0, 10.0, range(10, 20), 1))
+        
+        self.assertEqual(signal_stream.start_timestamp, 100.0)
+        self.assertEqual(signal_stream.remove_samples_before(100.5), 5)
+        self.assertEqual(signal_stream.start_timestamp, 100.5)
+        self.assertEqual(len(signal_stream), 15)
+        self.assertEqual(signal_stream.samples, range(5, 20))
+        
+        timed_samples = list(signal_stream.iterate_timed_samples(skip_samples=10))
+        self.assertEqual([sample for sample_timestamp, sample in timed_samples], range(15, 20))  #@UnusedVariable
+        self.assertAlmostEqual(timed_samples[0][0], 101.5)
+
+
+class SignalStreamHistoryTest(unittest.TestCase):
+    def setUp(self):
+        # 50 streams of two packets with five samples at 10 Hz, one every
+        # two seconds
+        self.signal_stream_history = SignalStreamHistory(downsampling_levels=())
+        
+        for packet_i in range(100):
+            packet_timestamp = (packet_i // 2) * 2.0 + (packet_i % 2) * 0.5
+            samples = range(packet_i * 5, packet_i * 5 + 5)
+            self.signal_stream_history.append_signal_packet(SignalPacket("ecg", packet_timestamp, 10.0, samples, 0),
+                                                            packet_i % 2 == 0)
+    
+    def test_sample_indices(self):
+        signal_stream_history = self.signal_stream_history
+        self.assertEqual(len(signal_stream_history.get_signal_streams()), 50)
+        
+        self.assertEqual(list(signal_stream_history.iterate_samples(23, 6.25)), range(23, 33))
+        self.assertEqual(signal_stream_history.get_timed_samples(495, 1000.0)[1], range(495, 500))
+        self.assertAlmostEqual(signal_stream_history.get_sample_timestamp(23), 4.3)
+        self.assertEqual(signal_stream_history.get_sample_timestamp(500), None)
+        
+        signal_stream_history.clean_up_samples_before(10.25)
+        self.assertEqual(len(signal_stream_history.get_signal_streams()), 45)
+        self.assertEqual(signal_stream_history.samples_cleaned_up, 52)
+        
+        # The indices of the remaining samples do not change
+        self.assertEqual(list(signal_stream_history.iterate_samples(55, 12.15)), range(55, 62))
+        self.assertEqual(list(signal_stream_history.iterate_samples(0, 10.45)), [52, 53, 54])
+        self.assertAlmostEqual(signal_stream_history.get_sample_timestamp(0), 10.2)
+    
+    def test_cursor(self):
+        signal_stream_history = self.signal_stream_history
+        cursor = signal_stream_history.create_cursor()
+        
+        timestamps, samples = cursor.read_timed_samples(5.5)
+        self.assertEqual(samples, range(30))
+        self.assertAlmostEqual(timestamps[-1], 4.9)
+        self.assertAlmostEqual(cursor.get_next_sample_timestamp(), 6.0)
+        
+        self.assertEqual(cursor.read_timed_samples(6.55)[1], range(30, 36))
+        self.assertEqual(cursor.read_timed_samples(6.55), ([], []))
+        
+        # Samples that are cleaned up before they are read are skipped
+        signal_stream_history.clean_up_samples_before(10.25)
+        self.assertAlmostEqual(cursor.get_next_sample_timestamp(), 10.2)
+        self.assertEqual(cursor.read_timed_samples(1000.0)[1], range(52, 500))
+        self.assertEqual(cursor.get_next_sample_timestamp(), None)
+        
+        signal_stream_history.append_signal_packet(SignalPacket("ecg", 100.0, 10.0, [500, 501], 0), True)
+        self.assertEqual(cursor.read_timed_samples(1000.0)[1], [500, 501])
+
+
+class ConcurrentReadTest(unittest.TestCase):
+    def test_open_iteration_does_not_block_appends(self):
+        signal_stream_history = SignalStreamHistory(downsampling_levels=())
+        signal_stream_history.append_signal_packet(SignalPacket("ecg", 100.0, 10.0, range(10), 0), False)
+        
+        sample_iterator = signal_stream_history.iterate_samples(0, float("inf"))
+        self.assertEqual(next(sample_iterator), 0)
+        
+        writer = threading.Thread(target=signal_stream_history.append_signal_packet,
+                                  args=(SignalPacket("ecg", 101.0, 10.0, range(10, 20), 1), False))
+        writer.start()
+        writer.join(5.0)
+        
+        self.assertFalse(writer.is_alive())
+        
+        # The iteration continues over the samples that were there when it started
+        self.assertEqual(list(sample_iterator), range(1, 10))
+        self.assertEqual(list(signal_stream_history.iterate_samples(0, float("inf"))), range(20))
+    
+    def test_reads_during_appends_are_consistent(self):
+        event_stream = EventStream()
+        signal_stream_history = SignalStreamHistory(history_length_seconds=1.0, downsampling_levels=())
+        
+        def write():
+            for packet_i in range(2000):
+                timestamp = packet_i * 0.5
+                event_stream.extend([timestamp, timestamp + 0.25], [packet_i, packet_i])
+                event_stream.clean_up_events_before(timestamp - 2.0)
+                
+                signal_stream_history.append_signal_packet(SignalPacket("ecg", timestamp, 10.0, [packet_i] * 5, 0),
+                                                           packet_i % 100 == 0)
+                signal_stream_history.clean_up_samples_before(timestamp - 2.0)
+        
+        writer = threading.Thread(target=write)
+        writer.start()
+        
+        while writer.is_alive():
+            timestamps, values = event_stream.events_between(float("-inf"), float("inf"))
+            self.assertEqual(len(timestamps), len(values))
+            self.assertEqual(values, sorted(values))
+            self.assertEqual(values[::2], values[1::2])
+            
+            sample_timestamps, samples = signal_stream_history.get_timed_samples(0, float("inf"))
+            self.assertEqual(len(sample_timestamps), len(samples))
+            self.assertEqual(samples, sorted(samples))
+        
+        writer.join()
@@ -0,0 +1,80 @@
+
+import time
+import unittest
+
+from zephyr.collector import MeasurementCollector
+from zephyr.delayed_stream import DelayedRealTimeStream
+from zephyr.message import SignalPacket
+
+
+class DelayedRealTimeStreamTest(unittest.TestCase):
+    def setUp(self):
+        self.start_time = time.time()
+        self.collector = MeasurementCollector()
+        self.output = []
+        
+        self.delayed_stream = DelayedRealTimeStream(self.collector, [self.callback], 1.0, {"heart_rate": 2.0})
+    
+    def callback(self, stream_name, sample):
+        self.output.append((stream_name, sample))
+    
+    def test_output_due_samples(self):
+        self.assertEqual(self.delayed_stream.output_due_samples(self.start_time), None)
+        
+        self.collector.handle_signal(SignalPacket("ecg", self.start_time, 10.0, range(10), 0), False)
+        self.collector.handle_event("heart_rate", (self.start_time + 0.25, 60))
+        
+        next_output_time = self.delayed_stream.output_due_samples(self.start_time + 1.25)
+        self.assertEqual(self.output, [("ecg", sample) for sample in range(3)])
+        self.assertAlmostEqual(next_output_time, self.start_time + 1.3)
+        
+        del self.output[:]
+        next_output_time = self.delayed_stream.output_due_samples(self.start_time + 2.0)
+        self.assertEqual(self.output, [("ecg", sample) for sample in range(3, 10)])
+        self.assertAlmostEqual(next_output_time, self.start_time + 2.25)
+        
+        del self.output[:]
+        next_output_time = self.delayed_stream.output_due_samples(self.start_time + 2.25)
+        self.assertEqual(self.output, [("heart_rate", 60)])
+        self.assertEqual(next_output_time, None)
+    
+    def test_batch_callbacks(self):
+        batches = []
+        self.delayed_stream.add_batch_callback(lambda *batch: batches.append(batch))
+        self.delayed_stream.max_batch_latencies = {"ecg": 0.5}
+        
+        self.collector.handle_signal(SignalPacket("ecg", self.start_time, 10.0, range(10), 0), False)
+        self.collector.handle_event("heart_rate", (self.start_time + 0.25, 60))
+        
+        next_output_time = self.delayed_stream.output_due_samples(self.start_time + 1.25)
+        self.assertEqual(batches, [])
+        self.assertAlmostEqual(next_output_time, self.start_time + 1.5)
+        
+        next_output_time = self.delayed_stream.output_due_samples(self.start_time + 1.75)
+        self.assertEqual(len(batches), 1)
+        
+        stream_name, timestamps, samples = batches[0]
+        self.assertEqual(stream_name, "ecg")
+        self.assertEqual(samples, range(8))
+        for sample_timestamp, expected_timestamp in zip(timestamps, [self.start_time + 0.1 * i for i in range(8)]):
+            self.assertAlmostEqual(sample_timestamp, expected_timestamp)
+        
+        self.assertEqual(self.output, [("ecg", sample) for sample in range(8)])
+        self.assertAlmostEqual(next_output_time, self.start_time + 2.25)
+    
+    def test_thread_outputs_new_data_and_terminates(self):
+        self.delayed_stream.default_delay = 0.0
+        self.delayed_stream.start()
+        
+        self.collector.handle_signal(SignalPacket("ecg", time.time() - 1.0, 10.0, range(10), 0), False)
+        
+        for i in range(100):  #@UnusedVariable
+            if len(self.output) == 10:
+                break
+            time.sleep(0.01)
+        
+        self.delayed_stream.terminate()
+        self.delayed_stream.join(1.0)
+        
+        self.assertFalse(self.delayed_stream.is_alive())
+        self.assertEqual(self.output, [("ecg", sample) for sample in range(10)])
@@ -0,0 +1,124 @@
+
+import math
+import random
+import unittest
+
+from zephyr.collector import MeasurementCollector
+from zephyr.downsampling import DownsampledSignalHistory
+from zephyr.message import SignalPacket
+from zephyr.replay import replay_measurement
+from zephyr.testing import test_data_dir
+
+
+def downsample_reference(timed_samples, bin_seconds):
+    bins = {}
+    for timestamp, sample in timed_samples:
+        bins.setdefault(int(math.floor(timestamp / bin_seconds)), []).append(sample)
+    
+    return [(bin_index * bin_seconds, min(bin_samples), max(bin_samples), sum(bin_samples) / float(len(bin_samples)))
+            for bin_index, bin_samples in sorted(bins.items())]
+
+
+class DownsampledSignalHistoryTest(unittest.TestCase):
+    def setUp(self):
+        random_generator = random.Random(4)
+        
+        self.signal_packets = []
+        self.timed_samples = []
+        timestamp = 1000.31
+        
+        for packet_i in range(200):
+            samples = [random_generator.randint(-100, 100) for sample_i in range(random_generator.randint(1, 40))]
+            self.signal_packets.append(SignalPacket("ecg", timestamp, 25.0, samples, packet_i % 256))
+            
+            for sample_i, sample in enumerate(samples):
+                self.timed_samples.append((timestamp + sample_i / 25.0, sample))
+            
+            timestamp += len(samples) / 25.0
+            if packet_i == 100:
+                timestamp += 30.0
+    
+    def test_levels_match_reference(self):
+        levels = ((0.5, 10000), (2.0, 10000), (10.0, 10000))
+        downsampled_history = DownsampledSignalHistory(1, levels)
+        
+        for signal_packet in self.signal_packets:
+            downsampled_history.append_signal_packet(signal_packet)
+        
+        for level_i, (bin_seconds, max_bin_count) in enumerate(levels): #@UnusedVariable
+            reference_bins = downsample_reference(self.timed_samples, bin_seconds)
+            bins = downsampled_history.levels[level_i].get_bins(float("-inf"), float("inf"),
+                                                                downsampled_history.get_open_bins(level_i))
+            
+            self.assertEqual(bins.bin_seconds, bin_seconds)
+            
+            for reference_bin, downsampled_bin in zip(reference_bins, zip(*bins[1:])):
+                self.assertEqual(reference_bin[:3], downsampled_bin[:3])
+                self.assertAlmostEqual(reference_bin[3], downsampled_bin[3])
+            
+            self.assertEqual(len(bins.timestamps), len(reference_bins))
+    
+    def test_multi_component_samples(self):
+        downsampled_history = DownsampledSignalHistory(3, ((1.0, 100),))
+        downsampled_history.append_signal_packet(SignalPacket("acceleration", 10.5, 2.0,
+                                                              [(1.0, 2.0, 3.0), (3.0, 0.0, 3.0), (5.0, 5.0, 5.0)], 0))
+        
+        bins = downsampled_history.get_downsampled(0.0, 20.0, 10)
+        self.assertEqual(bins.timestamps, [10.0, 11.0])
+        self.assertEqual(bins.minimums, [(1.0, 2.0, 3.0), (3.0, 0.0, 3.0)])
+        self.assertEqual(bins.maximums, [(1.0, 2.0, 3.0), (5.0, 5.0, 5.0)])
+        self.assertEqual(bins.means, [(1.0, 2.0, 3.0), (4.0, 2.5, 4.0)])
+    
+    def test_retention_and_level_choice(self):
+        downsampled_history = DownsampledSignalHistory(1, ((1.0, 10), (10.0, 10)))
+        
+        for second_i in range(100):
+            downsampled_history.append_signal_packet(SignalPacket("ecg", float(second_i), 1.0, [second_i], 0))
+        
+        finest_level, coarse_level = downsampled_history.levels
+        self.assertTrue(10 <= len(finest_level) <= 20)
+        
+        self.assertEqual(downsampled_history.choose_level(95.0, 100.0, 5), finest_level)
+        self.assertEqual(downsampled_history.choose_level(95.0, 100.0, 6), None)
+        self.assertEqual(downsampled_history.choose_level(50.0, 100.0, 5), coarse_level)
+        
+        # The 1 s bins do not reach back to the start of the range any more
+        self.assertEqual(downsampled_history.choose_level(0.0, 100.0, 50), coarse_level)
+        
+        self.assertRaises(ValueError, DownsampledSignalHistory, 1, ((1.0, 10), (2.5, 10)))
+
+
+class CollectorDownsamplingTest(unittest.TestCase):
+    def test_recorded_signals(self):
+        collector, replay_statistics = replay_measurement(test_data_dir + "/120-second-bt-stream.dat") #@UnusedVariable
+        
+        for stream_type in ["ecg", "breathing", "rr"]:
+            signal_stream_history = collector.get_signal_stream_history(stream_type)
+            samples = list(signal_stream_history.iterate_samples(0, float("inf")))
+            
+            downsampled_signal = signal_stream_history.get_downsampled(0.0, 2e9, 100)
+            self.assertEqual(downsampled_signal.bin_seconds, 60.0)
+            self.assertEqual(min(downsampled_signal.minimums), min(samples))
+            self.assertEqual(max(downsampled_signal.maximums), max(samples))
+            
+            last_timestamp = signal_stream_history.get_signal_streams()[-1].end_timestamp
+            downsampled_signal = signal_stream_history.get_downsampled(last_timestamp - 60.0, last_timestamp, 60)
+            self.assertEqual(downsampled_signal.bin_seconds, 1.0)
+            self.assertTrue(60 <= len(downsampled_signal.timestamps) <= 62)
+        
+        acceleration_history = collector.get_signal_stream_history("acceleration")
+        last_timestamp = acceleration_history.get_signal_streams()[-1].end_timestamp
+        downsampled_signal = acceleration_history.get_downsampled(last_timestamp - 5.0, last_timestamp, 1000)
+        
+        self.assertEqual(downsampled_signal.bin_seconds, 0.0)
+        self.assertEqual(downsampled_signal.minimums, downsampled_signal.maximums)
+        self.assertEqual(len(downsampled_signal.minimums[0]), 3)
+        self.assertTrue(240 <= len(downsampled_signal.timestamps) <= 251)
+    
+    def test_disabled_downsampling(self):
+        collector = MeasurementCollector(1e9, lambda: 0.0, downsampling_levels=())
+        collector.handle_signal(SignalPacket("ecg", 100.0, 250.0, [1.0, 2.0], 0), False)
+        
+        signal_stream_history = collector.get_signal_stream_history("ecg")
+        self.assertEqual(signal_stream_history.downsampled_history, None)
+        self.assertEqual(signal_stream_history.get_downsampled(0.0, 1000.0, 1).means, [1.0, 2.0])
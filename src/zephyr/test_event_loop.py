@@ -0,0 +1,166 @@
+
+import os
+import unittest
+
+from zephyr.event_loop import NonBlockingProtocol, NonBlockingBioHarnessProtocol, ProtocolEventLoop
+from zephyr.protocol import MessageFrameParser, BufferedMessageFrameParser, create_message_frame
+from zephyr.testing import test_data_dir, VirtualSerial, PipeSerial
+
+
+class IdleConnection:
+    """A connection that never receives data and fails to re-open once"""
+    def __init__(self):
+        self.read_fd, self.write_fd = os.pipe()
+        self.timeout = 0.05
+        self.open_calls = 0
+        self.close_calls = 0
+    
+    def fileno(self):
+        return self.read_fd
+    
+    def open(self):
+        self.open_calls += 1
+        if self.open_calls == 1:
+            raise IOError("Port busy")
+    
+    def close(self):
+        self.close_calls += 1
+
+
+class PseudoTerminalConnection:
+    """The master end of a pseudo-terminal, whose slave end stands for the
+    device"""
+    def __init__(self):
+        import pty
+        import tty
+        
+        self.master_fd, self.slave_fd = pty.openpty()
+        tty.setraw(self.slave_fd)
+    
+    def fileno(self):
+        return self.master_fd
+    
+    def open(self):
+        return None
+    
+    def close(self):
+        os.close(self.master_fd)
+    
+    def write(self, data):
+        pass
+
+
+class ProtocolEventLoopTest(unittest.TestCase):
+    def test_multiple_devices(self):
+        event_loop = ProtocolEventLoop()
+        device_frames = []
+        
+        for file_name in ["120-second-bt-stream.dat", "120-second-bt-stream-hxm.dat"] * 2:
+            stream_data_path = test_data_dir + "/" + file_name
+            
+            expected_frames = []
+            MessageFrameParser(expected_frames.append).parse_data(open(stream_data_path, "rb").read())
+            
+            frames = []
+            message_parser = BufferedMessageFrameParser(frames.append)
+            protocol = NonBlockingBioHarnessProtocol(PipeSerial(VirtualSerial(stream_data_path)),
+                                                     [message_parser.parse_data])
+            protocol.enable_periodic_packets()
+            event_loop.add_protocol(protocol)
+            
+            device_frames.append((protocol.connection, frames, expected_frames))
+        
+        event_loop.run()
+        
+        for connection, frames, expected_frames in device_frames:
+            connection.close()
+            self.assertEqual([(frame.message_id, list(frame.payload)) for frame in frames],
+                             [(frame.message_id, list(frame.payload)) for frame in expected_frames])
+    
+    def test_timeout_and_reopen(self):
+        connection = IdleConnection()
+        protocol = NonBlockingProtocol(connection, [])
+        protocol.reopen_retry_interval = 0.01
+        
+        event_loop = ProtocolEventLoop()
+        event_loop.add_protocol(protocol)
+        
+        for i in range(100):  #@UnusedVariable
+            event_loop.run_once()
+            if connection.open_calls == 2:
+                break
+        
+        self.assertTrue(connection.close_calls >= 1)
+        self.assertEqual(connection.open_calls, 2)
+        self.assertEqual(event_loop.protocols, [protocol])
+    
+    
+    @unittest.skipUnless(os.name == "posix", "Pseudo-terminals are only available on POSIX systems")
+    def test_failing_devices(self):
+        frame = create_message_frame(0x23, [1, 2, 3])
+        failures = []
+        event_loop = ProtocolEventLoop([lambda protocol, exception: failures.append((protocol, exception))])
+        
+        # The slave end of the broken device is closed, so reading the master
+        # end fails
+        broken_connection = PseudoTerminalConnection()
+        os.close(broken_connection.slave_fd)
+        broken_protocol = NonBlockingProtocol(broken_connection, [])
+        
+        def raise_error(data_string):
+            raise ValueError("Callback failed")
+        
+        failing_callback_connection = PseudoTerminalConnection()
+        os.write(failing_callback_connection.slave_fd, frame)
+        failing_callback_protocol = NonBlockingProtocol(failing_callback_connection, [raise_error])
+        
+        frames = []
+        healthy_connection = PseudoTerminalConnection()
+        os.write(healthy_connection.slave_fd, frame * 3)
+        healthy_protocol = NonBlockingProtocol(healthy_connection, [MessageFrameParser(frames.append).parse_data])
+        
+        for protocol in [broken_protocol, failing_callback_protocol, healthy_protocol]:
+            event_loop.add_protocol(protocol)
+        
+        try:
+            for i in range(100):  #@UnusedVariable
+                event_loop.run_once()
+                if len(frames) == 3 and len(failures) == 2:
+                    break
+            
+            self.assertEqual(len(frames), 3)
+            self.assertEqual(event_loop.protocols, [healthy_protocol])
+            self.assertEqual(set(protocol for protocol, exception in failures),  #@UnusedVariable
+                             set([broken_protocol, failing_callback_protocol]))
+            self.assertTrue(isinstance(dict(failures)[broken_protocol], OSError))
+            self.assertTrue(isinstance(dict(failures)[failing_callback_protocol], ValueError))
+            
+            # The connections of the failed protocols are closed
+            self.assertRaises(OSError, os.fstat, broken_connection.master_fd)
+            self.assertRaises(OSError, os.fstat, failing_callback_connection.master_fd)
+        finally:
+            os.close(failing_callback_connection.slave_fd)
+            healthy_connection.close()
+            os.close(healthy_connection.slave_fd)
+
+
+class EndlessSerial:
+    def read(self, byte_count):
+        return "\x00" * byte_count
+
+
+class PipeSerialTest(unittest.TestCase):
+    def test_close(self):
+        connection = PipeSerial(EndlessSerial())
+        self.assertEqual(len(connection.read(100)), 100)
+        
+        # The writer thread is blocked on the full pipe until the reading end
+        # is closed
+        connection.close()
+        connection.writer_thread.join(5.0)
+        
+        self.assertFalse(connection.writer_thread.is_alive())
+        self.assertRaises(OSError, os.fstat, connection.read_fd)
+        self.assertRaises(OSError, os.fstat, connection.write_fd)
+        
+        connection.close()
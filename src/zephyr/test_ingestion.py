@@ -0,0 +1,147 @@
+
+import os
+import functools
+import unittest
+
+import zephyr.util
+from zephyr.collector import MeasurementCollector
+from zephyr.bioharness import BioHarnessSignalAnalysis, BioHarnessPacketHandler
+from zephyr.hxm import HxMPacketAnalysis
+from zephyr.ingestion import RecordEncoder, decode_records, IngestionPool
+from zephyr.message import MessagePayloadParser, SignalPacket
+from zephyr.protocol import MessageFrameParser
+from zephyr.testing import test_data_dir, create_replay_connection
+
+
+def create_collector():
+    return MeasurementCollector(history_length_seconds=1e9)
+
+
+def collect_in_process(stream_data_path):
+    collector = create_collector()
+    
+    rr_signal_analysis = BioHarnessSignalAnalysis([], [collector.handle_event])
+    signal_packet_handler_bh = BioHarnessPacketHandler([collector.handle_signal, rr_signal_analysis.handle_signal],
+                                                       [collector.handle_event])
+    signal_packet_handler_hxm = HxMPacketAnalysis([collector.handle_event])
+    payload_parser = MessagePayloadParser([signal_packet_handler_bh.handle_packet,
+                                           signal_packet_handler_hxm.handle_packet])
+    MessageFrameParser(payload_parser.handle_message).parse_data(open(stream_data_path, "rb").read())
+    
+    return collector
+
+
+def open_missing_port():
+    raise IOError("No such serial port")
+
+
+def exit_worker():
+    os._exit(1)
+
+
+class DisconnectedPort:
+    """A pseudo-terminal whose device end is closed, so that reading it fails"""
+    def __init__(self):
+        import pty
+        
+        self.master_fd, slave_fd = pty.openpty()
+        os.close(slave_fd)
+    
+    def fileno(self):
+        return self.master_fd
+    
+    def close(self):
+        os.close(self.master_fd)
+
+
+def get_collector_contents(collector):
+    signals = dict((stream_name, list(signal_stream_history.iterate_samples(0, float("inf"))))
+                   for stream_name, signal_stream_history in collector.iterate_signal_stream_histories())
+    event_counts = dict((stream_name, len(event_stream))
+                        for stream_name, event_stream in collector.iterate_event_streams())
+    return signals, event_counts
+
+
+class RecordEncodingTest(unittest.TestCase):
+    def test_round_trip(self):
+        encoder = RecordEncoder()
+        encoder.add_signal(3, SignalPacket("ecg", 1000.5, 250.0, [1, -2, 3], 17), False)
+        encoder.add_signal(4, SignalPacket("acceleration", 1001.5, 50.0, [(0.5, 1.0, -1.0), (2.0, 0.0, 1.5)], 255), True)
+        encoder.add_event(5, "heartbeat_interval", (1002.5, 0.75))
+        encoder.add_event(5, "rmssd", (1002.5, 0.05))
+        encoder.add_signal(7, SignalPacket("filtered_ecg", 1004.5, 250.0, [1.5], 1), False)
+        
+        if zephyr.util.numpy is not None:
+            encoder.add_signal(6, SignalPacket("acceleration", 1003.5, 50.0, zephyr.util.numpy.ones((2, 3)), 0), False)
+        
+        signals = []
+        events = []
+        decode_records(encoder.pop_data(), lambda *signal: signals.append(signal), lambda *event: events.append(event))
+        
+        device_index, signal_packet, starts_new_stream = signals[0]
+        self.assertEqual((device_index, signal_packet._replace(samples=list(signal_packet.samples)), starts_new_stream),
+                         (3, SignalPacket("ecg", 1000.5, 250.0, [1.0, -2.0, 3.0], 17), False))
+        self.assertEqual(signals[1], (4, SignalPacket("acceleration", 1001.5, 50.0,
+                                                      [(0.5, 1.0, -1.0), (2.0, 0.0, 1.5)], 255), True))
+        self.assertEqual(events, [(5, "heartbeat_interval", (1002.5, 0.75)), (5, "rmssd", (1002.5, 0.05))])
+        self.assertEqual(signals[2][1].type, "filtered_ecg")
+        self.assertEqual(list(signals[2][1].samples), [1.5])
+        
+        if zephyr.util.numpy is not None:
+            self.assertEqual(signals[3][1].samples, [(1.0, 1.0, 1.0), (1.0, 1.0, 1.0)])
+        
+        self.assertEqual(encoder.pop_data(), "")
+
+
+class IngestionPoolTest(unittest.TestCase):
+    def test_recorded_streams(self):
+        stream_data_paths = [test_data_dir + "/120-second-bt-stream.dat",
+                             test_data_dir + "/120-second-bt-stream-hxm.dat",
+                             test_data_dir + "/120-second-bt-stream.dat"]
+        
+        device_definitions = [(functools.partial(create_replay_connection, stream_data_path), False)
+                              for stream_data_path in stream_data_paths]
+        
+        pool = IngestionPool(device_definitions, 2, create_collector)
+        pool.run()
+        
+        for stream_data_path, collector in zip(stream_data_paths, pool.collectors):
+            expected_signals, expected_event_counts = get_collector_contents(collect_in_process(stream_data_path))
+            signals, event_counts = get_collector_contents(collector)
+            
+            self.assertEqual(event_counts, expected_event_counts)
+            self.assertEqual(sorted(signals.keys()), sorted(expected_signals.keys()))
+            
+            for stream_name, samples in signals.items():
+                self.assertEqual(samples, expected_signals[stream_name])
+    
+    def test_failing_devices(self):
+        stream_data_path = test_data_dir + "/120-second-bt-stream-hxm.dat"
+        device_definitions = [(open_missing_port, False),
+                              (functools.partial(create_replay_connection, stream_data_path), False),
+                              (exit_worker, False)]
+        
+        pool = IngestionPool(device_definitions, 3, create_collector)
+        pool.worker_check_interval = 0.1
+        pool.run()
+        
+        self.assertEqual(len(list(pool.collectors[0].iterate_event_streams())), 0)
+        self.assertEqual(get_collector_contents(pool.collectors[1]),
+                         get_collector_contents(collect_in_process(stream_data_path)))
+        self.assertEqual(pool.processes[2].exitcode, 1)
+        self.assertEqual(pool.failed_devices, {0: "No such serial port"})
+    
+    @unittest.skipUnless(os.name == "posix", "Pseudo-terminals are only available on POSIX systems")
+    def test_failing_device_in_shard(self):
+        stream_data_path = test_data_dir + "/120-second-bt-stream.dat"
+        device_definitions = [(DisconnectedPort, False),
+                              (functools.partial(create_replay_connection, stream_data_path), False)]
+        
+        # Both devices are read by the same worker
+        pool = IngestionPool(device_definitions, 1, create_collector)
+        pool.run()
+        
+        self.assertEqual(pool.failed_devices.keys(), [0])
+        self.assertEqual(pool.processes[0].exitcode, 0)
+        self.assertEqual(get_collector_contents(pool.collectors[1]),
+                         get_collector_contents(collect_in_process(stream_data_path)))
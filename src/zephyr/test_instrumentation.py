@@ -0,0 +1,139 @@
+
+import os
+import json
+import shutil
+import urllib2
+import tempfile
+import unittest
+import threading
+
+from zephyr.bioharness import BioHarnessPacketHandler
+from zephyr.instrumentation import PipelineInstrumentation, format_report, write_report, create_report_server
+from zephyr.message import SignalPacket
+from zephyr.protocol import MessageFrameParser, BufferedMessageFrameParser, create_message_frame
+from zephyr.replay import replay_measurement
+from zephyr.testing import test_data_dir
+
+
+class PipelineInstrumentationTest(unittest.TestCase):
+    def test_replay_stages(self):
+        instrumentation = PipelineInstrumentation()
+        collector, replay_statistics = replay_measurement(test_data_dir + "/120-second-bt-stream.dat",  #@UnusedVariable
+                                                          instrumentation=instrumentation)
+        
+        report = instrumentation.get_report()
+        stages = report["stages"]
+        
+        self.assertEqual(stages["frame_parser"]["items"], replay_statistics.byte_count)
+        self.assertEqual(stages["payload_parser"]["calls"], replay_statistics.packet_count)
+        self.assertEqual(stages["collector_signals"]["calls"], stages["rr_analysis"]["calls"])
+        
+        # The own times of the nested stages add up to the total time of the
+        # outermost one
+        frame_parser_seconds = stages["frame_parser"]["total_seconds"]
+        own_seconds = sum(stage["own_seconds"] for stage in stages.values())
+        self.assertAlmostEqual(own_seconds, frame_parser_seconds, delta=frame_parser_seconds * 0.01)
+        
+        self.assertEqual(json.loads(json.dumps(report)), report)
+        self.assertTrue("payload_parser" in format_report(report))
+    
+    def test_error_counters(self):
+        frame = create_message_frame(0x23, [1, 2, 3])
+        corrupted_frame = frame[:-2] + chr(ord(frame[-2]) ^ 0xFF) + frame[-1]
+        
+        for parser_class in [MessageFrameParser, BufferedMessageFrameParser]:
+            instrumentation = PipelineInstrumentation()
+            frames = []
+            parser_class(frames.append, instrumentation).parse_data(frame + corrupted_frame + frame)
+            
+            self.assertEqual(len(frames), 2)
+            self.assertEqual(instrumentation.counters, {"protocol_errors": 1, "crc_failures": 1})
+            
+            # Other protocol errors are not counted as CRC failures
+            instrumentation = PipelineInstrumentation()
+            parser_class(frames.append, instrumentation).parse_data("\x02\x23\xFF" + frame)
+            self.assertEqual(instrumentation.counters, {"protocol_errors": 1})
+        
+        instrumentation = PipelineInstrumentation()
+        packet_handler = BioHarnessPacketHandler([], [], time_function=lambda: 100.0, instrumentation=instrumentation)
+        for sequence_number in [254, 255, 2, 3, 0]:
+            packet_handler.handle_packet(SignalPacket("ecg", 100.0, 250.0, [0] * 63, sequence_number))
+        
+        self.assertEqual(instrumentation.counters, {"sequence_gaps": 2, "missing_packets": 254})
+    
+    def test_report_while_counting(self):
+        instrumentation = PipelineInstrumentation()
+        
+        def count():
+            for counter_i in range(20000):
+                instrumentation.count("counter_%d" % (counter_i % 1000))
+                instrumentation.handle_output_samples("stream_%d" % (counter_i % 1000), [0.0], [0])
+        
+        counting_threads = [threading.Thread(target=count) for thread_i in range(2)]  #@UnusedVariable
+        for counting_thread in counting_threads:
+            counting_thread.start()
+        
+        try:
+            while any(counting_thread.is_alive() for counting_thread in counting_threads):
+                instrumentation.get_report()
+        finally:
+            for counting_thread in counting_threads:
+                counting_thread.join()
+        
+        report = instrumentation.get_report()
+        self.assertEqual(sum(report["counters"].values()), 40000)
+        self.assertEqual(sum(lag_report["samples"] for lag_report in report["lags"].values()), 40000)
+    
+    def test_output_lag(self):
+        instrumentation = PipelineInstrumentation(lambda: 10.0)
+        instrumentation.handle_output_samples("ecg", [8.0, 8.5, 9.0], [1, 2, 3])
+        instrumentation.handle_output_samples("ecg", [], [])
+        instrumentation.handle_output_samples("ecg", [9.5], [4])
+        
+        lag_report = instrumentation.get_report()["lags"]["ecg"]
+        self.assertEqual(lag_report["samples"], 4)
+        self.assertAlmostEqual(lag_report["mean_seconds"], 1.25)
+        self.assertEqual(lag_report["max_seconds"], 2.0)
+
+
+class ReportExportTest(unittest.TestCase):
+    def setUp(self):
+        self.instrumentation = PipelineInstrumentation()
+        self.instrumentation.instrument("parser", lambda data: None, len)("abc")
+        self.instrumentation.count("crc_failures")
+    
+    def test_write_report(self):
+        temporary_dir = tempfile.mkdtemp()
+        
+        try:
+            json_path = os.path.join(temporary_dir, "report.json")
+            write_report(self.instrumentation, json_path)
+            write_report(self.instrumentation, json_path)
+            
+            report = json.load(open(json_path))
+            self.assertEqual(report["stages"]["parser"]["items"], 3)
+            self.assertEqual(report["counters"], {"crc_failures": 1})
+            
+            text_path = os.path.join(temporary_dir, "report.txt")
+            write_report(self.instrumentation, text_path)
+            self.assertTrue("crc_failures\t1" in open(text_path).read())
+            
+            self.assertEqual(sorted(os.listdir(temporary_dir)), ["report.json", "report.txt"])
+        finally:
+            shutil.rmtree(temporary_dir)
+    
+    def test_report_server(self):
+        server = create_report_server(self.instrumentation, 0)
+        server_thread = threading.Thread(target=server.serve_forever)
+        server_thread.start()
+        
+        try:
+            url = "http://127.0.0.1:%d" % server.server_address[1]
+            
+            report = json.load(urllib2.urlopen(url + "/"))
+            self.assertEqual(report["stages"]["parser"]["calls"], 1)
+            self.assertTrue("crc_failures\t1" in urllib2.urlopen(url + "/text").read())
+        finally:
+            server.shutdown()
+            server_thread.join()
+            server.server_close()
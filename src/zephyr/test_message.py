@@ -0,0 +1,181 @@
+
+import pickle
+import unittest
+
+import zephyr.util
+from zephyr.message import (MessagePayloadParser, SignalPacket, HxMMessage, parse_summary_packet, parse_hxm_message,
+                            decode_summary_payloads, decode_hxm_payloads, decode_payload_columns,
+                            create_payload_layout)
+from zephyr.protocol import MessageFrameParser
+from zephyr.testing import test_data_dir
+
+
+def parse_signal_packets(stream_data_path):
+    signal_packets = []
+    
+    payload_parser = MessagePayloadParser([signal_packets.append])
+    message_parser = MessageFrameParser(payload_parser.handle_message)
+    message_parser.parse_data(open(stream_data_path, "rb").read())
+    
+    signal_packets = [packet for packet in signal_packets if isinstance(packet, SignalPacket)]
+    
+    # Decode the samples while the NumPy setting is in effect
+    for signal_packet in signal_packets:
+        signal_packet.samples
+    
+    return signal_packets
+
+
+def samples_as_lists(samples):
+    return [list(sample) if hasattr(sample, "__len__") else sample for sample in samples]
+
+
+@unittest.skipIf(zephyr.util.numpy is None, "NumPy is not installed")
+class NumpySampleParsingTest(unittest.TestCase):
+    def tearDown(self):
+        zephyr.util.USE_NUMPY = True
+    
+    def test_recorded_signal_packets(self):
+        stream_data_path = test_data_dir + "/120-second-bt-stream.dat"
+        
+        zephyr.util.USE_NUMPY = False
+        expected_packets = parse_signal_packets(stream_data_path)
+        
+        zephyr.util.USE_NUMPY = True
+        packets = parse_signal_packets(stream_data_path)
+        
+        self.assertEqual(set(packet.type for packet in packets),
+                         set(["ecg", "breathing", "rr", "acceleration"]))
+        self.assertEqual(len(packets), len(expected_packets))
+        
+        for packet, expected_packet in zip(packets, expected_packets):
+            self.assertEqual(packet._replace(samples=None), expected_packet._replace(samples=None))
+            self.assertEqual(samples_as_lists(packet.samples.tolist()), samples_as_lists(expected_packet.samples))
+
+
+class CompactMessageTest(unittest.TestCase):
+    def test_lazy_decoding(self):
+        stream_data_path = test_data_dir + "/120-second-bt-stream-hxm.dat"
+        
+        packets = []
+        payload_parser = MessagePayloadParser([packets.append])
+        MessageFrameParser(payload_parser.handle_message).parse_data(open(stream_data_path, "rb").read())
+        
+        hxm_message = packets[0]
+        self.assertEqual(hxm_message._heartbeat_milliseconds, None)
+        self.assertEqual(len(hxm_message.heartbeat_milliseconds), 15)
+        self.assertEqual(hxm_message._payload, None)
+        
+        self.assertEqual(hxm_message._replace(heart_rate=0).heartbeat_milliseconds, hxm_message.heartbeat_milliseconds)
+        self.assertNotEqual(hxm_message._replace(heart_rate=0), hxm_message)
+    
+    def test_signal_packet_fields(self):
+        signal_packet = SignalPacket("ecg", 100.0, 250.0, [1, 2, 3], 5)
+        
+        self.assertEqual(signal_packet, SignalPacket("ecg", 100.0, 250.0, [1, 2, 3], 5))
+        self.assertEqual(signal_packet._replace(timestamp=101.0).timestamp, 101.0)
+        self.assertEqual(hash(signal_packet._replace(samples=(1, 2, 3))),
+                         hash(SignalPacket("ecg", 100.0, 250.0, (1, 2, 3), 5)))
+        self.assertEqual(len(set([signal_packet._replace(samples=()), SignalPacket("ecg", 100.0, 250.0, (), 5)])), 1)
+        self.assertEqual(repr(signal_packet),
+                         "SignalPacket(type='ecg', timestamp=100.0, samplerate=250.0, samples=[1, 2, 3], sequence_number=5)")
+        self.assertRaises(AttributeError, setattr, signal_packet, "extra_field", None)
+    
+    def test_namedtuple_compatibility(self):
+        signal_packet = SignalPacket("ecg", 100.0, 250.0, [1, 2, 3], 5)
+        
+        signal_code, timestamp, samplerate, samples, sequence_number = signal_packet  #@UnusedVariable
+        self.assertEqual((signal_code, samples), ("ecg", [1, 2, 3]))
+        self.assertEqual(signal_packet[1], 100.0)
+        self.assertEqual(signal_packet[-1], 5)
+        self.assertEqual(signal_packet[:2], ("ecg", 100.0))
+        self.assertEqual(len(signal_packet), 5)
+        self.assertEqual(tuple(signal_packet), ("ecg", 100.0, 250.0, [1, 2, 3], 5))
+        self.assertEqual(signal_packet._asdict().keys(), ["type", "timestamp", "samplerate", "samples",
+                                                          "sequence_number"])
+        
+        hxm_message = HxMMessage(60, 3, [1000] * 15, 12.5, 1.5, 7)
+        self.assertEqual(hxm_message._asdict()["heartbeat_milliseconds"], [1000] * 15)
+        
+        for message in [signal_packet, hxm_message]:
+            for protocol in range(pickle.HIGHEST_PROTOCOL + 1):
+                self.assertEqual(pickle.loads(pickle.dumps(message, protocol)), message)
+
+
+def read_payloads(stream_data_path, message_id):
+    message_frames = []
+    MessageFrameParser(message_frames.append).parse_data(open(stream_data_path, "rb").read())
+    return [message_frame.payload for message_frame in message_frames if message_frame.message_id == message_id]
+
+
+def parse_summary_packet_reference(payload):
+    uint16_values = [payload[index] + (payload[index + 1] << 8) for index in [10, 12, 14, 16, 18, 20, 25]]
+    
+    return (payload[0], zephyr.util.parse_timestamp(payload, 1), uint16_values[0], uint16_values[1] * 0.1,
+            uint16_values[2] * 0.1, uint16_values[3], uint16_values[4] * 0.01, uint16_values[5] * 0.01,
+            uint16_values[6], payload[29], payload[34])
+
+
+def parse_hxm_message_reference(payload):
+    uint16_values = [payload[index] + (payload[index + 1] << 8) for index in range(11, 53, 2)]
+    
+    return (payload[9], payload[10], uint16_values[:15], uint16_values[18] / 16.0,
+            uint16_values[19] / 256.0, uint16_values[20])
+
+
+class FixedLayoutDecodingTest(unittest.TestCase):
+    def setUp(self):
+        self.original_use_numpy = zephyr.util.USE_NUMPY
+        self.summary_payloads = read_payloads(test_data_dir + "/120-second-bt-stream.dat", 0x2B)
+        self.hxm_payloads = read_payloads(test_data_dir + "/120-second-bt-stream-hxm.dat", 0x26)
+    
+    def tearDown(self):
+        zephyr.util.USE_NUMPY = self.original_use_numpy
+    
+    def test_summary_packets(self):
+        self.assertTrue(len(self.summary_payloads))
+        
+        expected_messages = [parse_summary_packet_reference(payload) for payload in self.summary_payloads]
+        self.assertEqual([tuple(parse_summary_packet(payload)) for payload in self.summary_payloads],
+                         expected_messages)
+        
+        for use_numpy in set([False, self.original_use_numpy]):
+            zephyr.util.USE_NUMPY = use_numpy
+            
+            summary_columns = decode_summary_payloads(self.summary_payloads)
+            self.assertEqual(zip(*[list(column) for column in summary_columns]), expected_messages)
+    
+    def test_hxm_messages(self):
+        self.assertTrue(len(self.hxm_payloads))
+        
+        expected_messages = [parse_hxm_message_reference(payload) for payload in self.hxm_payloads]
+        self.assertEqual([parse_hxm_message(payload)._get_values() for payload in self.hxm_payloads],
+                         expected_messages)
+        
+        for use_numpy in set([False, self.original_use_numpy]):
+            zephyr.util.USE_NUMPY = use_numpy
+            
+            hxm_columns = decode_hxm_payloads(self.hxm_payloads)
+            if use_numpy:
+                heartbeat_milliseconds = hxm_columns.heartbeat_milliseconds.tolist()
+            else:
+                heartbeat_milliseconds = [list(hxm_columns.heartbeat_milliseconds[message_i * 15:(message_i + 1) * 15])
+                                          for message_i in range(len(self.hxm_payloads))]
+            
+            self.assertEqual(zip(hxm_columns.heart_rate, hxm_columns.heartbeat_number, heartbeat_milliseconds,
+                                 hxm_columns.distance, hxm_columns.speed, hxm_columns.strides),
+                             expected_messages)
+    
+    def test_payload_fields(self):
+        payload_fields = [("h", 2), ("x", 3), ("I", 1), ("b", 1)]
+        payload_layout = create_payload_layout(payload_fields)
+        rows = [(-2, 300, 4000000000, -1), (5, -32768, 0, 127)]
+        payloads = [bytearray(payload_layout.pack(*row) + "\xFF") for row in rows]
+        
+        for use_numpy in set([False, self.original_use_numpy]):
+            zephyr.util.USE_NUMPY = use_numpy
+            self.assertEqual(zip(*[list(column) for column in decode_payload_columns(payload_fields, payloads)]),
+                             rows)
+        
+        self.assertRaises(ValueError, create_payload_layout, [("H", 1), ("f", 1)])
+        self.assertRaises(ValueError, create_payload_layout, [("4s", 1)])
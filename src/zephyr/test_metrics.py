@@ -0,0 +1,98 @@
+
+import math
+import unittest
+
+from zephyr.bioharness import BioHarnessSignalAnalysis, BioHarnessPacketHandler
+from zephyr.collector import MeasurementCollector
+from zephyr.message import MessagePayloadParser
+from zephyr.metrics import HeartRateVariabilityMetric, MetricsEngine
+from zephyr.protocol import MessageFrameParser
+from zephyr.testing import test_data_dir, standard_deviation
+
+
+class HeartRateVariabilityMetricTest(unittest.TestCase):
+    def test_heartbeat_gap(self):
+        metric = HeartRateVariabilityMetric()
+        outputs = []
+        output = lambda stream_name, timestamp, value: outputs.append((stream_name, timestamp, value))
+        
+        for timestamp, interval in [(1.0, 0.8), (2.0, 1.0), (3.0, 0.8)]:
+            metric.handle_value(timestamp, interval, output)
+        
+        self.assertAlmostEqual(outputs[-1][2], 0.2)
+        
+        # The first heartbeat after a 300 s disconnection has no successive
+        # difference in the window
+        outputs = []
+        metric.handle_value(303.0, 0.8, output)
+        self.assertEqual([stream_name for stream_name, timestamp, value in outputs], ["rolling_heart_rate"]) #@UnusedVariable
+        
+        outputs = []
+        metric.handle_value(304.0, 0.9, output)
+        self.assertEqual(outputs[-1][:2], ("rmssd", 304.0))
+        self.assertAlmostEqual(outputs[-1][2], 0.1)
+
+
+class MetricsEngineTest(unittest.TestCase):
+    def setUp(self):
+        self.collector = MeasurementCollector(history_length_seconds=1e9, time_function=lambda: 0.0)
+        metrics_engine = MetricsEngine(self.collector)
+        
+        rr_signal_analysis = BioHarnessSignalAnalysis([], [], [self.collector.handle_events,
+                                                               metrics_engine.handle_events])
+        signal_packet_handler = BioHarnessPacketHandler([self.collector.handle_signal, rr_signal_analysis.handle_signal,
+                                                         metrics_engine.handle_signal],
+                                                        [self.collector.handle_event, metrics_engine.handle_event])
+        payload_parser = MessagePayloadParser([signal_packet_handler.handle_packet])
+        MessageFrameParser(payload_parser.handle_message).parse_data(open(test_data_dir + "/120-second-bt-stream.dat",
+                                                                          "rb").read())
+    
+    def get_events(self, stream_name):
+        return list(self.collector.get_event_stream(stream_name))
+    
+    def test_heart_rate_variability(self):
+        heartbeats = self.get_events("heartbeat_interval")
+        
+        rolling_heart_rates = self.get_events("rolling_heart_rate")
+        sdnn_values = self.get_events("sdnn")
+        rmssd_values = self.get_events("rmssd")
+        
+        self.assertEqual(len(rolling_heart_rates), len(heartbeats))
+        self.assertEqual(len(sdnn_values), len(heartbeats) - 1)
+        
+        for heartbeat_i, (timestamp, interval) in enumerate(heartbeats): #@UnusedVariable
+            window_heartbeats = [(window_timestamp, window_interval)
+                                 for window_timestamp, window_interval in heartbeats[:heartbeat_i + 1]
+                                 if window_timestamp > timestamp - 60.0]
+            window_intervals = [window_interval for window_timestamp, window_interval in window_heartbeats]
+            
+            self.assertEqual(rolling_heart_rates[heartbeat_i][0], timestamp)
+            self.assertAlmostEqual(rolling_heart_rates[heartbeat_i][1], 60.0 * len(window_intervals) / sum(window_intervals))
+            
+            if heartbeat_i > 0:
+                self.assertAlmostEqual(sdnn_values[heartbeat_i - 1][1], standard_deviation(window_intervals))
+        
+        last_timestamp = heartbeats[-1][0]
+        squared_differences = [(interval - previous_interval) ** 2
+                               for (previous_timestamp, previous_interval), (timestamp, interval)
+                               in zip(heartbeats[:-1], heartbeats[1:])
+                               if timestamp > last_timestamp - 60.0 and timestamp - previous_timestamp <= 3.0]
+        self.assertEqual(rmssd_values[-1][0], last_timestamp)
+        self.assertAlmostEqual(rmssd_values[-1][1], math.sqrt(sum(squared_differences) / len(squared_differences)))
+    
+    def test_summary_and_signal_metrics(self):
+        respiration_rates = self.get_events("respiration_rate")
+        mean_respiration_rates = self.get_events("mean_respiration_rate")
+        max_activities = self.get_events("max_activity")
+        
+        self.assertEqual(len(mean_respiration_rates), len(respiration_rates))
+        self.assertEqual(len(max_activities), len(self.get_events("activity")))
+        
+        last_timestamp = respiration_rates[-1][0]
+        window_respiration_rates = [respiration_rate for timestamp, respiration_rate in respiration_rates
+                                    if timestamp > last_timestamp - 60.0]
+        self.assertAlmostEqual(mean_respiration_rates[-1][1], sum(window_respiration_rates) / len(window_respiration_rates))
+        
+        acceleration_variabilities = self.get_events("acceleration_variability")
+        self.assertTrue(len(acceleration_variabilities))
+        self.assertTrue(all(variability >= 0.0 for timestamp, variability in acceleration_variabilities))
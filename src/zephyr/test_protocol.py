@@ -0,0 +1,164 @@
+
+import os
+import glob
+import shutil
+import random
+import tempfile
+import unittest
+
+import zephyr
+from zephyr.protocol import Protocol, MessageFrameParser, BufferedMessageFrameParser, MessageDataLogger
+from zephyr.replay import ReplayEngine, VirtualClock
+from zephyr.testing import test_data_dir, VirtualSerial
+
+
+def read_message_frames(stream_data_path, read_chunk_size):
+    message_frames = []
+    
+    message_parser = MessageFrameParser(message_frames.append)
+    protocol = Protocol(VirtualSerial(stream_data_path), [message_parser.parse_data],
+                        read_chunk_size=read_chunk_size)
+    
+    try:
+        protocol.run()
+    except EOFError:
+        pass
+    
+    return [(frame.message_id, list(frame.payload), frame.eom) for frame in message_frames]
+
+
+def parse_message_frames(parser_class, data_string, chunk_size):
+    message_frames = []
+    message_parser = parser_class(message_frames.append)
+    
+    for chunk_start in range(0, len(data_string), chunk_size):
+        message_parser.parse_data(data_string[chunk_start:chunk_start + chunk_size])
+    
+    return [(frame.message_id, list(frame.payload), frame.eom) for frame in message_frames]
+
+
+class ChunkedReadTest(unittest.TestCase):
+    def test_chunked_reads_produce_identical_frames(self):
+        for file_name in ["120-second-bt-stream.dat", "120-second-bt-stream-hxm.dat"]:
+            stream_data_path = test_data_dir + "/" + file_name
+            
+            bytewise_frames = read_message_frames(stream_data_path, 1)
+            self.assertTrue(len(bytewise_frames))
+            
+            for read_chunk_size in [7, 128, 4096]:
+                chunked_frames = read_message_frames(stream_data_path, read_chunk_size)
+                self.assertEqual(chunked_frames, bytewise_frames)
+
+
+class BufferedMessageFrameParserTest(unittest.TestCase):
+    def assert_frames_equal(self, data_string):
+        expected_frames = parse_message_frames(MessageFrameParser, data_string, 1)
+        
+        for chunk_size in [1, 2, 5, 130, 4096, len(data_string)]:
+            frames = parse_message_frames(BufferedMessageFrameParser, data_string, chunk_size)
+            self.assertEqual(frames, expected_frames)
+        
+        return expected_frames
+    
+    def test_recorded_streams(self):
+        for file_name in ["120-second-bt-stream.dat", "120-second-bt-stream-hxm.dat"]:
+            data_string = open(test_data_dir + "/" + file_name, "rb").read()
+            self.assertTrue(len(self.assert_frames_equal(data_string)))
+    
+    def test_corrupted_stream(self):
+        data_bytes = bytearray(open(test_data_dir + "/120-second-bt-stream.dat", "rb").read())
+        
+        random_generator = random.Random(0)
+        for i in range(200):  #@UnusedVariable
+            data_bytes[random_generator.randrange(len(data_bytes))] = random_generator.choice([0x02, 0x03, 0xFF,
+                                                                                                random_generator.randrange(256)])
+        
+        self.assert_frames_equal(str(data_bytes))
+
+
+class MessageDataLoggerTest(unittest.TestCase):
+    def setUp(self):
+        self.temporary_dir = tempfile.mkdtemp()
+        self.log_file_basepath = os.path.join(self.temporary_dir, "log")
+        self.stream_data_path = test_data_dir + "/120-second-bt-stream.dat"
+        
+        self.clock = VirtualClock()
+        self.original_time = zephyr.time
+        zephyr.time = self.clock.time
+    
+    def tearDown(self):
+        zephyr.time = self.original_time
+        shutil.rmtree(self.temporary_dir)
+    
+    def replay_to_logger(self, logger):
+        for chunk_timestamp, data in ReplayEngine(self.stream_data_path, [], self.clock).iterate_chunks():
+            self.clock.now = chunk_timestamp
+            logger(data)
+    
+    def test_logged_files_match_recording(self):
+        logger = MessageDataLogger(self.log_file_basepath)
+        self.replay_to_logger(logger)
+        logger.close()
+        
+        self.assertEqual(open(self.log_file_basepath + ".dat", "rb").read(),
+                         open(self.stream_data_path, "rb").read())
+        
+        # The last timing entry is only written when more data arrives after it
+        expected_timing_lines = open(test_data_dir + "/120-second-bt-stream-timing.csv", "rb").readlines()[:-1]
+        self.assertEqual(open(self.log_file_basepath + "-timing.csv", "rb").readlines(), expected_timing_lines)
+    
+    def test_rotation(self):
+        logger = MessageDataLogger(self.log_file_basepath, flush_byte_count=4096, rotate_byte_count=20000)
+        self.replay_to_logger(logger)
+        logger.close()
+        
+        data_file_count = len(glob.glob(self.log_file_basepath + "*.dat"))
+        self.assertEqual(data_file_count, 6)
+        
+        logged_data = ""
+        for file_index in range(data_file_count):
+            log_file_basepath = logger.get_log_file_basepath(file_index)
+            data = open(log_file_basepath + ".dat", "rb").read()
+            timing_lines = open(log_file_basepath + "-timing.csv", "rb").readlines()
+            
+            if file_index < data_file_count - 1:
+                self.assertTrue(20000 <= len(data) < 21000)
+            self.assertTrue(len(timing_lines) > 0)
+            self.assertTrue(int(timing_lines[-1].split(",")[1]) <= len(data))
+            
+            logged_data += data
+        
+        self.assertEqual(logged_data, open(self.stream_data_path, "rb").read())
+    
+    def test_background_flush(self):
+        logger = MessageDataLogger(self.log_file_basepath, flush_byte_count=1000)
+        logger.start_flushing()
+        
+        data = open(self.stream_data_path, "rb").read(5000)
+        logger(data)
+        
+        for i in range(100):  #@UnusedVariable
+            if os.path.getsize(self.log_file_basepath + ".dat") == len(data):
+                break
+            zephyr.sleep(0.01)
+        
+        self.assertEqual(open(self.log_file_basepath + ".dat", "rb").read(), data)
+        
+        logger.close()
+        self.assertFalse(logger.flushing_thread.is_alive())
+    
+    def test_callback_writes_at_once(self):
+        logger = MessageDataLogger(self.log_file_basepath)
+        protocol = Protocol(VirtualSerial(self.stream_data_path), [logger], 4096)
+        
+        try:
+            while True:
+                protocol.read_and_handle_bytes(4096)
+        except EOFError:
+            pass
+        
+        self.assertEqual(len(logger.buffer), 0)
+        
+        logger.data_file.flush()
+        self.assertEqual(open(self.log_file_basepath + ".dat", "rb").read(),
+                         open(self.stream_data_path, "rb").read())
@@ -0,0 +1,96 @@
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import zephyr.util
+from zephyr.protocol import MessageFrameParser, BufferedMessageFrameParser
+from zephyr.recording import IndexedRecording, convert_to_recording, convert_from_recording
+from zephyr.replay import read_timing_data
+from zephyr.testing import test_data_dir
+
+
+class IndexedRecordingTest(unittest.TestCase):
+    def setUp(self):
+        self.temporary_dir = tempfile.mkdtemp()
+        self.stream_data_path = test_data_dir + "/120-second-bt-stream.dat"
+        self.recording_path = os.path.join(self.temporary_dir, "recording.zrec")
+        
+        convert_to_recording(self.stream_data_path, self.recording_path)
+        self.recording = IndexedRecording(self.recording_path)
+        
+        self.original_use_numpy = zephyr.util.USE_NUMPY
+    
+    def tearDown(self):
+        zephyr.util.USE_NUMPY = self.original_use_numpy
+        self.recording.close()
+        shutil.rmtree(self.temporary_dir)
+    
+    def test_conversion_round_trip(self):
+        for file_name in ["120-second-bt-stream", "120-second-bt-stream-hxm"]:
+            recording_path = os.path.join(self.temporary_dir, file_name + ".zrec")
+            converted_stream_data_path = os.path.join(self.temporary_dir, file_name + ".dat")
+            
+            convert_to_recording(os.path.join(test_data_dir, file_name + ".dat"), recording_path)
+            convert_from_recording(recording_path, converted_stream_data_path)
+            
+            for suffix in [".dat", "-timing.csv"]:
+                self.assertEqual(open(os.path.join(self.temporary_dir, file_name + suffix), "rb").read(),
+                                 open(os.path.join(test_data_dir, file_name + suffix), "rb").read())
+    
+    def test_frame_index(self):
+        expected_frames = []
+        MessageFrameParser(expected_frames.append).parse_data(open(self.stream_data_path, "rb").read())
+        
+        frame_columns = self.recording.read_frame_columns(0, len(self.recording))
+        self.assertEqual(list(frame_columns.message_ids), [frame.message_id for frame in expected_frames])
+        self.assertEqual([list(self.recording.get_payload(stream_offset)) for stream_offset in frame_columns.stream_offsets],
+                         [list(frame.payload) for frame in expected_frames])
+        
+        arrival_times = list(frame_columns.arrival_times)
+        self.assertEqual(arrival_times, sorted(arrival_times))
+        self.assertEqual(arrival_times[0], read_timing_data(test_data_dir + "/120-second-bt-stream-timing.csv")[0][0])
+    
+    def test_find_frames(self):
+        arrival_times = list(self.recording.read_frame_columns(0, len(self.recording)).arrival_times)
+        start_time = arrival_times[0] + 30.0
+        end_time = arrival_times[0] + 40.0
+        
+        expected_indices = [frame_i for frame_i, arrival_time in enumerate(arrival_times)
+                            if start_time <= arrival_time <= end_time]
+        
+        self.assertEqual(self.recording.find_frames(start_time, end_time),
+                         (expected_indices[0], expected_indices[-1] + 1))
+        self.assertEqual(self.recording.find_frames(0, 1), (0, 0))
+    
+    def test_read_signal(self):
+        start_time = self.recording.arrival_times[0] + 30.0
+        end_time = start_time + 10.0
+        
+        expected_packets = [message for arrival_time, message in self.recording.iterate_messages(start_time, end_time)
+                            if getattr(message, "type", None) == "acceleration"]
+        expected_sample_count = sum(len(signal_packet.samples) for signal_packet in expected_packets)
+        
+        for use_numpy in set([False, self.original_use_numpy]):
+            zephyr.util.USE_NUMPY = use_numpy
+            timestamps, samples = self.recording.read_signal("acceleration", start_time, end_time)
+            
+            self.assertEqual(len(timestamps), expected_sample_count)
+            self.assertEqual(len(samples), expected_sample_count * (1 if use_numpy else 3))
+            self.assertEqual(timestamps[0], expected_packets[0].timestamp)
+            self.assertAlmostEqual(timestamps[1] - timestamps[0], 1 / 50.0)
+
+
+class StreamOffsetTest(unittest.TestCase):
+    def test_buffered_parser_stream_offsets(self):
+        stream_data = open(test_data_dir + "/120-second-bt-stream.dat", "rb").read()
+        frames = []
+        message_parser = BufferedMessageFrameParser(frames.append)
+        
+        for chunk_start in range(0, len(stream_data), 100):
+            message_parser.parse_data(stream_data[chunk_start:chunk_start + 100])
+        
+        for frame in frames:
+            self.assertEqual(stream_data[frame.stream_offset], "\x02")
+            self.assertEqual(ord(stream_data[frame.stream_offset + 1]), frame.message_id)
@@ -0,0 +1,61 @@
+
+import unittest
+
+from zephyr.protocol import MessageFrameParser
+from zephyr.replay import ReplayEngine, VirtualClock, read_timing_data, replay_measurement
+from zephyr.testing import test_data_dir
+
+
+class ReplayEngineTest(unittest.TestCase):
+    def setUp(self):
+        self.stream_data_path = test_data_dir + "/120-second-bt-stream.dat"
+        self.timing_data_path = test_data_dir + "/120-second-bt-stream-timing.csv"
+    
+    def replay_chunks(self, use_mmap):
+        clock = VirtualClock()
+        chunks = []
+        
+        def callback(data):
+            chunks.append((clock.time(), data))
+        
+        ReplayEngine(self.stream_data_path, [callback], clock, use_mmap=use_mmap).run()
+        return chunks
+    
+    def test_chunks_arrive_at_recorded_times(self):
+        timestamps, cumulative_byte_counts = read_timing_data(self.timing_data_path)
+        
+        for use_mmap in [True, False]:
+            chunks = self.replay_chunks(use_mmap)
+            
+            self.assertEqual("".join(data for chunk_timestamp, data in chunks),
+                             open(self.stream_data_path, "rb").read())
+            self.assertEqual([chunk_timestamp for chunk_timestamp, data in chunks[:len(timestamps)]],
+                             list(timestamps))
+            
+            chunk_ends = []
+            for chunk_timestamp, data in chunks:
+                chunk_ends.append(len(data) + (chunk_ends[-1] if chunk_ends else 0))
+            self.assertEqual(chunk_ends[:len(cumulative_byte_counts)], list(cumulative_byte_counts))
+    
+    def test_replay_measurement(self):
+        expected_frames = []
+        MessageFrameParser(expected_frames.append).parse_data(open(self.stream_data_path, "rb").read())
+        
+        collector, statistics = replay_measurement(self.stream_data_path)
+        
+        self.assertEqual(statistics.packet_count, len(expected_frames))
+        self.assertEqual(statistics.byte_count, len(open(self.stream_data_path, "rb").read()))
+        
+        # The analysis uses the recorded arrival times instead of the current time
+        timestamps = read_timing_data(self.timing_data_path)[0]
+        heart_rate_timestamps = collector.get_event_stream("heart_rate").events_between(float("-inf"), float("inf"))[0]
+        self.assertEqual(len(heart_rate_timestamps), 150)
+        self.assertTrue(timestamps[0] - 5.0 < heart_rate_timestamps[0] < heart_rate_timestamps[-1] < timestamps[-1] + 5.0)
+    
+    def test_replay_hxm_measurement(self):
+        collector = replay_measurement(test_data_dir + "/120-second-bt-stream-hxm.dat", use_mmap=False)[0]
+        
+        timestamps = read_timing_data(test_data_dir + "/120-second-bt-stream-hxm-timing.csv")[0]
+        heart_rate_timestamps = collector.get_event_stream("heart_rate").events_between(float("-inf"), float("inf"))[0]
+        self.assertEqual(heart_rate_timestamps[0], timestamps[0])
+        self.assertTrue(set(heart_rate_timestamps) <= set(timestamps))
@@ -0,0 +1,187 @@
+
+import os
+import shutil
+import tempfile
+import unittest
+
+import zephyr.util
+from zephyr.bioharness import BioHarnessPacketHandler, BioHarnessSignalAnalysis
+from zephyr.hxm import HxMPacketAnalysis
+from zephyr.instrumentation import PipelineInstrumentation
+from zephyr.message import MessagePayloadParser, SignalPacket, SummaryMessage, HxMMessage
+from zephyr.protocol import MessageFrameParser
+from zephyr.replay import replay_measurement
+from zephyr.synthetic import (pack_bit_packed_values, create_timestamp_bytes, SyntheticDevice,
+                              create_synthetic_devices, write_stream_files, SyntheticSerial,
+                              PseudoTerminalPort, HXM_MESSAGE_IDS)
+
+
+START_TIME = 1400000000.0
+
+
+def parse_messages(stream_data, instrumentation=None):
+    messages = []
+    payload_parser = MessagePayloadParser([messages.append])
+    MessageFrameParser(payload_parser.handle_message, instrumentation).parse_data(stream_data)
+    return messages
+
+
+class PayloadEncodingTest(unittest.TestCase):
+    def test_bit_packing(self):
+        values = [0, 1023, 512, 3, 700, 1, 2, 1000]
+        self.assertEqual(zephyr.util.unpack_bit_packed_values(pack_bit_packed_values(values, 10), 10, False), values)
+        
+        values = [-1500, 1500, -1, 0, 32767, -32768]
+        self.assertEqual(zephyr.util.unpack_bit_packed_values(pack_bit_packed_values(values, 16), 16, True), values)
+    
+    def test_timestamp(self):
+        for timestamp in [START_TIME, START_TIME + 0.25, START_TIME + 86400 * 100 + 12345.678]:
+            self.assertAlmostEqual(zephyr.util.parse_timestamp(create_timestamp_bytes(timestamp)), timestamp, 2)
+
+
+class SyntheticDeviceTest(unittest.TestCase):
+    def test_bioharness_messages(self):
+        device = SyntheticDevice(start_time=START_TIME, heart_rate=75.0, seed=1)
+        messages = parse_messages(device.generate_stream_data(START_TIME + 60.1))
+        
+        signal_packets = {}
+        for message in messages:
+            if isinstance(message, SignalPacket):
+                signal_packets.setdefault(message.type, []).append(message)
+        
+        for signal_code, packets_per_minute in [("ecg", 238), ("breathing", 60), ("rr", 60), ("acceleration", 150)]:
+            packets = signal_packets[signal_code]
+            self.assertAlmostEqual(len(packets), packets_per_minute, delta=1)
+            
+            self.assertEqual([packet.sequence_number for packet in packets],
+                             [(packets[0].sequence_number + packet_i) % 256 for packet_i in range(len(packets))])
+            self.assertAlmostEqual(packets[0].timestamp, START_TIME, 2)
+            self.assertAlmostEqual(packets[1].timestamp - packets[0].timestamp,
+                                   len(packets[0].samples) / packets[0].samplerate, 2)
+        
+        self.assertEqual(len(signal_packets["ecg"][0].samples), 63)
+        self.assertTrue(max(max(packet.samples) for packet in signal_packets["ecg"]) > 300)
+        self.assertAlmostEqual(signal_packets["acceleration"][0].samples[0][0], 1.0, delta=0.2)
+        
+        heartbeat_intervals = []
+        rr_analysis = BioHarnessSignalAnalysis([], [lambda stream_name, value: heartbeat_intervals.append(value[1])])
+        for packet in signal_packets["rr"]:
+            rr_analysis.handle_signal(packet, False)
+        
+        self.assertAlmostEqual(len(heartbeat_intervals), 75, delta=3)
+        self.assertAlmostEqual(sum(heartbeat_intervals) / len(heartbeat_intervals), 0.8, delta=0.05)
+        
+        summary_messages = [message for message in messages if isinstance(message, SummaryMessage)]
+        self.assertEqual(len(summary_messages), 60)
+        self.assertAlmostEqual(summary_messages[-1].heart_rate, 75, delta=8)
+        self.assertAlmostEqual(summary_messages[-1].respiration_rate, 15.0, 1)
+        self.assertAlmostEqual(summary_messages[-1].timestamp, START_TIME + 60.0, 2)
+    
+    def test_hxm_messages(self):
+        device = SyntheticDevice(HXM_MESSAGE_IDS, START_TIME, heart_rate=60.0, walking_speed=1.5, seed=2)
+        messages = parse_messages(device.generate_stream_data(START_TIME + 120.1))
+        
+        self.assertEqual(len(messages), 120)
+        self.assertTrue(all(isinstance(message, HxMMessage) for message in messages))
+        self.assertAlmostEqual(messages[-1].distance, 180.0, delta=1.0)
+        self.assertEqual(messages[-1].speed, 1.5)
+        
+        # The messages arrive once a second
+        clock = [START_TIME]
+        heartbeat_intervals = []
+        hxm_analysis = HxMPacketAnalysis([lambda stream_name, value: stream_name == "heartbeat_interval" and
+                                          heartbeat_intervals.append(value[1])], lambda: clock[0])
+        for message in messages:
+            clock[0] += 1.0
+            hxm_analysis.handle_packet(message)
+        
+        self.assertAlmostEqual(len(heartbeat_intervals), 120, delta=3)
+        self.assertAlmostEqual(sum(heartbeat_intervals) / len(heartbeat_intervals), 1.0, delta=0.05)
+    
+    def test_dropout_and_corruption(self):
+        device = SyntheticDevice(start_time=START_TIME, packet_loss_probability=0.05, corruption_probability=0.05,
+                                 seed=3)
+        instrumentation = PipelineInstrumentation()
+        messages = parse_messages(device.generate_stream_data(START_TIME + 120.0), instrumentation)
+        
+        self.assertTrue(device.dropped_frame_count > 0 and device.corrupted_frame_count > 0)
+        self.assertEqual(instrumentation.counters["crc_failures"], device.corrupted_frame_count)
+        self.assertEqual(len(messages), device.frame_count - device.dropped_frame_count - device.corrupted_frame_count)
+        
+        packet_handler = BioHarnessPacketHandler([], [], time_function=lambda: START_TIME,
+                                                 instrumentation=instrumentation)
+        for message in messages:
+            packet_handler.handle_packet(message)
+        
+        self.assertTrue(instrumentation.counters["sequence_gaps"] > 0)
+        self.assertTrue(instrumentation.counters["missing_packets"] <= device.dropped_frame_count +
+                        device.corrupted_frame_count)
+    
+    def test_repeatable(self):
+        first_devices, second_devices = [create_synthetic_devices(3, start_time=START_TIME, seed=4) for i in range(2)]  #@UnusedVariable
+        
+        stream_data = [device.generate_stream_data(START_TIME + 10.0) for device in first_devices]
+        self.assertEqual(stream_data, [device.generate_stream_data(START_TIME + 10.0) for device in second_devices])
+        self.assertEqual(len(set(stream_data)), 3)
+    
+    def test_write_stream_files(self):
+        temporary_dir = tempfile.mkdtemp()
+        
+        try:
+            log_file_basepath = os.path.join(temporary_dir, "synthetic")
+            write_stream_files(SyntheticDevice(start_time=START_TIME, seed=5), 150.0, log_file_basepath)
+            
+            collector, replay_statistics = replay_measurement(log_file_basepath + ".dat")
+            self.assertEqual(replay_statistics.byte_count, os.path.getsize(log_file_basepath + ".dat"))
+            
+            heartbeat_interval_stream = collector.get_event_stream("heartbeat_interval")
+            self.assertTrue(len(heartbeat_interval_stream.events_between(float("-inf"), float("inf"))[0]) > 150)
+        finally:
+            shutil.rmtree(temporary_dir)
+
+
+class SyntheticSerialTest(unittest.TestCase):
+    def read_all(self, connection):
+        data_chunks = []
+        
+        try:
+            while True:
+                data_chunks.append(connection.read(4096))
+        except EOFError:
+            pass
+        
+        return "".join(data_chunks)
+    
+    def test_read(self):
+        stream_data = SyntheticDevice(start_time=START_TIME, seed=6).generate_stream_data(START_TIME + 30.0)
+        
+        connection = SyntheticSerial(SyntheticDevice(start_time=START_TIME, seed=6), 30.0, speed=None)
+        self.assertTrue(connection.inWaiting() > 0)
+        self.assertEqual(self.read_all(connection), stream_data)
+        
+        connection = SyntheticSerial(SyntheticDevice(start_time=START_TIME, seed=6), 1.0, speed=20.0)
+        stream_data = SyntheticDevice(start_time=START_TIME, seed=6).generate_stream_data(START_TIME + 1.0)
+        self.assertEqual(self.read_all(connection), stream_data)
+    
+    @unittest.skipUnless(os.name == "posix", "Pseudo-terminals are only available on POSIX systems")
+    def test_pseudo_terminal(self):
+        stream_data = SyntheticDevice(start_time=START_TIME, seed=7).generate_stream_data(START_TIME + 30.0)
+        
+        port = PseudoTerminalPort(SyntheticSerial(SyntheticDevice(start_time=START_TIME, seed=7), 30.0, speed=None))
+        
+        try:
+            port_fd = os.open(port.port_name, os.O_RDONLY | os.O_NOCTTY)
+            
+            try:
+                data_chunks = []
+                received_byte_count = 0
+                
+                while received_byte_count < len(stream_data):
+                    data_chunks.append(os.read(port_fd, 4096))
+                    received_byte_count += len(data_chunks[-1])
+                
+                self.assertEqual("".join(data_chunks), stream_data)
+            finally:
+                os.close(port_fd)
+        finally:
+            port.close()
@@ -0,0 +1,277 @@
+
+import os
+import time
+import random
+import struct
+import datetime
+import unittest
+
+import zephyr
+from zephyr import util
+from zephyr.protocol import MessageFrameParser
+from zephyr.testing import test_data_dir, standard_deviation
+
+
+def read_payloads(stream_data_path):
+    message_frames = []
+    message_parser = MessageFrameParser(message_frames.append)
+    message_parser.parse_data(open(stream_data_path, "rb").read())
+    return [message_frame.payload for message_frame in message_frames]
+
+
+class Crc8DigestTest(unittest.TestCase):
+    def assert_digests_equal(self, values):
+        expected_crc = util.crc_8_digest_bitwise(values)
+        
+        self.assertEqual(util.crc_8_digest(values), expected_crc)
+        self.assertEqual(util.crc_8_digest(bytearray(values)), expected_crc)
+        self.assertEqual(util.crc_8_digest(str(bytearray(values))), expected_crc)
+        self.assertEqual(util.crc_8_digest(memoryview(bytearray(values))), expected_crc)
+    
+    def test_single_bytes(self):
+        for byte in range(256):
+            self.assert_digests_equal([byte])
+    
+    def test_random_sequences(self):
+        random_generator = random.Random(0)
+        
+        for length in range(130):
+            self.assert_digests_equal([random_generator.randrange(256) for i in range(length)])  #@UnusedVariable
+    
+    def test_recorded_payloads(self):
+        for file_name in ["120-second-bt-stream.dat", "120-second-bt-stream-hxm.dat"]:
+            payloads = read_payloads(test_data_dir + "/" + file_name)
+            self.assertTrue(len(payloads))
+            
+            for payload in payloads:
+                self.assert_digests_equal(payload)
+
+
+@unittest.skipIf(util.numpy is None, "NumPy is not installed")
+class UnpackBitPackedArrayTest(unittest.TestCase):
+    def assert_unpacked_values_equal(self, data_bytes, value_nbits, twos_complement):
+        expected_values = util.unpack_bit_packed_values(data_bytes, value_nbits, twos_complement)
+        unpacked_array = util.unpack_bit_packed_array(data_bytes, value_nbits, twos_complement)
+        self.assertEqual(unpacked_array.tolist(), expected_values)
+    
+    def test_random_data(self):
+        random_generator = random.Random(0)
+        
+        for byte_count in [2, 10, 20, 80, 120]:
+            data_bytes = [random_generator.randrange(256) for i in range(byte_count)]  #@UnusedVariable
+            
+            for value_nbits, twos_complement in [(10, False), (10, True), (16, False), (16, True)]:
+                self.assert_unpacked_values_equal(data_bytes, value_nbits, twos_complement)
+    
+    def test_recorded_payloads(self):
+        payloads = read_payloads(test_data_dir + "/120-second-bt-stream.dat")
+        
+        for payload in payloads:
+            signal_bytes = payload[9:]
+            
+            for value_nbits, twos_complement in [(10, False), (16, True)]:
+                self.assert_unpacked_values_equal(signal_bytes, value_nbits, twos_complement)
+                self.assert_unpacked_values_equal(bytearray(signal_bytes), value_nbits, twos_complement)
+
+
+def parse_timestamp_reference(timestamp_bytes):
+    year = timestamp_bytes[0] + (timestamp_bytes[1] << 8)
+    day_milliseconds = (timestamp_bytes[4] + (timestamp_bytes[5] << 8) +
+                        (timestamp_bytes[6] << 16) + (timestamp_bytes[7] << 24))
+    
+    date = datetime.date(year=year, month=timestamp_bytes[2], day=timestamp_bytes[3])
+    return time.mktime(date.timetuple()) + day_milliseconds / 1000.0
+
+
+def create_timestamp_bytes(date, day_milliseconds):
+    return bytearray(struct.pack("<HBBI", date.year, date.month, date.day, day_milliseconds))
+
+
+@unittest.skipIf(not hasattr(time, "tzset"), "Time zones cannot be changed")
+class ParseTimestampTest(unittest.TestCase):
+    def setUp(self):
+        self.original_timezone = os.environ.get("TZ")
+        os.environ["TZ"] = "Europe/Helsinki"
+        time.tzset()
+        util._midnight_epochs.clear()
+    
+    def tearDown(self):
+        if self.original_timezone is None:
+            del os.environ["TZ"]
+        else:
+            os.environ["TZ"] = self.original_timezone
+        
+        time.tzset()
+        util._midnight_epochs.clear()
+    
+    def test_dst_transitions(self):
+        # The days before, of and after the transitions to and from summer time
+        transition_dates = [datetime.date(2012, 3, 25), datetime.date(2012, 10, 28)]
+        
+        for transition_date in transition_dates:
+            for day_offset in [-1, 0, 1]:
+                date = transition_date + datetime.timedelta(days=day_offset)
+                
+                for day_milliseconds in [0, 3599999, 3600000, 4 * 3600000 + 1, 86399999]:
+                    timestamp_bytes = create_timestamp_bytes(date, day_milliseconds)
+                    expected_timestamp = parse_timestamp_reference(timestamp_bytes)
+                    
+                    self.assertEqual(util.parse_timestamp(timestamp_bytes), expected_timestamp)
+                    self.assertEqual(util.parse_timestamp(list(timestamp_bytes)), expected_timestamp)
+                    self.assertEqual(util.parse_timestamp(bytearray(3) + timestamp_bytes, 3), expected_timestamp)
+        
+        midnight_before_spring_transition = util.parse_timestamp(create_timestamp_bytes(datetime.date(2012, 3, 25), 0))
+        midnight_after_spring_transition = util.parse_timestamp(create_timestamp_bytes(datetime.date(2012, 3, 26), 0))
+        self.assertEqual(midnight_after_spring_transition - midnight_before_spring_transition, 23 * 3600)
+    
+    def test_cache_eviction(self):
+        start_date = datetime.date(2012, 1, 1)
+        
+        for day_i in range(3 * util.MAX_CACHED_MIDNIGHT_EPOCHS):
+            timestamp_bytes = create_timestamp_bytes(start_date + datetime.timedelta(days=day_i), 1000)
+            self.assertEqual(util.parse_timestamp(timestamp_bytes), parse_timestamp_reference(timestamp_bytes))
+            self.assertTrue(len(util._midnight_epochs) <= util.MAX_CACHED_MIDNIGHT_EPOCHS)
+    
+    def test_recorded_payloads(self):
+        message_frames = []
+        MessageFrameParser(message_frames.append).parse_data(open(test_data_dir + "/120-second-bt-stream.dat", "rb").read())
+        
+        timestamped_payloads = [message_frame.payload for message_frame in message_frames
+                                if message_frame.message_id in [0x21, 0x22, 0x24, 0x25, 0x2B]]
+        self.assertTrue(len(timestamped_payloads))
+        
+        for payload in timestamped_payloads:
+            self.assertEqual(util.parse_timestamp(payload, 1), parse_timestamp_reference(payload[1:9]))
+
+
+def median(values):
+    sorted_values = sorted(values)
+    middle = len(sorted_values) // 2
+    
+    if len(sorted_values) % 2:
+        return sorted_values[middle]
+    else:
+        return (sorted_values[middle - 1] + sorted_values[middle]) / 2.0
+
+
+class SlidingWindowTest(unittest.TestCase):
+    def test_random_values(self):
+        random_generator = random.Random(3)
+        window = util.SlidingWindow(10.0, resummation_interval=70)
+        window_maximum = util.SlidingWindowMaximum(10.0)
+        
+        values = []
+        timestamp = 0.0
+        for value_i in range(1000): #@UnusedVariable
+            timestamp += random_generator.uniform(0.0, 0.5)
+            value = random_generator.gauss(1.0, 0.1)
+            
+            values.append((timestamp, value))
+            window.append(timestamp, value)
+            window_maximum.append(timestamp, value)
+            
+            window_values = [window_value for window_timestamp, window_value in values
+                             if window_timestamp > timestamp - 10.0]
+            
+            self.assertEqual(len(window), len(window_values))
+            self.assertAlmostEqual(window.mean, sum(window_values) / len(window_values))
+            self.assertEqual(window_maximum.maximum, max(window_values))
+            
+            if len(window_values) > 1:
+                self.assertAlmostEqual(window.standard_deviation, standard_deviation(window_values))
+            else:
+                self.assertEqual(window.standard_deviation, None)
+
+
+class ClockDifferenceEstimatorTest(unittest.TestCase):
+    def setUp(self):
+        random_generator = random.Random(2)
+        self.arrival_times = [1000.0 + 0.25 * value_i + random_generator.uniform(0.0, 0.1) for value_i in range(500)]
+        self.clock_differences = [3.0 - random_generator.expovariate(10.0) for value_i in range(500)]
+    
+    def estimate_with(self, clock_difference):
+        estimates = []
+        for now, value in zip(self.arrival_times, self.clock_differences):
+            clock_difference.append(now, value)
+            estimates.append(clock_difference.estimate(now))
+        return estimates
+    
+    def test_window_statistics(self):
+        window_length = 60
+        windows = [self.clock_differences[max(0, value_i - window_length + 1):value_i + 1]
+                   for value_i in range(len(self.clock_differences))]
+        
+        for estimate, window in zip(self.estimate_with(util.MeanClockDifference(window_length)), windows):
+            self.assertAlmostEqual(estimate, sum(window) / len(window))
+        
+        for estimate, window in zip(self.estimate_with(util.MinimumDelayClockDifference(window_length)), windows):
+            self.assertEqual(estimate, max(window))
+        
+        for estimate, window in zip(self.estimate_with(util.MedianClockDifference(window_length)), windows):
+            self.assertEqual(estimate, median(window))
+    
+    def test_delayed_burst(self):
+        self.clock_differences[300:310] = [value - 2.0 for value in self.clock_differences[300:310]]
+        
+        mean_estimates = self.estimate_with(util.MeanClockDifference(60))
+        minimum_delay_estimates = self.estimate_with(util.MinimumDelayClockDifference(60))
+        median_estimates = self.estimate_with(util.MedianClockDifference(60))
+        
+        self.assertTrue(mean_estimates[309] < 2.7)
+        self.assertTrue(minimum_delay_estimates[309] > 2.95)
+        self.assertTrue(median_estimates[309] > 2.85)
+    
+    def test_linear_drift(self):
+        # The device clock runs 100 ppm fast
+        self.clock_differences = [3.0 + 1e-4 * (now - 1000.0) for now in self.arrival_times]
+        
+        for now, estimate in zip(self.arrival_times, self.estimate_with(util.LinearDriftClockDifference(60))):
+            self.assertAlmostEqual(estimate, 3.0 + 1e-4 * (now - 1000.0), places=9)
+        
+        mean_estimates = self.estimate_with(util.MeanClockDifference(60))
+        self.assertAlmostEqual(mean_estimates[-1], 3.0 + 1e-4 * (self.arrival_times[-1] - 1000.0), delta=1e-3)
+        self.assertNotAlmostEqual(mean_estimates[-1], 3.0 + 1e-4 * (self.arrival_times[-1] - 1000.0), places=4)
+    
+    def test_long_linear_drift(self):
+        # A device clock that runs 100 ppm fast, first seen three days before
+        # ten minutes of packets four times a second
+        clock_difference = util.LinearDriftClockDifference(60)
+        start_time = 1400000000.0
+        arrival_times = [start_time] + [start_time + 3 * 24 * 3600 + 0.25 * value_i for value_i in range(2400)]
+        
+        for value_i, now in enumerate(arrival_times):
+            clock_difference.append(now, 3.0 + 1e-4 * (now - start_time))
+            
+            # The sums are recomputed once the first value has left the window
+            if value_i >= 120:
+                self.assertAlmostEqual(clock_difference.estimate(now), 3.0 + 1e-4 * (now - start_time), places=9)
+    
+    def test_shared_window(self):
+        clock = [0.0]
+        estimator = util.ClockDifferenceEstimator(lambda: clock[0], share_between_keys=True)
+        shared_estimates = []
+        
+        for value_i, (now, value) in enumerate(zip(self.arrival_times, self.clock_differences)):
+            clock[0] = now
+            key = ["ecg", "rr", "breathing"][value_i % 3]
+            shared_estimates.append(now + value - estimator.estimate_and_correct_timestamp(now + value, key))
+        
+        self.assertEqual(len(estimator._clock_differences), 1)
+        
+        for estimate, expected_estimate in zip(shared_estimates, self.estimate_with(util.MeanClockDifference(60))):
+            self.assertAlmostEqual(estimate, expected_estimate)
+    
+    def test_default_time_function(self):
+        original_time = zephyr.time
+        zephyr.time = lambda: 1000.0
+        
+        try:
+            estimator = util.ClockDifferenceEstimator()
+            self.assertEqual(estimator.estimate_and_correct_timestamp(1003.0, "rr"), 1000.0)
+            self.assertEqual(zephyr.get_time(lambda: 5.0), 5.0)
+            self.assertEqual(zephyr.get_time(None), 1000.0)
+        finally:
+            zephyr.time = original_time
+    
+    def test_unknown_method(self):
+        self.assertRaises(ValueError, util.ClockDifferenceEstimator, method="maximum")
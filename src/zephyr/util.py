@@ -1,127 +1,482 @@
-
-import time
-import datetime
-import collections
-
-import zephyr
-
-
-class FastTime:
-    def __init__(self, speed):
-        self.start_time = time.time()
-        self.speed = speed
-    
-    def __call__(self):
-        seconds_since_start = time.time() - self.start_time
-        now = self.start_time + seconds_since_start * self.speed
-        return now
-
-
-class FastSleep:
-    def __init__(self, speed):
-        self.speed = speed
-    
-    def __call__(self, seconds):
-        time.sleep(seconds / self.speed)
-
-
-def set_time_speed(simulation_speed):
-    zephyr.time = FastTime(simulation_speed)
-    zephyr.sleep = FastSleep(simulation_speed)
-
-
-def crc_8_digest(values):
-    crc = 0
-    
-    for byte in values:
-        crc ^= byte
-        for i in range(8):  #@UnusedVariable
-            if crc & 1:
-                crc = (crc >> 1) ^ 0x8C
-            else:
-                crc = (crc >> 1)
-    
-    return crc
-
-
-def parse_uint16_values_from_bytes(byte_values):
-    assert not len(byte_values) % 2
-    
-    byte_iterator = iter(byte_values)
-    
-    while True:
-        byte1 = byte_iterator.next()
-        byte2 = byte_iterator.next()
-        yield byte1 + (byte2 << 8)
-
-
-def uint16_from_two_bytes((byte1, byte2)):
-    return byte1 + (byte2 << 8)
-
-
-def parse_uint16_values_from_byte_sequence(ls_byte_indices, byte_sequence):
-    values = [uint16_from_two_bytes(byte_sequence[index:index + 2])
-              for index in ls_byte_indices]
-    return values
-
-
-def parse_timestamp(timestamp_bytes):
-    year = timestamp_bytes[0] + (timestamp_bytes[1] << 8)
-    month = timestamp_bytes[2]
-    day = timestamp_bytes[3]
-    day_milliseconds = (timestamp_bytes[4] +
-                        (timestamp_bytes[5] << 8) +
-                        (timestamp_bytes[6] << 16) +
-                        (timestamp_bytes[7] << 24))
-    
-    date = datetime.date(year=year, month=month, day=day)
-    
-    timestamp = time.mktime(date.timetuple()) + day_milliseconds / 1000.0
-    return timestamp
-
-
-def unpack_bit_packed_values(data_bytes, value_nbits, twos_complement):
-    total_bit_count = len(data_bytes) * 8
-    value_count = total_bit_count / value_nbits
-    
-    value_bit_mask = 2**value_nbits - 1
-    represented_value_count = 2**value_nbits
-    half_represented_value_count = represented_value_count / 2
-    
-    unpacked_values = []
-    
-    for value_i in range(value_count):
-        value_start_bit = value_i * value_nbits
-        value_start_byte = value_start_bit / 8
-        bit_offset_from_start_byte = value_start_bit % 8
-        
-        unpacked_value = data_bytes[value_start_byte] + (data_bytes[value_start_byte + 1] << 8)
-        unpacked_value >>= bit_offset_from_start_byte
-        unpacked_value &= value_bit_mask
-        
-        if twos_complement and unpacked_value >= half_represented_value_count:
-            unpacked_value = unpacked_value - represented_value_count
-        
-        unpacked_values.append(unpacked_value)
-    
-    return unpacked_values
-
-
-DISABLE_CLOCK_DIFFERENCE_ESTIMATION = False
-
-class ClockDifferenceEstimator:
-    def __init__(self):
-        self._clock_difference_deques = collections.defaultdict(lambda: collections.deque(maxlen=60))
-    
-    def estimate_and_correct_timestamp(self, timestamp, key):
-        if DISABLE_CLOCK_DIFFERENCE_ESTIMATION:
-            return timestamp
-        
-        instantaneous_zephyr_clock_ahead = timestamp - zephyr.time()
-        self._clock_difference_deques[key].append(instantaneous_zephyr_clock_ahead)
-        
-        clock_ahead_values = self._clock_difference_deques[key]
-        zephyr_clock_ahead_estimate = sum(clock_ahead_values) / float(len(clock_ahead_values))
-        
-        corrected_timestamp = timestamp - zephyr_clock_ahead_estimate
-        return corrected_timestamp
+
+import math
+import time
+import bisect
+import struct
+import datetime
+import threading
+import collections
+
+import zephyr
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# Sample payloads are unpacked into NumPy arrays when NumPy is available
+USE_NUMPY = numpy is not None
+
+
+class FastTime:
+    def __init__(self, speed):
+        self.start_time = time.time()
+        self.speed = speed
+    
+    def __call__(self):
+        seconds_since_start = time.time() - self.start_time
+        now = self.start_time + seconds_since_start * self.speed
+        return now
+
+
+class FastSleep:
+    def __init__(self, speed):
+        self.speed = speed
+    
+    def __call__(self, seconds):
+        time.sleep(seconds / self.speed)
+
+
+class FastWait:
+    def __init__(self, speed):
+        self.speed = speed
+    
+    def __call__(self, condition, seconds):
+        condition.wait(seconds / self.speed)
+
+
+def set_time_speed(simulation_speed):
+    zephyr.time = FastTime(simulation_speed)
+    zephyr.sleep = FastSleep(simulation_speed)
+    zephyr.wait = FastWait(simulation_speed)
+
+
+def crc_8_digest_bitwise(values):
+    crc = 0
+    
+    for byte in values:
+        crc ^= byte
+        for i in range(8):  #@UnusedVariable
+            if crc & 1:
+                crc = (crc >> 1) ^ 0x8C
+            else:
+                crc = (crc >> 1)
+    
+    return crc
+
+
+CRC_8_TABLE = bytearray(crc_8_digest_bitwise([byte]) for byte in range(256))
+
+def crc_8_digest(values):
+    """Calculate the CRC-8 (polynomial 0x8C) of a sequence of byte values.
+    The values can be a list of integers, a bytearray, a byte string or a
+    memoryview."""
+    if isinstance(values, (str, memoryview)):
+        values = bytearray(values)
+    
+    crc_table = CRC_8_TABLE
+    crc = 0
+    
+    for byte in values:
+        crc = crc_table[crc ^ byte]
+    
+    return crc
+
+
+def parse_uint16_values_from_bytes(byte_values):
+    assert not len(byte_values) % 2
+    
+    byte_iterator = iter(byte_values)
+    
+    while True:
+        byte1 = byte_iterator.next()
+        byte2 = byte_iterator.next()
+        yield byte1 + (byte2 << 8)
+
+
+def uint16_from_two_bytes((byte1, byte2)):
+    return byte1 + (byte2 << 8)
+
+
+def parse_uint16_values_from_byte_sequence(ls_byte_indices, byte_sequence):
+    values = [uint16_from_two_bytes(byte_sequence[index:index + 2])
+              for index in ls_byte_indices]
+    return values
+
+
+# Date as a 32-bit integer and milliseconds since midnight
+TIMESTAMP_FIELDS = struct.Struct("<II")
+
+# Local midnight epochs by the 32-bit date value. The cache assumes that
+# the time zone of the process does not change.
+MAX_CACHED_MIDNIGHT_EPOCHS = 64
+_midnight_epochs = {}
+
+def get_midnight_epoch(date_value):
+    midnight_epoch = _midnight_epochs.get(date_value)
+    
+    if midnight_epoch is None:
+        year = date_value & 0xFFFF
+        month = (date_value >> 16) & 0xFF
+        day = date_value >> 24
+        
+        date = datetime.date(year=year, month=month, day=day)
+        midnight_epoch = time.mktime(date.timetuple())
+        
+        if len(_midnight_epochs) >= MAX_CACHED_MIDNIGHT_EPOCHS:
+            _midnight_epochs.popitem()
+        
+        _midnight_epochs[date_value] = midnight_epoch
+    
+    return midnight_epoch
+
+
+def parse_timestamp(timestamp_bytes, offset=0):
+    """Parse the 8-byte timestamp at the given offset: the year, month and
+    day, and the milliseconds since the local midnight"""
+    try:
+        date_value, day_milliseconds = TIMESTAMP_FIELDS.unpack_from(timestamp_bytes, offset)
+    except TypeError:
+        # A sequence of integers instead of a buffer
+        date_value, day_milliseconds = TIMESTAMP_FIELDS.unpack_from(bytearray(timestamp_bytes[offset:offset + 8]))
+    
+    return get_midnight_epoch(date_value) + day_milliseconds / 1000.0
+
+
+def unpack_bit_packed_values(data_bytes, value_nbits, twos_complement):
+    total_bit_count = len(data_bytes) * 8
+    value_count = total_bit_count / value_nbits
+    
+    value_bit_mask = 2**value_nbits - 1
+    represented_value_count = 2**value_nbits
+    half_represented_value_count = represented_value_count / 2
+    
+    unpacked_values = []
+    
+    for value_i in range(value_count):
+        value_start_bit = value_i * value_nbits
+        value_start_byte = value_start_bit / 8
+        bit_offset_from_start_byte = value_start_bit % 8
+        
+        unpacked_value = data_bytes[value_start_byte] + (data_bytes[value_start_byte + 1] << 8)
+        unpacked_value >>= bit_offset_from_start_byte
+        unpacked_value &= value_bit_mask
+        
+        if twos_complement and unpacked_value >= half_represented_value_count:
+            unpacked_value = unpacked_value - represented_value_count
+        
+        unpacked_values.append(unpacked_value)
+    
+    return unpacked_values
+
+
+_bit_unpacking_indices = {}
+
+def get_bit_unpacking_indices(byte_count, value_nbits):
+    """Return the indices of the first byte of each value in a padded byte
+    array, and the bit offsets of the values from those bytes."""
+    key = (byte_count, value_nbits)
+    
+    if key not in _bit_unpacking_indices:
+        value_count = byte_count * 8 / value_nbits
+        value_start_bits = numpy.arange(value_count, dtype=numpy.int32) * value_nbits
+        _bit_unpacking_indices[key] = (value_start_bits >> 3, value_start_bits & 7)
+    
+    return _bit_unpacking_indices[key]
+
+
+def unpack_bit_packed_array(data_bytes, value_nbits, twos_complement):
+    """NumPy version of unpack_bit_packed_values, returns an integer array."""
+    byte_count = len(data_bytes)
+    value_start_bytes, bit_offsets = get_bit_unpacking_indices(byte_count, value_nbits)
+    
+    # One padding byte so that the second byte of each value can always be read
+    padded_bytes = numpy.zeros(byte_count + 1, dtype=numpy.int32)
+    padded_bytes[:byte_count] = numpy.frombuffer(bytes(bytearray(data_bytes)), dtype=numpy.uint8)
+    
+    unpacked_values = padded_bytes[value_start_bytes] + (padded_bytes[value_start_bytes + 1] << 8)
+    unpacked_values >>= bit_offsets
+    unpacked_values &= 2**value_nbits - 1
+    
+    if twos_complement:
+        represented_value_count = 2**value_nbits
+        unpacked_values[unpacked_values >= represented_value_count / 2] -= represented_value_count
+    
+    return unpacked_values
+
+
+class SlidingWindow:
+    """The mean and the standard deviation of the values whose keys are
+    within window_length of the latest key, where the keys are e.g.
+    timestamps or value indices. The sums are kept up to date as values
+    enter and leave the window, and they are recomputed from the window once
+    per resummation_interval appends to keep rounding errors from
+    accumulating."""
+    def __init__(self, window_length, resummation_interval=1000):
+        self.window_length = window_length
+        self.resummation_interval = resummation_interval
+        self.window = collections.deque()
+        self.value_sum = 0.0
+        self.squared_value_sum = 0.0
+        self.appends_until_resummation = resummation_interval
+    
+    def __len__(self):
+        return len(self.window)
+    
+    def append(self, key, value):
+        self.window.append((key, value))
+        self.value_sum += value
+        self.squared_value_sum += value * value
+        
+        self.expire(key)
+        
+        self.appends_until_resummation -= 1
+        if not self.appends_until_resummation:
+            self.value_sum = float(sum(value for key, value in self.window))
+            self.squared_value_sum = float(sum(value * value for key, value in self.window))
+            self.appends_until_resummation = self.resummation_interval
+    
+    def expire(self, key):
+        """Remove the values that are older than window_length at the given
+        key"""
+        while self.window and self.window[0][0] <= key - self.window_length:
+            removed_key, removed_value = self.window.popleft() #@UnusedVariable
+            self.value_sum -= removed_value
+            self.squared_value_sum -= removed_value * removed_value
+        
+        if not self.window:
+            self.value_sum = 0.0
+            self.squared_value_sum = 0.0
+    
+    @property
+    def mean(self):
+        return self.value_sum / len(self.window)
+    
+    @property
+    def standard_deviation(self):
+        """The sample standard deviation, None with less than two values"""
+        value_count = len(self.window)
+        
+        if value_count < 2:
+            return None
+        
+        variance = (self.squared_value_sum - self.value_sum * self.value_sum / value_count) / (value_count - 1)
+        return math.sqrt(max(0.0, variance))
+
+
+class SlidingWindowMaximum:
+    """The maximum of the values whose keys are within window_length of the
+    latest key, kept with a monotonic deque of (key, value) pairs"""
+    def __init__(self, window_length):
+        self.window_length = window_length
+        self.maximum_candidates = collections.deque()
+    
+    def append(self, key, value):
+        while self.maximum_candidates and self.maximum_candidates[-1][1] <= value:
+            self.maximum_candidates.pop()
+        
+        self.maximum_candidates.append((key, value))
+        
+        while self.maximum_candidates[0][0] <= key - self.window_length:
+            self.maximum_candidates.popleft()
+    
+    @property
+    def maximum(self):
+        return self.maximum_candidates[0][1]
+
+
+DISABLE_CLOCK_DIFFERENCE_ESTIMATION = False
+
+
+class MeanClockDifference:
+    """The mean of the latest window_length clock differences"""
+    def __init__(self, window_length):
+        self.window = SlidingWindow(window_length, resummation_interval=window_length)
+        self.value_count = 0
+    
+    def append(self, now, clock_difference):
+        self.window.append(self.value_count, clock_difference)
+        self.value_count += 1
+    
+    def estimate(self, now):
+        return self.window.mean
+
+
+class MinimumDelayClockDifference:
+    """The clock difference of the least delayed value in the window.
+    Transmission delays only decrease the observed difference between the
+    device clock and the arrival time, so a delayed burst of packets does not
+    affect the estimate."""
+    def __init__(self, window_length):
+        self.window_maximum = SlidingWindowMaximum(window_length)
+        self.value_count = 0
+    
+    def append(self, now, clock_difference):
+        self.window_maximum.append(self.value_count, clock_difference)
+        self.value_count += 1
+    
+    def estimate(self, now):
+        return self.window_maximum.maximum
+
+
+class MedianClockDifference:
+    """The median of the latest clock differences, from a sorted copy of the
+    window that is updated with bisection"""
+    def __init__(self, window_length):
+        self.window_length = window_length
+        self.window = collections.deque()
+        self.sorted_window = []
+    
+    def append(self, now, clock_difference):
+        self.window.append(clock_difference)
+        bisect.insort(self.sorted_window, clock_difference)
+        
+        if len(self.window) > self.window_length:
+            del self.sorted_window[bisect.bisect_left(self.sorted_window, self.window.popleft())]
+    
+    def estimate(self, now):
+        value_count = len(self.sorted_window)
+        middle = value_count // 2
+        
+        if value_count % 2:
+            return self.sorted_window[middle]
+        else:
+            return (self.sorted_window[middle - 1] + self.sorted_window[middle]) / 2.0
+
+
+class LinearDriftClockDifference:
+    """A least squares line through the latest clock differences as a
+    function of time, evaluated at the current time. Follows a drifting
+    device clock without the lag of the mean. The sums of the fit are kept
+    up to date like in MeanClockDifference, with the times relative to a
+    reference time for numerical accuracy. The reference time is moved to
+    the oldest value of the window whenever the sums are recomputed, so that
+    the relative times stay small however long the measurement is."""
+    def __init__(self, window_length):
+        self.window_length = window_length
+        self.window = collections.deque()
+        self.reference_time = None
+        self.sums = [0.0, 0.0, 0.0, 0.0]
+        self.appends_until_resummation = window_length
+    
+    def _add_to_sums(self, now, y, sign):
+        x = now - self.reference_time
+        self.sums[0] += sign * x
+        self.sums[1] += sign * y
+        self.sums[2] += sign * x * x
+        self.sums[3] += sign * x * y
+    
+    def append(self, now, clock_difference):
+        if self.reference_time is None:
+            self.reference_time = now
+        
+        self.window.append((now, clock_difference))
+        self._add_to_sums(now, clock_difference, 1)
+        
+        if len(self.window) > self.window_length:
+            self._add_to_sums(*(self.window.popleft() + (-1,)))
+        
+        self.appends_until_resummation -= 1
+        if not self.appends_until_resummation:
+            self.reference_time = self.window[0][0]
+            self.sums = [0.0, 0.0, 0.0, 0.0]
+            for now, y in self.window:
+                self._add_to_sums(now, y, 1)
+            self.appends_until_resummation = self.window_length
+    
+    def estimate(self, now):
+        value_count = len(self.window)
+        sum_x, sum_y, sum_xx, sum_xy = self.sums
+        
+        mean_x = sum_x / value_count
+        mean_y = sum_y / value_count
+        variance_x = sum_xx / value_count - mean_x * mean_x
+        
+        # The times of the values are too close for fitting the drift
+        if variance_x <= 1e-9 * max(1.0, mean_x * mean_x):
+            return mean_y
+        
+        slope = (sum_xy / value_count - mean_x * mean_y) / variance_x
+        return mean_y + slope * (now - self.reference_time - mean_x)
+
+
+CLOCK_DIFFERENCE_METHODS = {"mean": MeanClockDifference,
+                            "minimum_delay": MinimumDelayClockDifference,
+                            "median": MedianClockDifference,
+                            "linear_drift": LinearDriftClockDifference}
+
+
+class ClockDifferenceEstimator:
+    """Corrects device timestamps to the local clock by estimating how much
+    the device clock is ahead from the latest timestamps and their arrival
+    times. The estimate is updated in constant time per timestamp (in
+    logarithmic time with the median). Each key, e.g. the stream type, has
+    its own window of values unless the streams share a window, in which
+    case each value updates the single estimate of the device."""
+    def __init__(self, time_function=None, method="mean", window_length=60, share_between_keys=False):
+        if method not in CLOCK_DIFFERENCE_METHODS:
+            raise ValueError("Unknown clock difference estimation method %r" % method)
+        
+        self.time_function = time_function
+        self.share_between_keys = share_between_keys
+        
+        clock_difference_class = CLOCK_DIFFERENCE_METHODS[method]
+        self._clock_differences = collections.defaultdict(lambda: clock_difference_class(window_length))
+    
+    def estimate_and_correct_timestamp(self, timestamp, key):
+        if DISABLE_CLOCK_DIFFERENCE_ESTIMATION:
+            return timestamp
+        
+        if self.share_between_keys:
+            key = None
+        
+        now = zephyr.get_time(self.time_function)
+        instantaneous_zephyr_clock_ahead = timestamp - now
+        
+        clock_difference = self._clock_differences[key]
+        clock_difference.append(now, instantaneous_zephyr_clock_ahead)
+        zephyr_clock_ahead_estimate = clock_difference.estimate(now)
+        
+        corrected_timestamp = timestamp - zephyr_clock_ahead_estimate
+        return corrected_timestamp
+
+
+class SequenceLock:
+    """Lets a single writer update a structure while readers take consistent
+    copies of it without ever blocking the writer. The writer increments the
+    sequence number before and after each update, in a with statement, and a
+    reader retries its read if an update was in progress or the sequence
+    number changed during the read. Writers are serialized with a lock that
+    the readers never take."""
+    def __init__(self):
+        self.sequence_number = 0
+        self.write_lock = threading.Lock()
+    
+    def __enter__(self):
+        self.write_lock.acquire()
+        self.sequence_number += 1
+    
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.sequence_number += 1
+        self.write_lock.release()
+    
+    def read(self, read_function, *args):
+        """Call read_function(*args) until it completes without concurrent
+        updates and return its result. The function must not modify
+        anything, and it may see an inconsistent state, e.g. raise an
+        IndexError, before it is retried."""
+        while True:
+            sequence_number = self.sequence_number
+            
+            if not sequence_number & 1:
+                try:
+                    result = read_function(*args)
+                except Exception:
+                    if self.sequence_number == sequence_number:
+                        raise
+                else:
+                    if self.sequence_number == sequence_number:
+                        return result
+            
+            # Let the writer finish its update
+            time.sleep(0)
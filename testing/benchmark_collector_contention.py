@@ -0,0 +1,91 @@
+import time
+import threading
+
+from zephyr.collector import MeasurementCollector
+from zephyr.message import SignalPacket
+
+
+# Packets are appended at 40 times the real-time rate of a 250 Hz ECG stream
+SAMPLERATE = 250.0
+PACKET_LENGTH = 63
+PACKET_INTERVAL = 0.001
+PACKET_COUNT = 1000
+
+
+class VirtualTime:
+    def __init__(self):
+        self.now = 0.0
+    
+    def time(self):
+        return self.now
+
+
+def produce(collector, virtual_time, append_latencies):
+    samples = [float(sample_i) for sample_i in range(PACKET_LENGTH)]
+    
+    for packet_i in range(PACKET_COUNT):
+        packet_timestamp = 1000.0 + packet_i * PACKET_LENGTH / SAMPLERATE
+        virtual_time.now = packet_timestamp
+        
+        start_time = time.time()
+        collector.handle_signal(SignalPacket("ecg", packet_timestamp, SAMPLERATE, samples, packet_i % 256), False)
+        collector.handle_event("heartbeat_interval", (packet_timestamp, 1.0))
+        append_latencies.append(time.time() - start_time)
+        
+        time.sleep(PACKET_INTERVAL)
+
+
+def read_continuously(collector, stop_event, slow):
+    """Read the whole history over and over, like a plotting consumer. A slow
+    reader keeps a sample generator open while it processes the samples."""
+    signal_stream_history = collector.get_signal_stream_history("ecg")
+    event_stream = collector.get_event_stream("heartbeat_interval")
+    
+    while not stop_event.is_set():
+        if slow:
+            for sample_i, sample in enumerate(signal_stream_history.iterate_samples(0, float("inf"))): #@UnusedVariable
+                if sample_i % 500 == 0:
+                    time.sleep(0.001)
+        else:
+            signal_stream_history.get_timed_samples(0, float("inf"))
+            event_stream.events_between(float("-inf"), float("inf"))
+            time.sleep(0.0001)
+
+
+def measure(reader_count, slow):
+    virtual_time = VirtualTime()
+    collector = MeasurementCollector(history_length_seconds=20.0, time_function=virtual_time.time)
+    
+    stop_event = threading.Event()
+    readers = [threading.Thread(target=read_continuously, args=(collector, stop_event, slow))
+               for reader_i in range(reader_count)] #@UnusedVariable
+    
+    for reader in readers:
+        reader.start()
+    
+    append_latencies = []
+    try:
+        produce(collector, virtual_time, append_latencies)
+    finally:
+        stop_event.set()
+        for reader in readers:
+            reader.join()
+    
+    append_latencies.sort()
+    return (sum(append_latencies) / len(append_latencies),
+            append_latencies[int(0.99 * len(append_latencies))],
+            append_latencies[-1])
+
+
+def main():
+    for reader_count, slow in [(0, False), (2, False), (4, False), (2, True)]:
+        mean_latency, p99_latency, max_latency = measure(reader_count, slow)
+        description = "%d %s readers" % (reader_count, "slow" if slow else "fast")
+        print "%-14s: append latency mean %.0f us, 99th percentile %.0f us, max %.0f us" % (description,
+                                                                                          1e6 * mean_latency,
+                                                                                          1e6 * p99_latency,
+                                                                                          1e6 * max_latency)
+
+
+if __name__ == "__main__":
+    main()
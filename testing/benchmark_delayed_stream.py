@@ -0,0 +1,83 @@
+
+import math
+import time
+import resource
+
+import zephyr
+from zephyr.collector import MeasurementCollector
+from zephyr.delayed_stream import DelayedRealTimeStream
+from zephyr.message import SignalPacket
+
+
+# Stream name, sample rate and samples per packet. The value of each
+# sample is its own timestamp, so that the output latency can be measured.
+SIGNAL_STREAMS = [("ecg", 250.0, 63), ("breathing", 18.0, 18), ("rr", 18.0, 18)]
+
+
+def feed_collector(collector, duration):
+    start_time = zephyr.time()
+    next_packet_times = dict((stream_name, start_time) for stream_name, samplerate, packet_length in SIGNAL_STREAMS)  #@UnusedVariable
+    next_event_time = start_time
+    
+    while zephyr.time() < start_time + duration:
+        for stream_name, samplerate, packet_length in SIGNAL_STREAMS:
+            packet_start_time = next_packet_times[stream_name]
+            packet_end_time = packet_start_time + packet_length / samplerate
+            
+            if packet_end_time <= zephyr.time():
+                samples = [packet_start_time + sample_i / samplerate for sample_i in range(packet_length)]
+                collector.handle_signal(SignalPacket(stream_name, packet_start_time, samplerate, samples, 0), False)
+                next_packet_times[stream_name] = packet_end_time
+        
+        if next_event_time <= zephyr.time():
+            collector.handle_event("heart_rate", (next_event_time, next_event_time))
+            next_event_time += 1.0
+        
+        time.sleep(0.005)
+
+
+def get_cpu_seconds():
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    return usage.ru_utime + usage.ru_stime
+
+
+def measure(stream_class, max_batch_latencies={}, delay=1.2, active_duration=5.0, idle_duration=3.0):
+    collector = MeasurementCollector()
+    latencies = []
+    
+    def callback(stream_name, sample):
+        latencies.append(zephyr.time() - (sample + delay))
+    
+    delayed_stream = stream_class(collector, [callback], delay, max_batch_latencies=max_batch_latencies)
+    delayed_stream.start()
+    
+    cpu_seconds_before = get_cpu_seconds()
+    feed_collector(collector, active_duration)
+    time.sleep(delay + 0.1)
+    active_cpu_seconds = get_cpu_seconds() - cpu_seconds_before
+    
+    cpu_seconds_before = get_cpu_seconds()
+    time.sleep(idle_duration)
+    idle_cpu_seconds = get_cpu_seconds() - cpu_seconds_before
+    
+    delayed_stream.terminate()
+    delayed_stream.join()
+    
+    mean_latency = sum(latencies) / len(latencies)
+    latency_deviation = math.sqrt(sum((latency - mean_latency)**2 for latency in latencies) / len(latencies))
+    
+    print "%s, max batch latencies %s: %d samples" % (stream_class.__name__, max_batch_latencies, len(latencies))
+    print "  latency mean %.2f ms, standard deviation %.2f ms, max %.2f ms" % (mean_latency * 1000,
+                                                                           latency_deviation * 1000,
+                                                                           max(latencies) * 1000)
+    print "  CPU time %.3f s while streaming, %.3f s during %.1f s idle" % (active_cpu_seconds, idle_cpu_seconds,
+                                                                          idle_duration)
+
+
+def main():
+    measure(DelayedRealTimeStream)
+    measure(DelayedRealTimeStream, {"ecg": 0.05})
+
+
+if __name__ == "__main__":
+    main()
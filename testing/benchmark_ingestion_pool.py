@@ -0,0 +1,49 @@
+
+import os
+import sys
+import time
+import functools
+import multiprocessing
+
+from zephyr.collector import MeasurementCollector
+from zephyr.ingestion import IngestionPool
+from zephyr.testing import test_data_dir, create_replay_connection
+
+
+def create_collector():
+    return MeasurementCollector(history_length_seconds=1e9)
+
+
+def measure(device_count, process_count):
+    stream_data_path = os.path.join(test_data_dir, "120-second-bt-stream.dat")
+    megabytes = device_count * os.path.getsize(stream_data_path) / 1e6
+    
+    device_definitions = [(functools.partial(create_replay_connection, stream_data_path), False)] * device_count
+    
+    pool = IngestionPool(device_definitions, process_count, create_collector)
+    
+    start_time = time.time()
+    pool.run()
+    duration = time.time() - start_time
+    
+    sample_count = sum(len(list(signal_stream_history.iterate_samples(0, float("inf"))))
+                       for collector in pool.collectors
+                       for stream_name, signal_stream_history in collector.iterate_signal_stream_histories())  #@UnusedVariable
+    
+    print "%3d devices, %d processes: %.2f s, %.2f MB/s, %.0f samples/s" % (device_count, process_count, duration,
+                                                                           megabytes / duration,
+                                                                           sample_count / duration)
+
+
+def main():
+    device_counts = [int(arg) for arg in sys.argv[1:]] or [1, 4, 16]
+    
+    print "%d CPUs" % multiprocessing.cpu_count()
+    
+    for device_count in device_counts:
+        for process_count in [1, 2, 4]:
+            measure(device_count, process_count)
+
+
+if __name__ == "__main__":
+    main()
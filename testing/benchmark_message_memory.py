@@ -0,0 +1,117 @@
+
+import gc
+import sys
+import time
+import itertools
+
+import zephyr.util
+
+from zephyr.bioharness import BioHarnessPacketHandler
+from zephyr.message import MessagePayloadParser
+from zephyr.protocol import MessageFrameParser, BufferedMessageFrameParser
+from zephyr.testing import test_data_dir
+
+
+def get_deep_size(value, seen_ids):
+    """Approximate the memory used by an object and the objects it refers to.
+    Each object is counted once."""
+    if id(value) in seen_ids or value is None or isinstance(value, type):
+        return 0
+    
+    seen_ids.add(id(value))
+    size = sys.getsizeof(value)
+    
+    if isinstance(value, (list, tuple)):
+        size += sum(get_deep_size(item, seen_ids) for item in value)
+    elif isinstance(value, dict):
+        size += sum(get_deep_size(key, seen_ids) + get_deep_size(item, seen_ids) for key, item in value.items())
+    
+    if hasattr(value, "__dict__"):
+        size += get_deep_size(value.__dict__, seen_ids)
+    
+    for slot_class in type(value).__mro__:
+        for slot_name in slot_class.__dict__.get("__slots__", ()):
+            size += get_deep_size(getattr(value, slot_name, None), seen_ids)
+    
+    return size
+
+
+def measure(description, create_objects):
+    """Report the time to create a list of objects, the memory they retain and
+    the number of objects tracked by the garbage collector they add"""
+    gc.collect()
+    object_count_before = len(gc.get_objects())
+    
+    start_time = time.time()
+    objects = create_objects()
+    duration = time.time() - start_time
+    
+    gc.collect()
+    tracked_object_count = len(gc.get_objects()) - object_count_before
+    
+    if not objects:
+        return objects
+    
+    seen_ids = set()
+    retained_bytes = sum(get_deep_size(value, seen_ids) for value in objects)
+    
+    print "%-40s %5d objects, %6.1f ms, %5.0f bytes and %4.1f tracked objects per object" % (
+        description, len(objects), 1e3 * duration, retained_bytes / float(len(objects)),
+        tracked_object_count / float(len(objects)))
+    
+    return objects
+
+
+def parse_frames(parser_class, stream_data):
+    frames = []
+    parser_class(frames.append).parse_data(stream_data)
+    return frames
+
+
+def parse_packets(frames):
+    packets = []
+    payload_parser = MessagePayloadParser([packets.append])
+    
+    for frame in frames:
+        payload_parser.handle_message(frame)
+    
+    return packets
+
+
+def handle_packets(packets):
+    corrected_signal_packets = []
+    packet_handler = BioHarnessPacketHandler([lambda signal_packet, starts_new_stream: corrected_signal_packets.append(signal_packet)], [])
+    
+    for packet in packets:
+        packet_handler.handle_packet(packet)
+    
+    return corrected_signal_packets
+
+
+def decode_all_fields(packets):
+    for packet in packets:
+        for field_name in packet._fields:
+            getattr(packet, field_name)
+    
+    return packets
+
+
+def main():
+    numpy_settings = [False, True] if zephyr.util.numpy is not None else [False]
+    
+    for use_numpy, file_name in itertools.product(numpy_settings, ["120-second-bt-stream.dat",
+                                                                   "120-second-bt-stream-hxm.dat"]):
+        zephyr.util.USE_NUMPY = use_numpy
+        print "%s, NumPy %s" % (file_name, "used" if use_numpy else "not used")
+        stream_data = open(test_data_dir + "/" + file_name, "rb").read()
+        
+        measure("MessageFrameParser frames", lambda: parse_frames(MessageFrameParser, stream_data))
+        frames = measure("BufferedMessageFrameParser frames", lambda: parse_frames(BufferedMessageFrameParser, stream_data))
+        
+        packets = measure("Packets", lambda: parse_packets(frames))
+        measure("Timestamp corrected signal packets", lambda: handle_packets(packets))
+        measure("Packets after decoding all fields", lambda: decode_all_fields(packets))
+
+
+if __name__ == "__main__":
+    main()
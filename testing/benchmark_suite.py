@@ -0,0 +1,1073 @@
+
+"""Benchmarks of the stages of the data pipeline over the recorded BioHarness
+and HxM streams, and over longer and multi-device workloads synthesized from
+them. The results are written as JSON so that the results of different
+versions can be compared:
+    
+    python benchmark_suite.py --output before.json
+    python benchmark_suite.py --output after.json --compare before.json
+
+Measurements that need concurrent threads, processes or real time are in
+the other benchmark_*.py scripts.
+"""
+
+import os
+import gc
+import sys
+import json
+import math
+import time
+import shutil
+import platform
+import argparse
+import tempfile
+import subprocess
+import collections
+
+import zephyr.util
+from zephyr.bioharness import BioHarnessPacketHandler, BioHarnessSignalAnalysis, extract_heartbeat_intervals
+from zephyr.collector import MeasurementCollector, EventStream, SignalStreamHistory
+from zephyr.delayed_stream import DelayedRealTimeStream
+from zephyr.hxm import HxMPacketAnalysis
+from zephyr.instrumentation import PipelineInstrumentation, instrument
+from zephyr.message import (MessagePayloadParser, SignalPacket, SummaryMessage, HxMMessage, decode_summary_payloads,
+                            decode_hxm_payloads)
+from zephyr.metrics import MetricsEngine, HeartRateVariabilityMetric
+from zephyr.protocol import Protocol, MessageFrameParser, BufferedMessageFrameParser, MessageDataLogger
+from zephyr.replay import ReplayEngine, VirtualClock
+from zephyr.testing import test_data_dir
+
+
+# The arrival times of the devices of a multi-device workload are staggered
+# by this much, so that their chunks interleave
+DEVICE_ARRIVAL_OFFSET = 0.013
+
+# DelayedRealTimeStream is polled at this interval of the recorded time
+DELAYED_STREAM_POLL_INTERVAL = 0.05
+
+# The history length of the signal stream history benchmarks, and how often
+# they clean up the history, in packets
+SIGNAL_HISTORY_SECONDS = 600.0
+SIGNAL_HISTORY_CLEANUP_INTERVAL = 20
+
+# The slow storage of the data logger benchmarks stalls this long on every
+# 4096 bytes written
+SLOW_STORAGE_STALL_SECONDS = 0.005
+
+# The message IDs of the payloads that start with a sequence number and a
+# device timestamp
+TIMESTAMPED_MESSAGE_IDS = [0x21, 0x22, 0x24, 0x25, 0x2B]
+
+BULK_DECODERS = {0x2B: decode_summary_payloads,
+                 0x26: decode_hxm_payloads}
+
+
+class Workload:
+    """The arrival chunks and message frames of one or more devices. A device
+    repeats the recording repetition_count times, and the device timestamps
+    and sequence numbers of each repetition continue from the previous one,
+    so that the repetitions form one continuous measurement."""
+    def __init__(self, name, file_name, device_count=1, repetition_count=1):
+        self.name = name
+        self.file_name = file_name
+        self.device_count = device_count
+        self.repetition_count = repetition_count
+        
+        stream_data_path = os.path.join(test_data_dir, file_name)
+        recording_chunks = list(ReplayEngine(stream_data_path, [], VirtualClock(), use_mmap=False).iterate_chunks())
+        
+        recording_frames = []
+        frame_parser = BufferedMessageFrameParser(recording_frames.append)
+        frame_arrival_timestamps = []
+        for chunk_timestamp, data in recording_chunks:
+            frame_parser.parse_data(data)
+            frame_arrival_timestamps.extend([chunk_timestamp] * (len(recording_frames) - len(frame_arrival_timestamps)))
+        
+        # Leave out the incomplete frame at the end of the recording, which
+        # would swallow the first frame of the next repetition
+        complete_chunks = []
+        chunk_start = 0
+        for chunk_timestamp, data in recording_chunks:
+            data = data[:max(0, frame_parser.buffer_offset - chunk_start)]
+            chunk_start += len(data)
+            
+            if len(data):
+                complete_chunks.append((chunk_timestamp, data))
+        
+        recording_chunks = complete_chunks
+        
+        # The repetitions follow each other at the average chunk interval
+        recording_span = recording_chunks[-1][0] - recording_chunks[0][0]
+        self.repetition_seconds = recording_span * len(recording_chunks) / max(1, len(recording_chunks) - 1)
+        
+        self.sequence_number_counts = collections.Counter()
+        for message in decode_frames(recording_frames):
+            self.sequence_number_counts[get_sequence_key(message)] += 1
+        
+        self.byte_count = sum(len(data) for chunk_timestamp, data in recording_chunks) * device_count * repetition_count
+        
+        # (arrival timestamp, device index, repetition index, data) and
+        # (arrival timestamp, device index, repetition index, message frame)
+        # of all the devices in the order of arrival
+        self.chunks = self._interleave([chunk_timestamp for chunk_timestamp, data in recording_chunks],
+                                       [data for chunk_timestamp, data in recording_chunks])
+        self.frames = self._interleave(frame_arrival_timestamps, recording_frames)
+    
+    def _interleave(self, timestamps, items):
+        interleaved = []
+        
+        for device_i in range(self.device_count):
+            for repetition_i in range(self.repetition_count):
+                time_offset = repetition_i * self.repetition_seconds + device_i * DEVICE_ARRIVAL_OFFSET
+                interleaved.extend((timestamp + time_offset, device_i, repetition_i, item)
+                                   for timestamp, item in zip(timestamps, items))
+        
+        interleaved.sort(key=lambda entry: entry[:3])
+        return interleaved
+    
+    def shift_message(self, message, device_i, repetition_i):
+        """Move the device timestamp and the sequence number of a message of
+        the recording to the given repetition of the given device"""
+        if not repetition_i and not device_i:
+            return message
+        
+        time_offset = repetition_i * self.repetition_seconds + device_i * DEVICE_ARRIVAL_OFFSET
+        sequence_offset = repetition_i * self.sequence_number_counts[get_sequence_key(message)]
+        
+        if isinstance(message, (SignalPacket, SummaryMessage)):
+            message = message._replace(timestamp=message.timestamp + time_offset,
+                                       sequence_number=(message.sequence_number + sequence_offset) % 256)
+        
+        return message
+    
+    def get_device_data(self):
+        """Return the data of each device in the order of arrival"""
+        device_data_chunks = [[] for device_i in range(self.device_count)]  #@UnusedVariable
+        
+        for arrival_timestamp, device_i, repetition_i, data in self.chunks:  #@UnusedVariable
+            device_data_chunks[device_i].append(data)
+        
+        return ["".join(data_chunks) for data_chunks in device_data_chunks]
+    
+    def decode_messages(self):
+        """Return (arrival timestamp, device index, message) for all the
+        messages, decoded and shifted in advance"""
+        messages = []
+        payload_parser = MessagePayloadParser([messages.append])
+        
+        decoded_messages = []
+        for arrival_timestamp, device_i, repetition_i, message_frame in self.frames:
+            payload_parser.handle_message(message_frame)
+            
+            if messages:
+                message = self.shift_message(messages.pop(), device_i, repetition_i)
+                decoded_messages.append((arrival_timestamp, device_i, message))
+        
+        return decoded_messages
+
+
+def get_sequence_key(message):
+    return message.type if isinstance(message, SignalPacket) else type(message).__name__
+
+
+def decode_frames(message_frames):
+    messages = []
+    payload_parser = MessagePayloadParser([messages.append])
+    
+    for message_frame in message_frames:
+        payload_parser.handle_message(message_frame)
+    
+    return messages
+
+
+def decode_message_fully(message):
+    """Access the lazily decoded fields of a message"""
+    if isinstance(message, SignalPacket):
+        return message.samples
+    elif isinstance(message, HxMMessage):
+        return message.heartbeat_milliseconds
+
+
+class PipelineCallRecorder:
+    """Records the calls that the packet handlers make to the collector, so
+    that the collector can be benchmarked on its own"""
+    def __init__(self, clock, device_i, calls):
+        self.clock = clock
+        self.device_i = device_i
+        self.calls = calls
+    
+    def handle_signal(self, signal_packet, starts_new_stream):
+        self.calls.append((self.clock.now, self.device_i, "handle_signal", (signal_packet, starts_new_stream)))
+    
+    def handle_event(self, stream_name, value):
+        self.calls.append((self.clock.now, self.device_i, "handle_event", (stream_name, value)))
+    
+    def handle_events(self, stream_name, timestamps, values):
+        self.calls.append((self.clock.now, self.device_i, "handle_events", (stream_name, timestamps, values)))
+
+
+class StringSerial:
+    """A serial port that returns the given data and then raises EOFError"""
+    def __init__(self, data):
+        self.data = data
+        self.position = 0
+    
+    def open(self):
+        return None
+    
+    def read(self, byte_count):
+        read_bytes = self.data[self.position:self.position + byte_count]
+        
+        if len(read_bytes) == 0:
+            raise EOFError("End of data reached")
+        
+        self.position += len(read_bytes)
+        return read_bytes
+
+
+class SlowFile:
+    """A file that stalls for a while on every 4096 bytes written, like a
+    slow storage device"""
+    def __init__(self, output_file, stall_seconds):
+        self.output_file = output_file
+        self.stall_seconds = stall_seconds
+        self.unstalled_byte_count = 0
+    
+    def write(self, data):
+        self.unstalled_byte_count += len(data)
+        
+        while self.unstalled_byte_count >= 4096:
+            time.sleep(self.stall_seconds)
+            self.unstalled_byte_count -= 4096
+        
+        self.output_file.write(data)
+    
+    def __getattr__(self, name):
+        return getattr(self.output_file, name)
+
+
+class SlowMessageDataLogger(MessageDataLogger):
+    """A MessageDataLogger whose data files are SlowFiles"""
+    def open_files(self, file_index):
+        MessageDataLogger.open_files(self, file_index)
+        self.data_file = SlowFile(self.data_file, SLOW_STORAGE_STALL_SECONDS)
+
+
+def create_packet_handlers(clock, signal_callbacks, event_callbacks, batch_event_callbacks, instrumentation=None):
+    rr_signal_analysis = BioHarnessSignalAnalysis([], [], batch_event_callbacks)
+    
+    bioharness_packet_handler = BioHarnessPacketHandler(signal_callbacks + [instrument(instrumentation, "rr_analysis",
+                                                                                       rr_signal_analysis.handle_signal)],
+                                                        event_callbacks, time_function=clock.time,
+                                                        instrumentation=instrumentation)
+    hxm_packet_analysis = HxMPacketAnalysis(event_callbacks, clock.time)
+    
+    return [instrument(instrumentation, "bioharness_packet_handler", bioharness_packet_handler.handle_packet),
+            instrument(instrumentation, "hxm_packet_handler", hxm_packet_analysis.handle_packet)]
+
+
+def record_collector_calls(workload):
+    """Return (arrival timestamp, device index, method name, arguments) for the
+    calls that the packet handlers of the workload make to the collector"""
+    clock = VirtualClock()
+    calls = []
+    device_packet_handlers = []
+    
+    for device_i in range(workload.device_count):
+        recorder = PipelineCallRecorder(clock, device_i, calls)
+        device_packet_handlers.append(create_packet_handlers(clock, [recorder.handle_signal], [recorder.handle_event],
+                                                             [recorder.handle_events]))
+    
+    for arrival_timestamp, device_i, message in workload.decode_messages():
+        clock.now = arrival_timestamp
+        decode_message_fully(message)
+        
+        for packet_handler in device_packet_handlers[device_i]:
+            packet_handler(message)
+    
+    return calls
+
+
+class Measurement:
+    """The durations of the calls to a stage, and the number of items they
+    processed"""
+    def __init__(self, item_name, latency_unit, byte_count=None):
+        self.item_name = item_name
+        self.latency_unit = latency_unit
+        self.byte_count = byte_count
+        self.item_count = 0
+        self.durations = []
+    
+    @property
+    def seconds(self):
+        return sum(self.durations)
+    
+    def get_result(self, workload_name, benchmark_name):
+        seconds = self.seconds
+        durations = sorted(self.durations)
+        
+        def percentile(fraction):
+            return durations[min(len(durations) - 1, int(math.ceil(fraction * len(durations))) - 1)] * 1e6
+        
+        result = collections.OrderedDict([
+            ("workload", workload_name),
+            ("benchmark", benchmark_name),
+            ("item_name", self.item_name),
+            ("items", self.item_count),
+            ("bytes", self.byte_count),
+            ("seconds", seconds),
+            ("items_per_second", self.item_count / seconds if seconds > 0 else None),
+            ("megabytes_per_second", self.byte_count / 1e6 / seconds if self.byte_count and seconds > 0 else None),
+            ("latency_unit", self.latency_unit),
+            ("latency_microseconds", collections.OrderedDict([
+                ("mean", seconds / len(durations) * 1e6 if durations else None),
+                ("median", percentile(0.5) if durations else None),
+                ("p99", percentile(0.99) if durations else None),
+                ("max", durations[-1] * 1e6 if durations else None)]))])
+        
+        return result
+
+
+def benchmark_framing(parser_class):
+    def benchmark(workload):
+        measurement = Measurement("frames", "chunk", workload.byte_count)
+        
+        def count_frame(message_frame):
+            measurement.item_count += 1
+        
+        parsers = [parser_class(count_frame) for device_i in range(workload.device_count)]  #@UnusedVariable
+        durations = measurement.durations
+        timer = time.time
+        
+        for arrival_timestamp, device_i, repetition_i, data in workload.chunks:  #@UnusedVariable
+            start_time = timer()
+            parsers[device_i].parse_data(data)
+            durations.append(timer() - start_time)
+        
+        return measurement
+    
+    return benchmark
+
+
+def benchmark_serial_reads(read_chunk_size):
+    def benchmark(workload):
+        """Reading of the data of each device through Protocol with the given
+        read_chunk_size, including the framing"""
+        measurement = Measurement("frames", "read", workload.byte_count)
+        durations = measurement.durations
+        timer = time.time
+        
+        def count_frame(message_frame):
+            measurement.item_count += 1
+        
+        for data in workload.get_device_data():
+            protocol = Protocol(StringSerial(data), [MessageFrameParser(count_frame).parse_data], read_chunk_size)
+            
+            while True:
+                start_time = timer()
+                
+                try:
+                    protocol.read_and_handle_bytes(read_chunk_size)
+                except EOFError:
+                    break
+                
+                durations.append(timer() - start_time)
+        
+        return measurement
+    
+    return benchmark
+
+
+def benchmark_data_logger(start_flushing, slow_storage=False):
+    def benchmark(workload):
+        """Logging of the arrival chunks with MessageDataLogger, writing in the
+        call or from the flushing thread, optionally to slow storage"""
+        measurement = Measurement("chunks", "chunk", workload.byte_count)
+        durations = measurement.durations
+        timer = time.time
+        temporary_dir = tempfile.mkdtemp()
+        
+        try:
+            logger_class = SlowMessageDataLogger if slow_storage else MessageDataLogger
+            loggers = [logger_class(os.path.join(temporary_dir, "device-%d" % device_i))
+                       for device_i in range(workload.device_count)]
+            
+            if start_flushing:
+                for logger in loggers:
+                    logger.start_flushing()
+            
+            for arrival_timestamp, device_i, repetition_i, data in workload.chunks:  #@UnusedVariable
+                start_time = timer()
+                loggers[device_i](data)
+                durations.append(timer() - start_time)
+            
+            for logger in loggers:
+                logger.close()
+        finally:
+            shutil.rmtree(temporary_dir)
+        
+        measurement.item_count = len(durations)
+        return measurement
+    
+    return benchmark
+
+
+def benchmark_crc(workload):
+    measurement = Measurement("frames", "frame")
+    durations = measurement.durations
+    timer = time.time
+    crc_8_digest = zephyr.util.crc_8_digest
+    
+    for arrival_timestamp, device_i, repetition_i, message_frame in workload.frames:  #@UnusedVariable
+        start_time = timer()
+        crc_8_digest(message_frame.payload)
+        durations.append(timer() - start_time)
+    
+    measurement.item_count = len(durations)
+    return measurement
+
+
+def benchmark_payload_decoding(workload):
+    measurement = Measurement("frames", "frame")
+    durations = measurement.durations
+    timer = time.time
+    
+    messages = []
+    payload_parser = MessagePayloadParser([messages.append])
+    
+    for arrival_timestamp, device_i, repetition_i, message_frame in workload.frames:  #@UnusedVariable
+        start_time = timer()
+        payload_parser.handle_message(message_frame)
+        if messages:
+            decode_message_fully(messages.pop())
+        durations.append(timer() - start_time)
+    
+    measurement.item_count = len(durations)
+    return measurement
+
+
+def benchmark_timestamps(workload):
+    measurement = Measurement("timestamps", "timestamp")
+    durations = measurement.durations
+    timer = time.time
+    parse_timestamp = zephyr.util.parse_timestamp
+    
+    for arrival_timestamp, device_i, repetition_i, message_frame in workload.frames:  #@UnusedVariable
+        if message_frame.message_id in TIMESTAMPED_MESSAGE_IDS:
+            payload = message_frame.payload
+            
+            start_time = timer()
+            parse_timestamp(payload, 1)
+            durations.append(timer() - start_time)
+    
+    measurement.item_count = len(durations)
+    return measurement
+
+
+def benchmark_bulk_decoding(workload):
+    """Decoding of all the summary and HxM payloads of a device at once"""
+    measurement = Measurement("payloads", "device")
+    timer = time.time
+    
+    device_payloads = collections.defaultdict(list)
+    for arrival_timestamp, device_i, repetition_i, message_frame in workload.frames:  #@UnusedVariable
+        if message_frame.message_id in BULK_DECODERS:
+            device_payloads[device_i, message_frame.message_id].append(message_frame.payload)
+    
+    for (device_i, message_id), payloads in sorted(device_payloads.items()):  #@UnusedVariable
+        start_time = timer()
+        BULK_DECODERS[message_id](payloads)
+        measurement.durations.append(timer() - start_time)
+        measurement.item_count += len(payloads)
+    
+    return measurement
+
+
+def benchmark_packet_handling(workload):
+    measurement = Measurement("packets", "packet")
+    durations = measurement.durations
+    timer = time.time
+    
+    decoded_messages = workload.decode_messages()
+    for arrival_timestamp, device_i, message in decoded_messages:  #@UnusedVariable
+        decode_message_fully(message)
+    
+    clock = VirtualClock()
+    device_packet_handlers = [create_packet_handlers(clock, [], [], [])
+                              for device_i in range(workload.device_count)]  #@UnusedVariable
+    
+    for arrival_timestamp, device_i, message in decoded_messages:
+        clock.now = arrival_timestamp
+        packet_handlers = device_packet_handlers[device_i]
+        
+        start_time = timer()
+        for packet_handler in packet_handlers:
+            packet_handler(message)
+        durations.append(timer() - start_time)
+    
+    measurement.item_count = len(durations)
+    return measurement
+
+
+def benchmark_clock_difference(method, window_length=60, share_between_keys=False):
+    def benchmark(workload):
+        """Correction of the device timestamps of the messages with the given
+        clock difference estimation method, window length and window
+        sharing"""
+        measurement = Measurement("messages", "message")
+        durations = measurement.durations
+        timer = time.time
+        
+        clock = VirtualClock()
+        estimators = [zephyr.util.ClockDifferenceEstimator(clock.time, method, window_length, share_between_keys)
+                      for device_i in range(workload.device_count)]  #@UnusedVariable
+        
+        for arrival_timestamp, device_i, message in workload.decode_messages():
+            if isinstance(message, (SignalPacket, SummaryMessage)):
+                clock.now = arrival_timestamp
+                estimator = estimators[device_i]
+                timestamp = message.timestamp
+                key = get_sequence_key(message)
+                
+                start_time = timer()
+                estimator.estimate_and_correct_timestamp(timestamp, key)
+                durations.append(timer() - start_time)
+        
+        measurement.item_count = len(durations)
+        return measurement
+    
+    return benchmark
+
+
+def get_signal_packets(workload, signal_type):
+    """Return (device index, signal packet, starts_new_stream) for the signal
+    packets of the given type, timestamp corrected by
+    BioHarnessPacketHandler"""
+    signal_packets = []
+    clock = VirtualClock()
+    
+    def create_packet_handler(device_i):
+        def handle_signal(signal_packet, starts_new_stream):
+            if signal_packet.type == signal_type:
+                decode_message_fully(signal_packet)
+                signal_packets.append((device_i, signal_packet, starts_new_stream))
+        
+        return BioHarnessPacketHandler([handle_signal], [], time_function=clock.time)
+    
+    packet_handlers = [create_packet_handler(device_i) for device_i in range(workload.device_count)]
+    
+    for arrival_timestamp, device_i, message in workload.decode_messages():
+        clock.now = arrival_timestamp
+        packet_handlers[device_i].handle_packet(message)
+    
+    return signal_packets
+
+
+def benchmark_rr_analysis(batch):
+    def benchmark(workload):
+        """Heartbeat detection from the RR signal packets with per-event or
+        batch event callbacks"""
+        measurement = Measurement("heartbeats", "packet")
+        durations = measurement.durations
+        timer = time.time
+        
+        def count_heartbeat(stream_name, value):
+            measurement.item_count += 1
+        
+        def count_heartbeats(stream_name, timestamps, values):
+            measurement.item_count += len(values)
+        
+        rr_signal_packets = get_signal_packets(workload, "rr")
+        
+        if batch:
+            signal_analyses = [BioHarnessSignalAnalysis([], [], [count_heartbeats])
+                               for device_i in range(workload.device_count)]  #@UnusedVariable
+        else:
+            signal_analyses = [BioHarnessSignalAnalysis([], [count_heartbeat])
+                               for device_i in range(workload.device_count)]  #@UnusedVariable
+        
+        for device_i, signal_packet, starts_new_stream in rr_signal_packets:
+            signal_analysis = signal_analyses[device_i]
+            
+            start_time = timer()
+            signal_analysis.handle_signal(signal_packet, starts_new_stream)
+            durations.append(timer() - start_time)
+        
+        return measurement
+    
+    return benchmark
+
+
+def benchmark_rr_extraction(workload):
+    """Offline heartbeat detection from the stored RR signal history of each
+    device"""
+    measurement = Measurement("samples", "device")
+    timer = time.time
+    
+    clock = VirtualClock()
+    collectors = [MeasurementCollector(history_length_seconds=1e9, time_function=clock.time,
+                                       downsampling_levels=())
+                  for device_i in range(workload.device_count)]  #@UnusedVariable
+    
+    rr_device_indices = set()
+    
+    for device_i, signal_packet, starts_new_stream in get_signal_packets(workload, "rr"):
+        collectors[device_i].handle_signal(signal_packet, starts_new_stream)
+        measurement.item_count += len(signal_packet.samples)
+        rr_device_indices.add(device_i)
+    
+    for device_i in sorted(rr_device_indices):
+        rr_signal_stream_history = collectors[device_i].get_signal_stream_history("rr")
+        
+        start_time = timer()
+        extract_heartbeat_intervals(rr_signal_stream_history)
+        measurement.durations.append(timer() - start_time)
+    
+    return measurement
+
+
+def benchmark_collector(workload):
+    """Insertion of the samples and events into collectors with the default
+    20 s history, including the periodic cleanup"""
+    measurement = Measurement("calls", "call")
+    durations = measurement.durations
+    timer = time.time
+    
+    calls = record_collector_calls(workload)
+    
+    clock = VirtualClock()
+    collectors = [MeasurementCollector(time_function=clock.time) for device_i in range(workload.device_count)]  #@UnusedVariable
+    
+    for arrival_timestamp, device_i, method_name, args in calls:
+        clock.now = arrival_timestamp
+        method = getattr(collectors[device_i], method_name)
+        
+        start_time = timer()
+        method(*args)
+        durations.append(timer() - start_time)
+    
+    measurement.item_count = len(durations)
+    return measurement
+
+
+def benchmark_metrics(workload):
+    """Updating of the default derived metrics with MetricsEngine, including
+    the storing of their outputs in the collectors"""
+    measurement = Measurement("calls", "call")
+    durations = measurement.durations
+    timer = time.time
+    
+    calls = record_collector_calls(workload)
+    
+    clock = VirtualClock()
+    metrics_engines = [MetricsEngine(MeasurementCollector(time_function=clock.time))
+                       for device_i in range(workload.device_count)]  #@UnusedVariable
+    
+    for arrival_timestamp, device_i, method_name, args in calls:
+        clock.now = arrival_timestamp
+        method = getattr(metrics_engines[device_i], method_name)
+        
+        start_time = timer()
+        method(*args)
+        durations.append(timer() - start_time)
+    
+    measurement.item_count = len(durations)
+    return measurement
+
+
+def get_heartbeats(workload):
+    """Return (device index, timestamp, interval) for the heartbeats that the
+    packet handlers of the workload detect"""
+    heartbeats = []
+    
+    for arrival_timestamp, device_i, method_name, args in record_collector_calls(workload):  #@UnusedVariable
+        if args[0] != "heartbeat_interval":
+            continue
+        
+        if method_name == "handle_events":
+            stream_name, timestamps, intervals = args  #@UnusedVariable
+            heartbeats.extend((device_i, timestamp, interval) for timestamp, interval in zip(timestamps, intervals))
+        elif method_name == "handle_event":
+            timestamp, interval = args[1]
+            heartbeats.append((device_i, timestamp, interval))
+    
+    return heartbeats
+
+
+def recompute_heart_rate_variability(heartbeat_stream, timestamp, window_seconds=60.0):
+    """Compute the metrics of HeartRateVariabilityMetric from the stored
+    heartbeats, like a consumer without the metrics engine"""
+    timestamps, intervals = heartbeat_stream.events_between(timestamp - window_seconds, timestamp)  #@UnusedVariable
+    
+    mean_interval = sum(intervals) / len(intervals)
+    rolling_heart_rate = 60.0 / mean_interval
+    
+    if len(intervals) < 2:
+        return rolling_heart_rate, None, None
+    
+    sdnn = math.sqrt(sum((interval - mean_interval) ** 2 for interval in intervals) / (len(intervals) - 1))
+    squared_differences = [(interval - previous_interval) ** 2
+                           for previous_interval, interval in zip(intervals[:-1], intervals[1:])]
+    rmssd = math.sqrt(sum(squared_differences) / len(squared_differences))
+    return rolling_heart_rate, sdnn, rmssd
+
+
+def benchmark_heart_rate_variability(recompute):
+    def benchmark(workload):
+        """Storing of each heartbeat and the heart rate variability after it,
+        updated by HeartRateVariabilityMetric or recomputed from the stored
+        heartbeats of the latest 60 s"""
+        measurement = Measurement("heartbeats", "heartbeat")
+        durations = measurement.durations
+        timer = time.time
+        
+        heartbeat_streams = [EventStream() for device_i in range(workload.device_count)]  #@UnusedVariable
+        metrics = [HeartRateVariabilityMetric() for device_i in range(workload.device_count)]  #@UnusedVariable
+        output = lambda stream_name, timestamp, value: None
+        
+        for device_i, timestamp, interval in get_heartbeats(workload):
+            heartbeat_stream = heartbeat_streams[device_i]
+            metric = metrics[device_i]
+            
+            start_time = timer()
+            heartbeat_stream.append((timestamp, interval))
+            if recompute:
+                recompute_heart_rate_variability(heartbeat_stream, timestamp)
+            else:
+                metric.handle_value(timestamp, interval, output)
+            durations.append(timer() - start_time)
+        
+        measurement.item_count = len(durations)
+        return measurement
+    
+    return benchmark
+
+
+def benchmark_signal_history(packets_per_stream, measure_reads):
+    def benchmark(workload):
+        """Appending of the ECG packets of each device to a signal stream
+        history of SIGNAL_HISTORY_SECONDS, and reading of the new samples
+        through a cursor after each packet, like DelayedRealTimeStream. Either
+        the appending with the periodic cleanup or the reading is measured. A
+        new signal stream is started every packets_per_stream packets, or
+        only where the packet handler detects a gap if it is None."""
+        measurement = Measurement("samples", "packet")
+        durations = measurement.durations
+        timer = time.time
+        
+        signal_stream_histories = [SignalStreamHistory(SIGNAL_HISTORY_SECONDS, downsampling_levels=())
+                                   for device_i in range(workload.device_count)]  #@UnusedVariable
+        cursors = [signal_stream_history.create_cursor() for signal_stream_history in signal_stream_histories]
+        packet_counts = [0] * workload.device_count
+        
+        for device_i, signal_packet, starts_new_stream in get_signal_packets(workload, "ecg"):
+            signal_stream_history = signal_stream_histories[device_i]
+            cursor = cursors[device_i]
+            packet_i = packet_counts[device_i]
+            packet_counts[device_i] += 1
+            
+            if packets_per_stream is not None:
+                starts_new_stream = packet_i % packets_per_stream == 0
+            
+            start_time = timer()
+            signal_stream_history.append_signal_packet(signal_packet, starts_new_stream)
+            if packet_i % SIGNAL_HISTORY_CLEANUP_INTERVAL == 0:
+                signal_stream_history.clean_up_samples_before(signal_packet.timestamp - SIGNAL_HISTORY_SECONDS)
+            append_duration = timer() - start_time
+            
+            start_time = timer()
+            timestamps, samples = cursor.read_timed_samples(signal_packet.timestamp + 1.0)  #@UnusedVariable
+            cursor.get_next_sample_timestamp()
+            read_duration = timer() - start_time
+            
+            if measure_reads:
+                durations.append(read_duration)
+                measurement.item_count += len(samples)
+            else:
+                durations.append(append_duration)
+                measurement.item_count += len(signal_packet.samples)
+        
+        return measurement
+    
+    return benchmark
+
+
+def benchmark_delayed_stream(workload):
+    """Output of the collected samples by DelayedRealTimeStream with a 1.2 s
+    delay, polled at regular intervals of the recorded time"""
+    measurement = Measurement("samples", "poll")
+    durations = measurement.durations
+    timer = time.time
+    
+    calls = record_collector_calls(workload)
+    
+    clock = VirtualClock()
+    collectors = []
+    delayed_streams = []
+    
+    def count_samples(stream_name, timestamps, samples):
+        measurement.item_count += len(samples)
+    
+    for device_i in range(workload.device_count):  #@UnusedVariable
+        collector = MeasurementCollector(time_function=clock.time, downsampling_levels=())
+        collectors.append(collector)
+        delayed_streams.append(DelayedRealTimeStream(collector, [], 1.2, batch_callbacks=[count_samples]))
+    
+    next_poll_time = calls[0][0] if calls else 0.0
+    for arrival_timestamp, device_i, method_name, args in calls + [(float("inf"), None, None, None)]:
+        while next_poll_time <= arrival_timestamp and next_poll_time <= calls[-1][0] + 2.0:
+            for delayed_stream in delayed_streams:
+                start_time = timer()
+                delayed_stream.output_due_samples(next_poll_time)
+                durations.append(timer() - start_time)
+            
+            next_poll_time += DELAYED_STREAM_POLL_INTERVAL
+        
+        if method_name is not None:
+            clock.now = arrival_timestamp
+            getattr(collectors[device_i], method_name)(*args)
+    
+    return measurement
+
+
+def benchmark_pipeline(instrumented):
+    def benchmark(workload):
+        """The whole pipeline from the arrival chunks to the collectors, as in
+        zephyr.replay.replay_measurement, with or without instrumentation"""
+        return measure_pipeline(workload, PipelineInstrumentation() if instrumented else None)
+    
+    return benchmark
+
+
+def measure_pipeline(workload, instrumentation):
+    measurement = Measurement("frames", "chunk", workload.byte_count)
+    durations = measurement.durations
+    timer = time.time
+    
+    clock = VirtualClock()
+    device_parsers = []
+    current_repetition = [0]
+    
+    def create_device_parser(device_i):
+        collector = MeasurementCollector(time_function=clock.time)
+        packet_handlers = create_packet_handlers(clock,
+                                                 [instrument(instrumentation, "collector_signals",
+                                                             collector.handle_signal)],
+                                                 [instrument(instrumentation, "collector_events",
+                                                             collector.handle_event)],
+                                                 [instrument(instrumentation, "collector_event_batches",
+                                                             collector.handle_events)],
+                                                 instrumentation)
+        
+        def handle_message(message):
+            message = workload.shift_message(message, device_i, current_repetition[0])
+            for packet_handler in packet_handlers:
+                packet_handler(message)
+        
+        payload_parser = MessagePayloadParser([handle_message])
+        
+        def handle_frame(message_frame):
+            measurement.item_count += 1
+            payload_parser.handle_message(message_frame)
+        
+        message_parser = BufferedMessageFrameParser(instrument(instrumentation, "payload_parser", handle_frame),
+                                                    instrumentation)
+        return instrument(instrumentation, "frame_parser", message_parser.parse_data, len)
+    
+    for device_i in range(workload.device_count):
+        device_parsers.append(create_device_parser(device_i))
+    
+    for arrival_timestamp, device_i, repetition_i, data in workload.chunks:
+        clock.now = arrival_timestamp
+        current_repetition[0] = repetition_i
+        
+        start_time = timer()
+        device_parsers[device_i](data)
+        durations.append(timer() - start_time)
+    
+    return measurement
+
+
+BENCHMARKS = [("serial_reads_1", benchmark_serial_reads(1)),
+              ("serial_reads_4096", benchmark_serial_reads(4096)),
+              ("data_logger", benchmark_data_logger(False)),
+              ("data_logger_flushing", benchmark_data_logger(True)),
+              ("data_logger_slow", benchmark_data_logger(False, slow_storage=True)),
+              ("data_logger_flushing_slow", benchmark_data_logger(True, slow_storage=True)),
+              ("framing_bytewise", benchmark_framing(MessageFrameParser)),
+              ("framing_buffered", benchmark_framing(BufferedMessageFrameParser)),
+              ("crc", benchmark_crc),
+              ("timestamps", benchmark_timestamps),
+              ("payload_decoding", benchmark_payload_decoding),
+              ("bulk_decoding", benchmark_bulk_decoding),
+              ("packet_handling", benchmark_packet_handling),
+              ("clock_mean", benchmark_clock_difference("mean")),
+              ("clock_minimum_delay", benchmark_clock_difference("minimum_delay")),
+              ("clock_median", benchmark_clock_difference("median")),
+              ("clock_linear_drift", benchmark_clock_difference("linear_drift")),
+              ("clock_mean_600", benchmark_clock_difference("mean", 600)),
+              ("clock_minimum_delay_600", benchmark_clock_difference("minimum_delay", 600)),
+              ("clock_median_600", benchmark_clock_difference("median", 600)),
+              ("clock_linear_drift_600", benchmark_clock_difference("linear_drift", 600)),
+              ("clock_mean_shared", benchmark_clock_difference("mean", share_between_keys=True)),
+              ("clock_minimum_delay_shared", benchmark_clock_difference("minimum_delay", share_between_keys=True)),
+              ("clock_median_shared", benchmark_clock_difference("median", share_between_keys=True)),
+              ("clock_linear_drift_shared", benchmark_clock_difference("linear_drift", share_between_keys=True)),
+              ("rr_analysis", benchmark_rr_analysis(False)),
+              ("rr_analysis_batch", benchmark_rr_analysis(True)),
+              ("rr_extraction", benchmark_rr_extraction),
+              ("collector", benchmark_collector),
+              ("signal_history", benchmark_signal_history(None, False)),
+              ("signal_history_10", benchmark_signal_history(10, False)),
+              ("signal_history_2", benchmark_signal_history(2, False)),
+              ("sample_cursor", benchmark_signal_history(None, True)),
+              ("sample_cursor_10", benchmark_signal_history(10, True)),
+              ("sample_cursor_2", benchmark_signal_history(2, True)),
+              ("metrics", benchmark_metrics),
+              ("hrv", benchmark_heart_rate_variability(False)),
+              ("hrv_recomputed", benchmark_heart_rate_variability(True)),
+              ("delayed_stream", benchmark_delayed_stream),
+              ("pipeline", benchmark_pipeline(False)),
+              ("pipeline_instrumented", benchmark_pipeline(True))]
+
+
+def run_benchmark(benchmark, workload, repeat_count):
+    """Run the benchmark repeat_count times and return the fastest
+    measurement"""
+    best_measurement = None
+    
+    for repeat_i in range(repeat_count):  #@UnusedVariable
+        gc.collect()
+        measurement = benchmark(workload)
+        
+        if best_measurement is None or measurement.seconds < best_measurement.seconds:
+            best_measurement = measurement
+    
+    return best_measurement
+
+
+def get_git_revision():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "HEAD"], cwd=os.path.dirname(os.path.abspath(__file__)),
+                                       stderr=open(os.devnull, "w")).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def get_environment():
+    return collections.OrderedDict([
+        ("git_revision", get_git_revision()),
+        ("python", sys.version.split()[0]),
+        ("numpy", zephyr.util.numpy.__version__ if zephyr.util.USE_NUMPY else None),
+        ("platform", platform.platform()),
+        ("machine", platform.machine())])
+
+
+def create_workloads(hours, device_count):
+    workloads = [Workload("bioharness", "120-second-bt-stream.dat"),
+                 Workload("hxm", "120-second-bt-stream-hxm.dat")]
+    
+    if hours > 0:
+        single_workload = workloads[0]
+        repetition_count = int(math.ceil(hours * 3600.0 / single_workload.repetition_seconds))
+        workloads.append(Workload("bioharness_%g_hours" % hours, "120-second-bt-stream.dat",
+                                  repetition_count=repetition_count))
+    
+    if device_count > 1:
+        workloads.append(Workload("bioharness_%d_devices" % device_count, "120-second-bt-stream.dat",
+                                  device_count=device_count))
+    
+    return workloads
+
+
+def format_rate(value):
+    return "%12.0f" % value if value is not None else "%12s" % "-"
+
+
+def compare_results(results, baseline_results):
+    """Print the change of the throughput and the 99th percentile latency of
+    each benchmark from the baseline"""
+    baseline = dict(((result["workload"], result["benchmark"]), result) for result in baseline_results)
+    
+    print
+    print "Compared to the baseline:"
+    
+    for result in results:
+        baseline_result = baseline.get((result["workload"], result["benchmark"]))
+        
+        if baseline_result is None or not baseline_result["items_per_second"] or not result["items_per_second"]:
+            continue
+        
+        throughput_change = result["items_per_second"] / baseline_result["items_per_second"] - 1.0
+        baseline_p99 = baseline_result["latency_microseconds"]["p99"]
+        p99_change = result["latency_microseconds"]["p99"] / baseline_p99 - 1.0 if baseline_p99 else 0.0
+        
+        print "  %-26s %-26s throughput %+7.1f %%, p99 latency %+7.1f %%" % (result["workload"], result["benchmark"],
+                                                                            throughput_change * 100.0,
+                                                                            p99_change * 100.0)
+
+
+def main():
+    argument_parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    argument_parser.add_argument("--output", help="write the results to this JSON file")
+    argument_parser.add_argument("--compare", help="compare the results to those of this JSON file")
+    argument_parser.add_argument("--hours", type=float, default=1.0,
+                                 help="length of the long synthetic workload, 0 to skip it (default 1)")
+    argument_parser.add_argument("--devices", type=int, default=4,
+                                 help="device count of the multi-device workload, 1 to skip it (default 4)")
+    argument_parser.add_argument("--repeat", type=int, default=3,
+                                 help="run each benchmark this many times and keep the fastest (default 3)")
+    argument_parser.add_argument("--without-numpy", action="store_true",
+                                 help="run the benchmarks with the pure-Python code paths even if NumPy is available")
+    argument_parser.add_argument("--benchmark", action="append", choices=[name for name, benchmark in BENCHMARKS],  #@UnusedVariable
+                                 help="run only the given benchmarks")
+    arguments = argument_parser.parse_args()
+    
+    if arguments.without_numpy:
+        zephyr.util.USE_NUMPY = False
+    
+    workloads = create_workloads(arguments.hours, arguments.devices)
+    results = []
+    
+    print "%-26s %-26s %12s %12s %10s %10s %10s" % ("workload", "benchmark", "items/s", "MB/s",
+                                                   "median us", "p99 us", "max us")
+    
+    for workload in workloads:
+        for benchmark_name, benchmark in BENCHMARKS:
+            if arguments.benchmark and benchmark_name not in arguments.benchmark:
+                continue
+            
+            measurement = run_benchmark(benchmark, workload, arguments.repeat)
+            
+            # The workload has nothing for the benchmark, e.g. no RR signal
+            if not measurement.durations:
+                continue
+            
+            result = measurement.get_result(workload.name, benchmark_name)
+            results.append(result)
+            
+            latencies = result["latency_microseconds"]
+            print "%-26s %-26s %s %s %10.1f %10.1f %10.1f" % (workload.name, benchmark_name,
+                                                              format_rate(result["items_per_second"]),
+                                                              format_rate(result["megabytes_per_second"]),
+                                                              latencies["median"], latencies["p99"], latencies["max"])
+            sys.stdout.flush()
+    
+    report = collections.OrderedDict([
+        ("environment", get_environment()),
+        ("parameters", collections.OrderedDict([("hours", arguments.hours), ("devices", arguments.devices),
+                                                ("repeat", arguments.repeat),
+                                                ("without_numpy", arguments.without_numpy)])),
+        ("results", results)])
+    
+    if arguments.output:
+        with open(arguments.output, "wb") as output_file:
+            json.dump(report, output_file, indent=2)
+    
+    if arguments.compare:
+        with open(arguments.compare, "rb") as baseline_file:
+            compare_results(results, json.load(baseline_file)["results"])
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,136 @@
+"""Stress test of reading many synthetic BioHarness and HxM devices in a
+single thread with zephyr.event_loop.ProtocolEventLoop. Prints the
+instrumentation report of the pipeline, e.g.:
+    
+    python stress_synthetic_devices.py --devices 50 --seconds 600 --speed 10
+    python stress_synthetic_devices.py --devices 10 --pty
+"""
+
+import os
+import time
+import fcntl
+import struct
+import termios
+import argparse
+
+from zephyr.bioharness import BioHarnessPacketHandler, BioHarnessSignalAnalysis
+from zephyr.collector import MeasurementCollector
+from zephyr.event_loop import ProtocolEventLoop, NonBlockingBioHarnessProtocol
+from zephyr.hxm import HxMPacketAnalysis
+from zephyr.instrumentation import PipelineInstrumentation, instrument, format_report
+from zephyr.message import MessagePayloadParser
+from zephyr.protocol import BufferedMessageFrameParser
+from zephyr.synthetic import create_synthetic_devices, SyntheticSerial, PseudoTerminalPort, HXM_MESSAGE_IDS
+from zephyr.testing import PipeSerial
+
+
+class PseudoTerminalConnection:
+    """Reads a PseudoTerminalPort by its name, like a serial port"""
+    def __init__(self, port):
+        self.port = port
+        self.fd = os.open(port.port_name, os.O_RDONLY | os.O_NOCTTY)
+    
+    def fileno(self):
+        return self.fd
+    
+    def open(self):
+        return None
+    
+    def close(self):
+        pass
+    
+    def inWaiting(self):
+        return struct.unpack("i", fcntl.ioctl(self.fd, termios.FIONREAD, "\0" * 4))[0]
+    
+    def read(self, byte_count):
+        return os.read(self.fd, byte_count)
+    
+    def write(self, data):
+        pass
+
+
+def create_device_pipeline(collector, instrumentation):
+    """Return the data callback of a device, which feeds the collector of the
+    device"""
+    rr_signal_analysis = BioHarnessSignalAnalysis([], [], [collector.handle_events])
+    
+    signal_packet_handler_bh = BioHarnessPacketHandler([collector.handle_signal, rr_signal_analysis.handle_signal],
+                                                       [collector.handle_event], instrumentation=instrumentation)
+    signal_packet_handler_hxm = HxMPacketAnalysis([collector.handle_event])
+    
+    payload_parser = MessagePayloadParser([signal_packet_handler_bh.handle_packet,
+                                           signal_packet_handler_hxm.handle_packet])
+    
+    message_parser = BufferedMessageFrameParser(instrument(instrumentation, "payload_parser",
+                                                           payload_parser.handle_message),
+                                                instrumentation)
+    return instrument(instrumentation, "frame_parser", message_parser.parse_data, len)
+
+
+def main():
+    argument_parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    argument_parser.add_argument("--devices", type=int, default=10, help="BioHarness device count (default 10)")
+    argument_parser.add_argument("--hxm-devices", type=int, default=0, help="HxM device count (default 0)")
+    argument_parser.add_argument("--seconds", type=float, default=60.0,
+                                 help="length of the measurement in device time (default 60)")
+    argument_parser.add_argument("--speed", type=float, default=None,
+                                 help="device time per second, as fast as possible if not given")
+    argument_parser.add_argument("--packet-loss", type=float, default=0.0, help="packet loss probability")
+    argument_parser.add_argument("--corruption", type=float, default=0.0, help="frame corruption probability")
+    argument_parser.add_argument("--pty", action="store_true", help="read the devices through pseudo-terminals")
+    arguments = argument_parser.parse_args()
+    
+    instrumentation = PipelineInstrumentation()
+    
+    start_time = time.time()
+    devices = (create_synthetic_devices(arguments.devices, start_time=start_time,
+                                        packet_loss_probability=arguments.packet_loss,
+                                        corruption_probability=arguments.corruption) +
+               create_synthetic_devices(arguments.hxm_devices, HXM_MESSAGE_IDS, start_time, seed=1,
+                                        packet_loss_probability=arguments.packet_loss,
+                                        corruption_probability=arguments.corruption))
+    
+    event_loop = ProtocolEventLoop()
+    connections = []
+    
+    for device in devices:
+        synthetic_serial = SyntheticSerial(device, arguments.seconds, arguments.speed)
+        
+        if arguments.pty:
+            connection = PseudoTerminalConnection(PseudoTerminalPort(synthetic_serial))
+        else:
+            connection = PipeSerial(synthetic_serial)
+        
+        connections.append(connection)
+        
+        collector = MeasurementCollector(history_length_seconds=arguments.seconds + 60.0)
+        protocol = NonBlockingBioHarnessProtocol(connection, [create_device_pipeline(collector, instrumentation)])
+        event_loop.add_protocol(protocol)
+    
+    if arguments.pty:
+        # A pseudo-terminal does not signal the end of data, so read until
+        # the writers have finished and the terminals are empty
+        event_loop.max_wait_seconds = 0.1
+        while (any(connection.port.writer_thread.is_alive() for connection in connections) or
+               any(connection.inWaiting() for connection in connections)):
+            event_loop.run_once()
+        
+        for connection in connections:
+            connection.port.close()
+    else:
+        event_loop.run()
+        
+        for connection in connections:
+            connection.close()
+    
+    duration = time.time() - start_time
+    
+    print format_report(instrumentation.get_report())
+    print "%d devices, %.0f s of device time in %.2f s" % (len(devices), arguments.seconds, duration)
+    print "%d frames generated, %d dropped and %d corrupted" % (sum(device.frame_count for device in devices),
+                                                                  sum(device.dropped_frame_count for device in devices),
+                                                                  sum(device.corrupted_frame_count for device in devices))
+
+
+if __name__ == "__main__":
+    main()